@@ -15,6 +15,13 @@
 
 #define PROCESS_VARIANCE 0.1
 
+// binary frame: FRAME_SYNC, seq, 6 x uint16 little endian, crc8 of seq + distances
+// sent instead of the ASCII line once the Pi writes MODE_BINARY, MODE_ASCII goes back
+#define FRAME_SYNC 0xA5
+#define FRAME_SIZE 15
+#define MODE_ASCII 'A'
+#define MODE_BINARY 'B'
+
 Ultrasonic sensor01(TRIG_PIN, ECHO_PIN_01);  // Initialize sensor.
 Ultrasonic sensor02(TRIG_PIN, ECHO_PIN_02);  // Initialize sensor.
 Ultrasonic sensor03(TRIG_PIN, ECHO_PIN_03);  // Initialize sensor.
@@ -34,6 +41,32 @@ KalmanFilter filter04(10, 10, PROCESS_VARIANCE);
 KalmanFilter filter05(10, 10, PROCESS_VARIANCE);
 KalmanFilter filter06(10, 10, PROCESS_VARIANCE);
 
+bool binary = false;
+uint8_t seq = 0;
+
+uint8_t crc8(const uint8_t *data, uint8_t len) { // CRC-8/SMBUS, poly 0x07
+  uint8_t crc = 0;
+  while (len--) {
+    crc ^= *data++;
+    for (uint8_t i = 0; i < 8; i++)
+      crc = (crc & 0x80) ? (crc << 1) ^ 0x07 : crc << 1;
+  }
+  return crc;
+}
+
+void sendBinary(const int *values) {
+  uint8_t frame[FRAME_SIZE];
+  frame[0] = FRAME_SYNC;
+  frame[1] = seq++;
+  for (uint8_t i = 0; i < 6; i++) {
+    uint16_t value = values[i] < 0 ? 0 : values[i];
+    frame[2 + 2*i] = value & 0xFF;
+    frame[3 + 2*i] = value >> 8;
+  }
+  frame[FRAME_SIZE - 1] = crc8(frame + 1, FRAME_SIZE - 2);
+  Serial.write(frame, FRAME_SIZE);
+}
+
 void setup () {
     Serial.begin(9600);  // Initialize serial communication
 }
@@ -51,6 +84,16 @@ void loop () {
   //int value04 = sensor04.measure();
   //int value05 = sensor05.measure();
   //int value06 = sensor06.measure();
+  while (Serial.available()) { // format requested by the Pi
+    char mode = Serial.read();
+    if (mode == MODE_BINARY) binary = true;
+    else if (mode == MODE_ASCII) binary = false;
+  }
+  if (binary) {
+    int values[6] = {value01, value02, value03, value04, value05, value06};
+    sendBinary(values);
+    return;
+  }
   Serial.print(value01); Serial.print(" "); 
   Serial.print(value02); Serial.print(" "); 
   Serial.print(value03); Serial.print(" "); 
@@ -12,7 +12,7 @@ from flask import render_template, flash, redirect, url_for, request, Response,
 from flask_login import current_user, login_user, login_required, logout_user
 from app import control_app, db
 from app.control.forms import LoginForm
-from app.models import User
+from app.models import User, remember_user, forget_user
 from datetime import timedelta
 import subprocess as sp
 
@@ -64,6 +64,7 @@ def login():
             flash('Invalid username or password')
             return redirect(url_for('login')) # , duration = timedelta(seconds=5)
         login_user(user, remember = False) # only login 1 time - no remember
+        remember_user(user) # the next requests load it from memory, see models.load_user()
         return redirect(url_for('index'))
 
     templateData = {
@@ -82,5 +83,6 @@ def about():
 @control_app.route('/logout')
 @login_required
 def logout():
+    forget_user()
     logout_user()
     return redirect(url_for('login'))
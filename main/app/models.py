@@ -7,12 +7,37 @@
  --------------------------------------------------------------
  * Defines database columns and tables
  *
+ * The logged in user is loaded from memory, SQLite is only read
+ * at login:
+ * - login stores a SESSION_KEY payload in the session cookie,
+ *   signed with SECRET_KEY by Flask: id, username and the user
+ *   generation it was made at
+ * - load_user() takes the user from the cache, else from that
+ *   payload, if both are of the current generation. Entries
+ *   live USER_TTL at most
+ * - server_admin-init.py bumps the generation by touching
+ *   GENERATION_FILE when it changes the users: every cached
+ *   user and every session made before is checked against the
+ *   database again, then cached for USER_TTL. Only login writes
+ *   the session, load_user() also runs in socket.io handlers,
+ *   where a session write is not kept
+ * The generation is the mtime of GENERATION_FILE, checked at
+ * most every GENERATION_CHECK, on tmpfs.
+ *
  --------------------------------------------------------------"""
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
 from hashlib import md5
-from app import db, login
+from app import db, login, LOGGING_DIR
+from flask import session
 from datetime import datetime, timezone
+import os
+import time
+
+USER_TTL = 300 # secs a user is served from the cache, or from a session payload, before it is read again
+GENERATION_FILE = LOGGING_DIR + '/users.generation' # touched by server_admin-init.py, tmpfs as the root is read-only
+GENERATION_CHECK = 1 # secs between two checks of the generation file
+SESSION_KEY = 'user' # signed session payload: [id, username, generation]
 
 class User(UserMixin, db.Model):
   id = db.Column(db.Integer, primary_key=True)
@@ -29,6 +54,106 @@ class User(UserMixin, db.Model):
     return '<User {} - {}>'.format(self.id, self.username)
 
 
+class SessionUser(UserMixin):
+  """
+  The logged in user as the request path needs it, without the database.
+
+  """
+  def __init__(self, id, username):
+    self.id = id
+    self.username = username
+
+  def __repr__(self):
+    return '<SessionUser {} - {}>'.format(self.id, self.username)
+
+
+class UserCache(object):
+  """
+  A python written cache of the logged in users, with a TTL and a generation.
+
+  """
+  def __init__(self, path=GENERATION_FILE, ttl=USER_TTL, check=GENERATION_CHECK, clock=time.monotonic):
+    """
+    Constructor
+    @param path: a string, the generation file
+    @param ttl: a float, secs an entry is served before it is read again
+    @param check: a float, secs between two checks of the generation file
+    @param clock: a callable returning monotonic time in secs
+    """
+    self.path = path
+    self.ttl = ttl
+    self.check = check
+    self.clock = clock
+    self.users = {} # id --> (SessionUser, time it runs out)
+    self.hits = 0
+    self.misses = 0 # users read from the database
+    self.__generation = None
+    self.__checked = float('-inf')
+
+  def generation(self): # changes every time server_admin-init.py changes the users
+    now = self.clock()
+    if now - self.__checked >= self.check:
+      self.__checked = now
+      try:
+        generation = os.stat(self.path).st_mtime_ns
+      except OSError: # never bumped since boot
+        generation = 0
+      if generation != self.__generation:
+        self.__generation = generation
+        self.users.clear()
+    return self.__generation
+
+  def get(self, id): # the cached user, None if unknown or run out
+    self.generation()
+    entry = self.users.get(id)
+    if entry is None or self.clock() > entry[1]:
+      self.users.pop(id, None)
+      return None
+    self.hits += 1
+    return entry[0]
+
+  def put(self, user):
+    user = SessionUser(user.id, user.username)
+    self.users[user.id] = (user, self.clock() + self.ttl)
+    return user
+
+  def forget(self, id):
+    self.users.pop(id, None)
+
+  def invalidate(self): # from the process changing the users: every other process reads them again
+    directory = os.path.dirname(self.path)
+    if directory and not os.path.exists(directory):
+      os.makedirs(directory)
+    with open(self.path, 'a'):
+      os.utime(self.path, None)
+    self.users.clear()
+
+users = UserCache()
+
+
+def remember_user(user): # at login: the signed session payload, the user in the cache
+    session[SESSION_KEY] = [user.id, user.username, users.generation()]
+    return users.put(user)
+
+
+def forget_user(): # at logout
+    payload = session.pop(SESSION_KEY, None)
+    if payload:
+        users.forget(payload[0])
+
+
 @login.user_loader
 def load_user(id):
-    return User.query.get(int(id))
+    id = int(id)
+    user = users.get(id)
+    if user is not None:
+        return user
+    payload = session.get(SESSION_KEY)
+    if payload and payload[0] == id and payload[2] == users.generation(): # signed, nothing changed since
+        users.hits += 1
+        return users.put(SessionUser(id, payload[1]))
+    users.misses += 1
+    user = User.query.get(id) # made before a change of the users: is it still there?
+    if user is None:
+        return None
+    return users.put(user) # the session is left as is: a socket.io handler can't save it, the cache covers USER_TTL
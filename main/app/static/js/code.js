@@ -4,6 +4,21 @@ document.addEventListener("keydown", keyIsPressing, false);
 document.addEventListener("keyup", keyReleased, false);
 
 const K_SIGNAL = 0, K_ID = 1;
+const HEARTBEAT_MS = 250; // held keys are resent this often, the server releases them after 750 ms without news
+// bit of each key in the held keys bitmap, as ipc.KEYS on the robot
+const KEY_BITS = {'UP': 1, 'DO': 2, 'LE': 4, 'RI': 8, 'LU': 16, 'LD': 32, 'RU': 64, 'RD': 128};
+// limit switch bits, as limits.L_UP... on the robot
+const LIMIT_BITS = {'L UP': 1, 'L DOWN': 2, 'R UP': 4, 'R DOWN': 8};
+// how a telemetry field is shown, the others are shown as they come
+const TELEMETRY_FORMAT = {
+    'light': (v) => v ? 'ON' : 'OFF',
+    'degraded': (v) => v ? 'DEGRADED' : 'OK',
+    'estop': (v) => v ? 'STOPPED - release every key' : 'OK',
+    'limits': (v) => Object.keys(LIMIT_BITS).filter((name) => v & LIMIT_BITS[name]).join(', ') || 'none',
+    'tick_100us': (v) => (v / 10).toFixed(1),
+    'jitter_100us': (v) => (v / 10).toFixed(1),
+};
+['d0', 'd1', 'd2', 'd3', 'd4', 'd5'].forEach((name) => TELEMETRY_FORMAT[name] = (v) => v < 0 ? '--' : v);
 
 const keyMap = {
     87: ['UP', 'w', false],                          // W - UP
@@ -22,10 +37,15 @@ var socket = io();
 lastTime = new Date().getTime();
 lightOn = 'OF'; //OFF
 lightPressedTime = 0;
+heldKeys = 0; // bitmap of the keys held down, sent on every change
+telemetry = {}; // robot state, the server only sends the fields that changed
+window.addEventListener("blur", releaseAll, false); // no keyup comes once the page lost the focus
+setInterval(() => { if (heldKeys) sendKeys(); }, HEARTBEAT_MS);
 
 // ----------------------- client signal listener --------------------------
 socket.on('connect', () => {
     console.log("Server connected");
+    if (heldKeys) sendKeys();
 });
 
 socket.on('light', (status) => {
@@ -58,10 +78,57 @@ socket.on('speed', (status) => {
     speedToggler.classList.remove("pressed");
 });
 
+socket.on('telemetry', (changes) => {
+    for (var name in changes) {
+        telemetry[name] = changes[name];
+        var cell = document.getElementById("t-" + name);
+        if (cell) {
+            cell.textContent = TELEMETRY_FORMAT[name] ? TELEMETRY_FORMAT[name](changes[name]) : changes[name];
+        }
+    }
+});
+
 // ----------------------- client signal emitter ----------------------------
+function sendKeys() {
+    socket.emit('keys', heldKeys);
+}
+
+function releaseAll() {
+    if (heldKeys) {
+        heldKeys = 0;
+        sendKeys();
+        for (var code in keyMap) {
+            if (KEY_BITS[keyMap[code][K_SIGNAL]])
+                document.getElementById(keyMap[code][K_ID]).classList.remove("pressed");
+        }
+    }
+}
+
+function emergencyStop() { // from anyone, the robot stops until every key is released
+    releaseAll();
+    socket.emit('estop');
+    console.log("emergency stop");
+}
+
 function keyIsPressing(e) {
+    if (e.keyCode === 27) { // Escape - EMERGENCY STOP
+        emergencyStop();
+        return;
+    }
     var pressedKey = keyMap[e.keyCode];
     if (pressedKey) {
+        // ----------------------- held keys, sent on change only ---------------------
+        var bit = KEY_BITS[pressedKey[K_SIGNAL]];
+        if (bit) {
+            if (!(heldKeys & bit)) { // not an auto repeat
+                heldKeys |= bit;
+                sendKeys();
+                document.getElementById(pressedKey[K_ID]).classList.add("pressed");
+                console.log(pressedKey[K_ID]);
+            }
+            return;
+        }
+
         var curTime = new Date().getTime();
 
         if (curTime - lastTime < 40) // ms
@@ -84,8 +151,6 @@ function keyIsPressing(e) {
         // ----------------------- toggle speed function ------------------------
         if (pressedKey[K_SIGNAL] === 'SP') { //SPEED
             socket.emit('speed');
-        } else {
-            socket.emit('pressed', pressedKey[K_SIGNAL]);
         }
         
         document.getElementById(pressedKey[K_ID]).classList.add("pressed");
@@ -100,6 +165,11 @@ function keyReleased(e) {
         if (releasedKey[K_SIGNAL] === 'TG') { //TOGGLE
             lightPressedTime = 0;
         }
+        var bit = KEY_BITS[releasedKey[K_SIGNAL]];
+        if (bit && (heldKeys & bit)) {
+            heldKeys &= ~bit;
+            sendKeys();
+        }
         document.getElementById(releasedKey[K_ID]).classList.remove("pressed");
         console.log(releasedKey[K_ID] + " released");
     }
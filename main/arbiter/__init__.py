@@ -0,0 +1,8 @@
+"""------------------------------------------------------------*-
+  Init module for the input arbiter
+ --------------------------------------------------------------
+ * Gives the control of the robot to one input at a time, the
+ * PS2 controller or one web client, with a lease.
+ *
+ --------------------------------------------------------------"""
+from arbiter.arbiter import Arbiter, PS2, NOBODY
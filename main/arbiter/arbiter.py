@@ -0,0 +1,116 @@
+"""------------------------------------------------------------*-
+  Input arbiter for UV Robot
+ --------------------------------------------------------------
+ * The PS2 controller and every web client can drive, but only
+ * the holder of the control lease reaches the motor path. Once
+ * per control tick, before anything acts on the inputs:
+ * - the PS2 controller takes the lease as soon as it is used,
+ *   from anyone, and keeps it PS2_LEASE after its last input
+ * - a web client takes the lease when nobody holds it, and
+ *   keeps it while it holds keys, then WEB_LEASE after it
+ *   released them. Other clients wait for the lease to run out,
+ *   the newest one to press gets it
+ * - an emergency stop, from the PS2 or any web client, calls
+ *   on_estop() at once and drops the lease. Nobody gets it back
+ *   until every input is released.
+ *
+ * The holder is PS2, NOBODY or the id of the web client.
+ *
+ --------------------------------------------------------------"""
+import time
+
+PS2 = -1 # lease holders, a web client is its id in the control frames
+NOBODY = 0
+PS2_LEASE = 0.5 # secs the PS2 controller keeps the lease after its last input
+WEB_LEASE = 1.0 # secs a web client keeps the lease after it released its keys
+
+
+class Arbiter(object):
+    """
+    A python written arbiter of the control lease.
+
+    """
+    def __init__(self, on_estop=None, clock=time.monotonic, ps2_lease=PS2_LEASE, web_lease=WEB_LEASE):
+        """
+        Constructor
+        @param on_estop: a callable without argument, stops the robot, called once per emergency stop
+        @param clock: a callable returning monotonic time in secs
+        @param ps2_lease: a float, secs the PS2 controller keeps the lease after its last input
+        @param web_lease: a float, secs a web client keeps the lease after it released its keys
+        """
+        self.on_estop = on_estop
+        self.clock = clock
+        self.ps2_lease = ps2_lease
+        self.web_lease = web_lease
+        self.holder = NOBODY
+        self.until = 0.0 # the lease runs out then, if its holder stays idle
+        self.estopped = False # stopped until every input is released
+        self.estops = 0
+        self.handovers = 0 # times the lease went to another holder
+
+    def __give(self, holder, until):
+        if holder != self.holder and holder != NOBODY:
+            self.handovers += 1
+        self.holder = holder
+        self.until = until
+
+    def update(self, ps2_active, web, estop=False):
+        """
+        Pick the holder of the lease, call once per control tick
+        @param ps2_active: True if any PS2 button is pressed or the stick is out of its deadzone
+        @param web: a dict web client id --> time its keys changed, of the clients holding keys
+        @param estop: True if an emergency stop was asked since the last update
+        @return the holder
+        """
+        now = self.clock()
+        if estop and not self.estopped: # asked again while stopped: nothing more to do
+            self.estops += 1
+            self.estopped = True
+            self.holder = NOBODY
+            if self.on_estop is not None:
+                self.on_estop()
+        if self.estopped:
+            if ps2_active or web: # a key still held must not drive again
+                return NOBODY
+            self.estopped = False
+        if ps2_active: # the PS2 controller overrides the web
+            self.__give(PS2, now + self.ps2_lease)
+        elif self.holder != NOBODY and self.holder in web: # still holding keys
+            self.until = now + self.web_lease
+        elif self.holder != NOBODY and now < self.until: # released, the lease runs out
+            pass
+        elif web: # free: to the newest client to press
+            self.__give(max(web, key=web.get), now + self.web_lease)
+        else:
+            self.holder = NOBODY
+        return self.holder
+
+
+if __name__ == '__main__': # the priority rules, on a fake clock
+    class FakeClock(object):
+        def __init__(self):
+            self.now = 0.0
+        def __call__(self):
+            return self.now
+
+    clock = FakeClock()
+    stops = []
+    arbiter = Arbiter(lambda: stops.append(clock.now), clock)
+    assert arbiter.update(False, {}) == NOBODY
+    assert arbiter.update(False, {1: 0.0, 2: 0.1}) == 2, 'newest press'
+    clock.now = 0.5
+    assert arbiter.update(False, {1: 0.0, 2: 0.1}) == 2, 'kept while held'
+    assert arbiter.update(True, {2: 0.1}) == PS2, 'the PS2 overrides'
+    clock.now = 0.8
+    assert arbiter.update(False, {2: 0.1}) == PS2, 'the PS2 keeps its lease'
+    clock.now = 1.1
+    assert arbiter.update(False, {2: 0.1}) == 2, 'back to the web'
+    clock.now = 1.2
+    assert arbiter.update(False, {1: 1.15}) == 2, 'released, still leased'
+    clock.now = 2.3
+    assert arbiter.update(False, {1: 1.15}) == 1, 'handover after the lease'
+    assert arbiter.update(False, {1: 1.15}, estop=True) == NOBODY and stops == [2.3], 'emergency stop'
+    assert arbiter.update(True, {}, estop=True) == NOBODY and arbiter.estops == 1, 'stopped until released'
+    assert arbiter.update(False, {}) == NOBODY and not arbiter.estopped
+    assert arbiter.update(True, {}) == PS2
+    print('Arbiter OK: %d handovers, %d emergency stops' % (arbiter.handovers, arbiter.estops))
@@ -0,0 +1,7 @@
+"""------------------------------------------------------------*-
+  Init module for the benchmarks of UV Robot
+ --------------------------------------------------------------
+ * Benchmarks of the control stack, run on the sim backend.
+ *
+ --------------------------------------------------------------"""
+from bench.latency import SCENARIOS, run, analyse
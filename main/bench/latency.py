@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""------------------------------------------------------------*-
+  Input to motor UART latency benchmark for UV Robot
+ --------------------------------------------------------------
+ * Runs the real main.py on the sim backend (see hal) once per
+ * scenario. The scripted PS2 controller and control server
+ * trace the monotonic time each input step starts, the emulated
+ * MSD_EM driver traces the time each command's bytes reach it.
+ *
+ * An input step with 'expect' is matched with the first command
+ * on one of those channels after it that reacts to it: a press
+ * makes a pwm grow away from 0, a release makes it shrink toward
+ * 0. A ramp still going on, or a refresh frame resending the same
+ * value, doesn't count. The latency is the time between the two,
+ * the step is missed if nothing reacts before the next input step.
+ *
+ * Web keys are sent on press and on release, as code.js does,
+ * so both edges have the same path to the main process.
+ *
+ * From main/:
+ *      python3 bench/latency.py -o before.json
+ *      python3 bench/latency.py -o after.json --compare before.json
+ *
+ --------------------------------------------------------------"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import signal
+import subprocess as sp
+import sys
+import time
+
+MAIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRACE_DIR = '/tmp/MIS_logs/bench' # read-only root on the robot
+WARMUP = 4 # secs - main.py starting, peripherals found, loop running
+TAIL = 1 # secs - after the last step, for its commands to come out
+EXIT_TIMEOUT = 10 # secs - for main.py to clean up after SIGINT
+CYCLES = 20 # press and release cycles per scenario
+DRIVE = (1, 2) # motor channels of the wheels
+LHAND = (3,)
+RHAND = (4,)
+
+
+def _cycles(press, release, expect, source):
+    """
+    Steps of a scenario repeating CYCLES press and release
+    @param press: a list of (secs, input) pressed one after the other, input in the format of source
+    @param release: a float in secs, idle time after each press
+    @param expect: a tuple of the motor channels reacting to press and release
+    @param source: 'ps2' or 'web'
+    """
+    idle = {'buttons': []} if source == 'ps2' else {}
+    steps = [dict(idle, secs=WARMUP)]
+    for _ in range(CYCLES):
+        for secs, held in press:
+            steps.append(dict(held, secs=secs, expect=expect, edge='press'))
+            steps.append(dict(idle, secs=release, expect=expect, edge='release'))
+    return steps
+
+SCENARIOS = {
+    'ps2_drive': {'source': 'ps2', # forward then backward, so the robot stays in the room
+                  'steps': _cycles([(0.5, {'buttons': ['UP']}), (0.5, {'buttons': ['DOWN']})], 0.7, DRIVE, 'ps2')},
+    'ps2_stick': {'source': 'ps2',
+                  'steps': _cycles([(0.5, {'buttons': [], 'ly': 0}), (0.5, {'buttons': [], 'ly': 255})], 0.7, DRIVE, 'ps2')},
+    'ps2_hands': {'source': 'ps2',
+                  'steps': _cycles([(0.3, {'buttons': ['L1']}), (0.3, {'buttons': ['R1']})], 0.3, LHAND + RHAND, 'ps2')},
+    'web_drive': {'source': 'web',
+                  'steps': _cycles([(0.5, {'key': 'UP'}), (0.5, {'key': 'DO'})], 0.7, DRIVE, 'web')},
+    'web_hands': {'source': 'web',
+                  'steps': _cycles([(0.3, {'key': 'LU'}), (0.3, {'key': 'RU'})], 0.3, LHAND + RHAND, 'web')},
+}
+
+
+def _percentile(values, fraction): # values sorted
+    if not values:
+        return None
+    return values[min(int(fraction*len(values)), len(values) - 1)]
+
+
+def _distribution(latencies): # in ms
+    values = sorted(latency*1000 for latency in latencies)
+    if not values:
+        return {'count': 0}
+    return {'count': len(values),
+            'min': round(values[0], 3),
+            'p50': round(_percentile(values, 0.5), 3),
+            'p90': round(_percentile(values, 0.9), 3),
+            'p99': round(_percentile(values, 0.99), 3),
+            'max': round(values[-1], 3),
+            'mean': round(sum(values)/len(values), 3)}
+
+
+def _read_trace(path, parse):
+    if not os.path.exists(path):
+        return []
+    with open(path) as file:
+        return [parse(line.split()) for line in file if line.strip()]
+
+
+def analyse(trace, steps, source):
+    """
+    Match the input steps with the motor commands of a trace directory
+    @param trace: a string, the UVROBOT_SIM_TRACE directory of the run
+    @param steps: the steps of the scenario, with their expect channels and edge
+    @param source: 'ps2' or 'web', the input traced for the steps
+    @return a dict of the results
+    """
+    inputs = _read_trace(os.path.join(trace, source + '.log'), lambda f: (float(f[0]), int(f[1])))
+    commands = _read_trace(os.path.join(trace, 'motor.log'), lambda f: (float(f[0]), int(f[1]), f[2], int(f[3])))
+
+    changes = [] # (secs, channel, grew), only when the value of the channel changed
+    values = [0] * 5
+    per_channel = [0] * 5
+    for secs, channel, kind, value in commands:
+        per_channel[channel] += 1
+        if kind != 'P':
+            continue
+        for c in (range(1, 5) if channel == 0 else (channel,)):
+            if values[c] != value:
+                changes.append((secs, c, abs(value) > abs(values[c])))
+                values[c] = value
+
+    latencies = {'press': [], 'release': []}
+    missed = 0
+    first = 0
+    for i, (secs, index) in enumerate(inputs):
+        expect = steps[index].get('expect')
+        if not expect:
+            continue
+        limit = inputs[i + 1][0] if i + 1 < len(inputs) else float('inf')
+        while first < len(changes) and changes[first][0] < secs:
+            first += 1
+        edge = steps[index].get('edge', 'press')
+        for when, channel, grew in changes[first:]:
+            if when >= limit:
+                missed += 1
+                break
+            if channel in expect and grew == (edge == 'press'):
+                latencies[edge].append(when - secs)
+                break
+        else:
+            missed += 1
+
+    duration = (commands[-1][0] - commands[0][0]) if len(commands) > 1 else 0.0
+    matched = latencies['press'] + latencies['release']
+    return {'events': len(matched) + missed,
+            'missed': missed,
+            'latency_ms': _distribution(matched),
+            'press_ms': _distribution(latencies['press']),
+            'release_ms': _distribution(latencies['release']),
+            'commands': len(commands),
+            'commands_per_channel': per_channel,
+            'commands_per_sec': round(len(commands)/duration, 1) if duration else None}
+
+
+def run(name, scenario, trace_root=TRACE_DIR, python=sys.executable):
+    """
+    Run main.py on the sim backend through one scenario
+    @param name: a string, the scenario name
+    @param scenario: a dict with 'source' ('ps2' or 'web') and 'steps'
+    @return a dict of the results, see analyse()
+    """
+    trace = os.path.join(trace_root, name)
+    shutil.rmtree(trace, ignore_errors=True)
+    os.makedirs(trace)
+    script = os.path.join(trace, 'script.json')
+    with open(script, 'w') as file:
+        json.dump({'loop': False, 'steps': scenario['steps']}, file)
+    idle = os.path.join(trace, 'idle.json') # the other source holds still
+    with open(idle, 'w') as file:
+        json.dump({'loop': False, 'steps': [{'secs': 0, 'buttons': []}]}, file)
+
+    env = dict(os.environ, UVROBOT_BACKEND='sim', UVROBOT_SIM_TRACE=trace, UVROBOT_CAMERA_PORT='0')
+    env['UVROBOT_PS2_SCRIPT'] = script if scenario['source'] == 'ps2' else idle
+    if scenario['source'] == 'web':
+        env['UVROBOT_WEB_SCRIPT'] = script
+    else:
+        env.pop('UVROBOT_WEB_SCRIPT', None)
+
+    secs = sum(step['secs'] for step in scenario['steps']) + TAIL
+    with open(os.path.join(trace, 'main.log'), 'w') as log:
+        process = sp.Popen([python, 'main.py'], cwd=MAIN_DIR, env=env, stdout=log, stderr=sp.STDOUT,
+                           start_new_session=True) # its own process group, nothing left behind
+        try:
+            time.sleep(secs)
+            if process.poll() is not None:
+                print('%s: main.py exited early, see %s' % (name, log.name))
+        finally:
+            process.send_signal(signal.SIGINT) # the normal way out of main.py
+            try:
+                process.wait(EXIT_TIMEOUT)
+            except sp.TimeoutExpired:
+                print('%s: main.py did not exit, killed' % name)
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+    results = analyse(trace, scenario['steps'], scenario['source'])
+    results['duration'] = secs
+    return results
+
+
+def _version(): # of the tree being measured
+    try:
+        return sp.check_output(['git', 'describe', '--always', '--dirty'], cwd=MAIN_DIR,
+                               stderr=sp.DEVNULL).decode('utf-8').strip()
+    except (OSError, sp.CalledProcessError):
+        return 'unknown'
+
+
+def compare(old, new): # print the latency change of every scenario found in both
+    print('%-12s %10s %10s %10s %10s' % ('scenario', 'p50 was', 'p50 now', 'p99 was', 'p99 now'))
+    for name, result in new['scenarios'].items():
+        before = old['scenarios'].get(name)
+        if before is None:
+            continue
+        a = before['latency_ms']
+        b = result['latency_ms']
+        print('%-12s %10s %10s %10s %10s' % (name, a.get('p50'), b.get('p50'), a.get('p99'), b.get('p99')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Input to motor UART latency of main.py, on the sim backend')
+    parser.add_argument('-o', '--output', help='JSON file of the results, default in ' + TRACE_DIR)
+    parser.add_argument('-s', '--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='scenario to run, can be repeated, all of them by default')
+    parser.add_argument('--compare', help='JSON file of an older run, to print the differences')
+    args = parser.parse_args()
+
+    report = {'version': _version(),
+              'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'python': platform.python_version(),
+              'machine': platform.machine(),
+              'scenarios': {}}
+    for name in args.scenario or sorted(SCENARIOS):
+        print('%s...' % name, flush=True)
+        result = report['scenarios'][name] = run(name, SCENARIOS[name])
+        latency = result['latency_ms']
+        print('  %d events, %d missed, p50 %sms, p99 %sms, max %sms (press p50 %sms, release p50 %sms), %d commands' %
+              (result['events'], result['missed'], latency.get('p50'), latency.get('p99'), latency.get('max'),
+               result['press_ms'].get('p50'), result['release_ms'].get('p50'), result['commands']))
+
+    output = args.output or os.path.join(TRACE_DIR, 'latency-%s.json' % report['version'])
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print('Results in', output)
+    if args.compare:
+        with open(args.compare) as file:
+            compare(json.load(file), report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""------------------------------------------------------------*-
+  Motion equivalence check of MotorUART_PWM for UV Robot
+ --------------------------------------------------------------
+ * Runs traces of move_fw / move_bw / turn_left / turn_right /
+ * release calls through two versions of usb_peripherals/motor.py:
+ * the one in the tree and the one of a git revision. Every frame
+ * queued to the writer and every (pwm_1, pwm_2) state, types
+ * included, must be the same.
+ *
+ * A change to MOTION_TABLE or to its rules is checked against
+ * the last commit with, from main/:
+ *      python3 bench/motion.py
+ *      python3 bench/motion.py --base de1f19e~1 --random 2000
+ * the second line checks the table against the nested branches
+ * it replaced.
+ *
+ * The traces are in motion_traces.json, a step is one call:
+ *      F<accel> move_fw, B<accel> move_bw, S release,
+ *      R<accel>+ / R<accel>- turn_right forward / backward,
+ *      L<accel>+ / L<accel>- turn_left
+ * each trace starts from its own (pwm_1, pwm_2) and MAX_PWM. An
+ * accel with a dot is a float, as the callers may give.
+ *
+ * No serial port is opened: the writer is bypassed and the
+ * periodic refresh turned off, so only the motions write.
+ *
+ --------------------------------------------------------------"""
+import argparse
+import importlib.util
+import json
+import os
+import random
+import subprocess as sp
+import sys
+import tempfile
+
+MAIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, MAIN_DIR)
+import serial
+
+MOTOR_FILE = 'main/usb_peripherals/motor.py' # in the git tree
+TRACE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'motion_traces.json')
+TICK = 10 # ms between two calls, as the control loop
+ACCELS = ('15.0', '30', '60') # as the stick and the arrows give them
+START_PWMS = (0, 15.0, 60, 90, -90, 105.0, 120, -120, 150, -165.0, 200, 230, -230, 400, 420, -600, 630, 0.0)
+MAX_PWMS = (200, 400, 600)
+
+
+class NullSerial(object):
+    """
+    A python written stand-in of serial.Serial, nothing is written.
+
+    """
+    def __init__(self, *args, **kwargs):
+        self.is_open = False
+
+    def isOpen(self):
+        return self.is_open
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    def write(self, data):
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def load(name, path): # a version of motor.py as its own module
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.REFRESH_TIME = float('inf') # only the motions write
+    module.MotorUART_PWM.clean = lambda self: None
+    return module
+
+
+def run(module, clock, trace):
+    """
+    One trace through one version
+    @return (frames queued, [(pwm_1, pwm_2, their types)] after each step)
+    """
+    clock[0] = 0
+    module.millis = lambda: clock[0]
+    motor = module.MotorUART_PWM('/dev/null')
+    motor.MAX_PWM = trace['max_pwm']
+    motor.pwm_1, motor.pwm_2 = trace['init']
+    frames = []
+    motor.writer.put = frames.append
+    states = []
+    for step in trace['steps'].split():
+        clock[0] += TICK
+        command = step[0]
+        accel = float(step[1:].rstrip('+-')) if '.' in step else int(step[1:].rstrip('+-') or 0)
+        direction = step.endswith('+')
+        if command == 'F':
+            motor.move_fw(accel)
+        elif command == 'B':
+            motor.move_bw(accel)
+        elif command == 'R':
+            motor.turn_right(direction, accel)
+        elif command == 'L':
+            motor.turn_left(direction, accel)
+        else:
+            motor.release()
+        motor.flush()
+        states.append((motor.pwm_1, motor.pwm_2, type(motor.pwm_1).__name__, type(motor.pwm_2).__name__))
+    motor.writer.stop()
+    return frames, states
+
+
+def random_trace(rng): # moves and turns mostly, some releases, from an edge case start state
+    steps = []
+    for _ in range(rng.randint(1, 100)):
+        command = rng.choice('FFBBRLRLS')
+        if command == 'S':
+            steps.append('S')
+        elif command in 'RL':
+            steps.append(command + rng.choice(ACCELS) + rng.choice('+-'))
+        else:
+            steps.append(command + rng.choice(ACCELS))
+    init = [rng.choice(START_PWMS), rng.choice(START_PWMS)]
+    if rng.random() < 0.2: # same speed, opposite directions
+        init[1] = -init[0]
+    return {'max_pwm': rng.choice(MAX_PWMS), 'init': init, 'steps': ' '.join(steps)}
+
+
+def compare(base, tree, clock, traces):
+    """
+    @return (number of frames compared, None or a description of the first difference)
+    """
+    frames = 0
+    for index, trace in enumerate(traces):
+        a = run(base, clock, trace)
+        b = run(tree, clock, trace)
+        frames += len(a[0])
+        if a != b:
+            steps = trace['steps'].split()
+            for i, (x, y) in enumerate(zip(a[1], b[1])):
+                if x != y:
+                    return frames, ('trace #%d (max_pwm %d, from %s), step %d %s: base %s, tree %s' %
+                                    (index, trace['max_pwm'], trace['init'], i, steps[i], x, y))
+            return frames, 'trace #%d: different frames %s / %s' % (index, a[0], b[0])
+    return frames, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check two versions of motor.py give the same commands')
+    parser.add_argument('--base', default='HEAD', help='git revision of the version to compare with (default HEAD)')
+    parser.add_argument('--random', type=int, default=0, help='number of random traces run after the recorded ones')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--generate', type=int, help='write that many random traces to the trace file and exit')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    if args.generate:
+        with open(TRACE_FILE, 'w') as file:
+            json.dump({'seed': args.seed, 'traces': [random_trace(rng) for _ in range(args.generate)]}, file, indent=0)
+        print('%d traces written to %s' % (args.generate, TRACE_FILE))
+        return
+
+    with open(TRACE_FILE) as file:
+        traces = json.load(file)['traces']
+    traces += [random_trace(rng) for _ in range(args.random)]
+    source = sp.check_output(['git', 'show', '%s:%s' % (args.base, MOTOR_FILE)], cwd=MAIN_DIR)
+    serial.Serial = NullSerial
+    clock = [0]
+    with tempfile.NamedTemporaryFile(suffix='.py') as file:
+        file.write(source)
+        file.flush()
+        base = load('motor_base', file.name)
+    tree = load('motor_tree', os.path.join(MAIN_DIR, 'usb_peripherals', 'motor.py'))
+    frames, difference = compare(base, tree, clock, traces)
+    if difference is not None:
+        print('Different from %s: %s' % (args.base, difference))
+        sys.exit(1)
+    print('Same as %s: %d traces, %d frames' % (args.base, len(traces), frames))
+
+
+if __name__ == '__main__':
+    main()
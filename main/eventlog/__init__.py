@@ -0,0 +1,12 @@
+"""------------------------------------------------------------*-
+  Init module for the non-blocking event log
+ --------------------------------------------------------------
+ * Shared event log, so the control loop never writes to stdout
+ * itself: records go to a ring, a thread formats them.
+ *
+ * Dump the ring with: sudo kill -USR2 <pid of main.py>
+ *
+ --------------------------------------------------------------"""
+from eventlog.eventlog import EventLog
+
+events = EventLog()
@@ -0,0 +1,282 @@
+"""------------------------------------------------------------*-
+  Non-blocking event log module for UV Robot
+ --------------------------------------------------------------
+ * Replaces print() in the control loop: under systemd or a slow
+ * terminal a print is a blocking write in the 100Hz loop.
+ *
+ * - Events are declared once with event(), with their text and a
+ *   rate limit, and logged with log(event, a, b): two integers,
+ *   no string is built in the loop.
+ * - log() packs a fixed-size record (event id, monotonic time,
+ *   a, b) into a preallocated ring. Past its rate (token bucket
+ *   per event) a record is only counted as suppressed.
+ * - A formatter thread turns the new records into text every
+ *   FLUSH_PERIOD, echoes them to stdout and appends them to
+ *   EVENT_FILE, rotated at MAX_BYTES. Records overwritten before
+ *   it got to them are counted as lost.
+ * - dump() writes the whole ring to CRASH_FILE, e.g. from the
+ *   exception handler of main.py or with:
+ *      sudo kill -USR2 <pid of main.py>
+ *
+ * Everything goes to /tmp/MIS_logs (tmpfs, the root filesystem
+ * is read-only), at most 2 x MAX_BYTES for the event file and
+ * MAX_BYTES for the crash dump.
+ *
+ --------------------------------------------------------------"""
+import os
+import signal
+import struct
+import sys
+import threading
+import time
+
+LOG_DIR = '/tmp/MIS_logs' # tmpfs, since the root filesystem is read-only
+EVENT_FILE = LOG_DIR + '/events.log'
+CRASH_FILE = LOG_DIR + '/events_crash.log'
+MAX_BYTES = 1000000 # cap of the event file before it is rotated to .1, and of the crash dump
+
+CAPACITY = 4096 # records in the ring, ~40s of the loop logging every tick
+RECORD = struct.Struct('<Hdii') # event id, monotonic secs, a, b
+FLUSH_PERIOD = 0.1 # secs between two runs of the formatter
+RATE = 10.0 # events/s allowed per event type, by default
+BURST = 20 # events allowed at once per event type, by default
+INT_MAX = 2**31 - 1
+
+
+class EventLog(object):
+    """
+    A python written ring buffer logger of fixed-size binary records.
+
+    """
+    def __init__(self, capacity=CAPACITY, path=EVENT_FILE, crash_path=CRASH_FILE, max_bytes=MAX_BYTES,
+                 echo=True, clock=time.monotonic):
+        """
+        Constructor
+        @param capacity: an integer indicates the number of records kept in the ring
+        @param path: a string, the event file, None for stdout only
+        @param crash_path: a string, the file written by dump()
+        @param max_bytes: an integer, size cap of the event file and of the crash dump
+        @param echo: True to also write the events to stdout, from the formatter thread
+        @param clock: a callable returning monotonic time in secs
+        """
+        self.capacity = capacity
+        self.path = path
+        self.crash_path = crash_path
+        self.max_bytes = max_bytes
+        self.echo = echo
+        self.clock = clock
+        self.started = clock()
+        self.ring = bytearray(capacity * RECORD.size) # preallocated, never grows
+        self.head = 0 # number of records ever written, the next one goes to head % capacity
+        self.tail = 0 # first record not formatted yet
+        self.lost = 0 # records overwritten before the formatter got to them
+        self.names = [] # per event id
+        self.texts = []
+        self.scales = []
+        self.rates = []
+        self.bursts = []
+        self.tokens = []
+        self.refills = [] # time of the last token refill
+        self.suppressed = [] # records dropped by the rate limit
+        self.__reported = [] # suppressed count already reported by the formatter
+        self.__lock = threading.Lock()
+        self.__file = None
+        self.__size = 0
+        self.__thread = None
+        self.__running = False
+
+    def event(self, name, text, rate=RATE, burst=BURST, scale=1):
+        """
+        Declare an event type
+        @param name: a string used for reporting
+        @param text: a format string taking (a, b), (a,) or nothing, or a callable(a, b) returning a string
+        @param rate: a float, events/s logged at most, None for no limit
+        @param burst: an integer, events logged at once before the rate applies
+        @param scale: a number a and b are divided by before formatting, e.g. 1000 to log floats as milli-units
+        @return the event id, to give to log()
+        """
+        with self.__lock:
+            self.names.append(name)
+            self.texts.append(text)
+            self.scales.append(scale)
+            self.rates.append(rate)
+            self.bursts.append(burst)
+            self.tokens.append(float(burst))
+            self.refills.append(self.clock())
+            self.suppressed.append(0)
+            self.__reported.append(0)
+            return len(self.names) - 1
+
+    def log(self, event, a=0, b=0): # hot path: a record in the ring, no formatting, no I/O
+        now = self.clock()
+        rate = self.rates[event]
+        with self.__lock:
+            if rate is not None:
+                tokens = self.tokens[event] + (now - self.refills[event]) * rate
+                self.refills[event] = now
+                if tokens > self.bursts[event]:
+                    tokens = self.bursts[event]
+                if tokens < 1:
+                    self.tokens[event] = tokens
+                    self.suppressed[event] += 1
+                    return False
+                self.tokens[event] = tokens - 1
+            RECORD.pack_into(self.ring, (self.head % self.capacity) * RECORD.size, event, now,
+                             int(min(max(a, -INT_MAX), INT_MAX)), int(min(max(b, -INT_MAX), INT_MAX)))
+            self.head += 1
+        return True
+
+    def format(self, event, secs, a, b): # one line of text for a record
+        text = self.texts[event]
+        scale = self.scales[event]
+        if scale != 1:
+            a /= scale
+            b /= scale
+        if callable(text):
+            message = text(a, b)
+        else:
+            args = text.count('%') - 2 * text.count('%%')
+            message = text % (a, b)[:args] if args else text
+        return '%10.3f %s' % (secs - self.started, message)
+
+    def __unpack(self, first, last): # (event, secs, a, b) of the records [first, last), lock held
+        ring = self.ring
+        capacity = self.capacity
+        return [RECORD.unpack_from(ring, (seq % capacity) * RECORD.size) for seq in range(first, last)]
+
+    def records(self): # (event, secs, a, b) of every record still in the ring, oldest first
+        with self.__lock:
+            return self.__unpack(max(self.head - self.capacity, 0), self.head)
+
+    def drain(self): # format every new record, return the lines
+        with self.__lock:
+            head = self.head
+            oldest = head - self.capacity
+            if self.tail < oldest:
+                self.lost += oldest - self.tail
+                self.tail = oldest
+            records = self.__unpack(self.tail, head)
+            self.tail = head
+        lines = [self.format(*record) for record in records]
+        for event, name in enumerate(self.names):
+            suppressed = self.suppressed[event]
+            if suppressed != self.__reported[event]:
+                lines.append('%10.3f %s: %d more suppressed by the rate limit' %
+                             (self.clock() - self.started, name, suppressed - self.__reported[event]))
+                self.__reported[event] = suppressed
+        return lines
+
+    def __open(self): # the event file, None if the directory can't be written
+        try:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            self.__file = open(self.path, 'a')
+            self.__size = self.__file.tell()
+        except OSError as e:
+            print(e)
+            self.__file = None
+
+    def __write(self, lines): # formatter thread
+        text = ''.join(line + '\n' for line in lines)
+        if self.echo:
+            sys.stdout.write(text)
+            sys.stdout.flush()
+        if self.__file is None:
+            return
+        try:
+            if self.__size + len(text) > self.max_bytes: # rotate, the older half is kept as .1
+                self.__file.close()
+                os.replace(self.path, self.path + '.1')
+                self.__file = open(self.path, 'w')
+                self.__size = 0
+            self.__file.write(text)
+            self.__file.flush()
+            self.__size += len(text)
+        except OSError as e:
+            print(e)
+            self.__file = None
+
+    def __run(self):
+        while self.__running:
+            time.sleep(FLUSH_PERIOD)
+            lines = self.drain()
+            if lines:
+                self.__write(lines)
+
+    def start(self): # formatter thread
+        if self.__thread is not None:
+            return
+        if self.path is not None:
+            self.__open()
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__run)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self): # last flush, then stop the formatter thread
+        self.__running = False
+        if self.__thread is not None:
+            self.__thread.join(FLUSH_PERIOD * 2)
+            self.__thread = None
+        lines = self.drain()
+        if lines:
+            self.__write(lines)
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+    def dump(self, reason=''): # write every record still in the ring to the crash file, return its path
+        lines = ['Event log dump %s: %d records, %d lost, %d suppressed' %
+                 (reason, min(self.head, self.capacity), self.lost, sum(self.suppressed))]
+        lines += [self.format(*record) for record in self.records()]
+        text = ''.join(line + '\n' for line in lines)
+        if len(text) > self.max_bytes: # keep the newest records
+            text = text[-self.max_bytes:]
+        try:
+            directory = os.path.dirname(self.crash_path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            with open(self.crash_path, 'w') as file:
+                file.write(text)
+        except OSError as e:
+            print(e)
+            return None
+        return self.crash_path
+
+    def install(self, signum=signal.SIGUSR2): # must be called from the main thread
+        signal.signal(signum, lambda signum, frame: self.dump('on signal %d' % signum))
+
+
+if __name__ == '__main__': # check the rate limit, the ring and the dump on a fake clock
+    import tempfile
+
+    class FakeClock(object):
+        def __init__(self):
+            self.now = 100.0
+        def __call__(self):
+            return self.now
+
+    clock = FakeClock()
+    directory = tempfile.mkdtemp()
+    log = EventLog(capacity=8, path=None, crash_path=os.path.join(directory, 'crash.log'),
+                   max_bytes=300, echo=False, clock=clock)
+    twist = log.event('twist', 'twist %.2f %.2f', rate=10, burst=2, scale=1000)
+    hit = log.event('hit', 'limit switch %d hit', rate=None)
+    released = log.event('released', 'Left Hand Released')
+    assert [log.log(twist, 500, -250) for _ in range(4)] == [True, True, False, False]
+    clock.now += 0.15 # one token and a half back
+    assert log.log(twist, 1000, 0) and not log.log(twist, 0, 0)
+    log.log(released)
+    lines = log.drain()
+    assert lines[0].endswith('twist 0.50 -0.25') and lines[2].endswith('twist 1.00 0.00'), lines
+    assert lines[3].endswith('Left Hand Released') and lines[4].endswith('twist: 3 more suppressed by the rate limit'), lines
+    for i in range(20): # wraps the ring twice before the formatter runs
+        log.log(hit, i)
+    lines = log.drain()
+    assert log.lost == 12 and len(lines) == 8 and lines[-1].endswith('limit switch 19 hit'), (log.lost, lines)
+    path = log.dump('check')
+    with open(path) as file:
+        text = file.read()
+    assert len(text) <= 300 and text.endswith('limit switch 19 hit\n'), text
+    print('Event log OK:', lines[-1].strip())
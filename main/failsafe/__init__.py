@@ -0,0 +1,8 @@
+"""------------------------------------------------------------*-
+  Init module for the staleness watchdog
+ --------------------------------------------------------------
+ * Puts the robot in a degraded mode when a peripheral stops
+ * sending data, and out of it when the data comes back.
+ *
+ --------------------------------------------------------------"""
+from failsafe.failsafe import Watchdog, Source
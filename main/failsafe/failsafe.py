@@ -0,0 +1,144 @@
+"""------------------------------------------------------------*-
+  Staleness watchdog for UV Robot
+ --------------------------------------------------------------
+ * Every watched source gives the age of its newest frame
+ * (sensor Nano, motor driver, ps2x process, web control server)
+ * and a staleness budget. Once per control tick:
+ * - if any source is older than its budget, the robot enters
+ *   the degraded mode: on_degraded(names) is called once.
+ * - when every source is fresh again, on_recovered() is called
+ *   once and normal control resumes by itself.
+ *
+ * The interval between two frames of each source is recorded
+ * in the monitor, as 'gap.<name>', with the resolution of a
+ * control tick.
+ *
+ * A source watched with a heartbeat period is only held to its
+ * budget once ARM_BEATS gaps in a row came at that rate. A
+ * peripheral built before it had a heartbeat (an old ps2x
+ * binary, sending on changes only) is then never stale, instead
+ * of tripping the degraded mode whenever it is idle.
+ *
+ --------------------------------------------------------------"""
+import math
+
+ARM_BEATS = 3 # gaps in a row at the heartbeat rate before a heartbeat source is held to its budget
+
+
+class Source(object):
+    """
+    A watched peripheral.
+
+    """
+    def __init__(self, name, age, budget, heartbeat=None):
+        """
+        Constructor
+        @param name: a string used for reporting
+        @param age: a callable returning the secs since the newest frame
+        @param budget: a float in secs, the source is stale when older than this
+        @param heartbeat: a float in secs, period the source resends at when idle, or None if it always sends
+        """
+        self.name = name
+        self.age = age
+        self.budget = budget
+        self.heartbeat = heartbeat
+        self.armed = heartbeat is None # held to the budget, once the heartbeat was seen
+        self.beats = 0 # gaps in a row at the heartbeat rate, until armed
+        self.last_age = 0.0
+        self.stale = False
+        self.trips = 0 # number of times the source went stale
+        self.histogram = None # monitor.Histogram of the gaps between frames, if monitored
+
+
+class Watchdog(object):
+    """
+    A python written staleness watchdog with a degraded mode.
+
+    """
+    def __init__(self, on_degraded=None, on_recovered=None, stats=None):
+        """
+        Constructor
+        @param on_degraded: a callable taking the list of stale source names
+        @param on_recovered: a callable without argument
+        @param stats: a monitor.Monitor to record the frame gaps into, or None
+        """
+        self.on_degraded = on_degraded
+        self.on_recovered = on_recovered
+        self.stats = stats
+        self.sources = []
+        self.degraded = False
+        self.stale = [] # names of the stale sources on the last update
+        self.trips = 0 # number of times the degraded mode was entered
+
+    def watch(self, name, age, budget, heartbeat=None): # see Source
+        source = Source(name, age, budget, heartbeat)
+        if self.stats is not None:
+            source.histogram = self.stats.histogram('gap.' + name, budget)
+        self.sources.append(source)
+        return source
+
+    def __beat(self, source, gap): # count the gaps at the heartbeat rate, arm the source after ARM_BEATS in a row
+        if source.heartbeat / 2 <= gap <= source.heartbeat * 2:
+            source.beats += 1
+        else:
+            source.beats = 0
+        if source.beats >= ARM_BEATS:
+            source.armed = True
+            print('Heartbeat from %s, watched from now on' % source.name)
+
+    def update(self): # check every source, call once per control tick
+        stale = []
+        for source in self.sources:
+            age = source.age()
+            if age < source.last_age and not math.isinf(source.last_age): # a new frame came, the last age was the gap
+                if source.histogram is not None:
+                    source.histogram.record(source.last_age)
+                if not source.armed:
+                    self.__beat(source, source.last_age)
+            source.last_age = age
+            if age > source.budget and source.armed:
+                if not source.stale:
+                    source.trips += 1
+                source.stale = True
+                stale.append(source.name)
+            else:
+                source.stale = False
+
+        if stale and not self.degraded:
+            self.degraded = True
+            self.trips += 1
+            print('Degraded mode, no data from:', ', '.join(stale))
+            if self.on_degraded is not None:
+                self.on_degraded(stale)
+        elif not stale and self.degraded:
+            self.degraded = False
+            print('Data back from every peripheral, degraded mode left')
+            if self.on_recovered is not None:
+                self.on_recovered()
+        elif stale != self.stale and stale:
+            print('Still degraded, no data from:', ', '.join(stale))
+        self.stale = stale
+        return self.degraded
+
+
+if __name__ == '__main__': # a heartbeat source, from an old binary then a new one, on a fake age
+    TICK = 0.01
+    ages = {'ps2x': 0.0}
+    trips = []
+    watchdog = Watchdog(trips.append)
+    source = watchdog.watch('ps2x', lambda: ages['ps2x'], 0.5, 0.1)
+    for gap in (0.03, 2.0, 0.1, 5.0, 0.02, 0.01, 3.0): # old binary: frames on stick changes, idle in between
+        for _ in range(int(round(gap / TICK))):
+            ages['ps2x'] += TICK
+            watchdog.update()
+        ages['ps2x'] = 0.0
+    assert not trips and not source.armed, 'no heartbeat, never stale'
+    for _ in range(ARM_BEATS * 20): # new binary: a frame every 100ms
+        ages['ps2x'] = ages['ps2x'] + TICK if ages['ps2x'] < 0.095 else 0.0
+        watchdog.update()
+    assert source.armed and not watchdog.degraded
+    for _ in range(60): # the process died
+        ages['ps2x'] += TICK
+        watchdog.update()
+    assert trips == [['ps2x']] and watchdog.degraded, 'armed, stale past the budget'
+    print('Watchdog OK: %d trips' % watchdog.trips)
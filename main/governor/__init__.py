@@ -0,0 +1,11 @@
+"""------------------------------------------------------------*-
+  Init module for the obstacle-aware speed governor
+ --------------------------------------------------------------
+ * Caps the drive speed by the distance to the nearest obstacle
+ * in the direction of travel.
+ *
+ * Check the stopping distances with:
+ *      python3 governor/governor.py
+ *
+ --------------------------------------------------------------"""
+from governor.governor import Governor, speed_table
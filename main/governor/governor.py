@@ -0,0 +1,200 @@
+"""------------------------------------------------------------*-
+  Obstacle-aware speed governor for UV Robot
+ --------------------------------------------------------------
+ * Runs between motor_controller() and MotorUART_PWM.update():
+ * every control tick, it takes the smallest filtered distance
+ * seen by the ultrasonic channels facing the direction of
+ * travel, and caps motor.MAX_PWM with a precomputed
+ * distance --> pwm table.
+ *
+ * The table gives the fastest pwm the robot can still stop
+ * from before STOP_DISTANCE, braking at motor.decel after a
+ * LATENCY (sensor frame, median filter, control tick):
+ *      d = CM_PER_PWM*p*LATENCY + CM_PER_PWM*p^2/(2*decel)
+ * Below STOP_PWM the ramp stops the wheels, so the robot
+ * settles just outside STOP_DISTANCE.
+ *
+ * The user speed setting goes to governor.speed instead of
+ * motor.MAX_PWM, the governor owns the latter.
+ *
+ * Run this file (python3 -m governor.governor, from main/) to
+ * replay simulated sensor traces through a MotorUART_PWM on the
+ * emulated driver of the sim backend, and check the stopping
+ * distance at each speed setting.
+ *
+ --------------------------------------------------------------"""
+import math
+
+FRONT = (2, 3) # ultrasonic channels facing forward, 0 and 1 look down from the hands
+REAR = (4, 5) # ultrasonic channels facing backward
+STOP_DISTANCE = 25 # cm - distance kept to an obstacle
+SENSOR_RANGE = 150 # cm - farther is reported as 999 by the Nano, so no cap
+CM_PER_PWM = 0.1 # cm/s of the robot per pwm unit, ~60cm/s at 600
+LATENCY = 0.15 # secs - from an obstacle appearing to braking: ~3 frames through the median, plus a tick
+STALE_PWM = 150 # cap while the ultrasonic data is stale, creeping speed
+
+
+def speed_table(decel, stop_distance=STOP_DISTANCE, latency=LATENCY, cm_per_pwm=CM_PER_PWM, size=SENSOR_RANGE + 1):
+    """
+    Fastest pwm the robot can stop from, for every distance in cm
+    @param decel: a float in pwm/s, braking ramp of the motors
+    @return a tuple of integers indexed by the distance
+    """
+    table = []
+    for distance in range(size):
+        room = distance - stop_distance
+        if room <= 0:
+            table.append(0)
+            continue
+        # solve cm_per_pwm*(p*latency + p^2/(2*decel)) = room for p
+        pwm = decel*(math.sqrt(latency**2 + 2*room/(cm_per_pwm*decel)) - latency)
+        table.append(int(pwm))
+    return tuple(table)
+
+
+class Governor(object):
+    """
+    A python written speed governor for the drive motors.
+
+    """
+    def __init__(self, motor, sensor, front=FRONT, rear=REAR):
+        """
+        Constructor
+        @param motor: a MotorUART_PWM, driven with set_twist()
+        @param sensor: an Ultrasonics, with history and stale()
+        @param front: a tuple of the channels checked when moving forward
+        @param rear: a tuple of the channels checked when moving backward
+        """
+        self.motor = motor
+        self.sensor = sensor
+        self.front = list(front)
+        self.rear = list(rear)
+        self.speed = motor.MAX_PWM # speed setting chosen by the user
+        self.table = speed_table(motor.decel)
+        self.cap = self.speed # pwm allowed on the last update
+        self.distance = None # smallest distance in the direction of travel on the last update, cm
+        self.limited = 0 # number of ticks the speed was capped
+
+    def update(self): # cap motor.MAX_PWM, call every control tick before motor.update()
+        motor = self.motor
+        moving = motor.pwm_1 + motor.pwm_2
+        channels = []
+        if motor.linear > 0 or moving > 0:
+            channels += self.front
+        if motor.linear < 0 or moving < 0:
+            channels += self.rear
+
+        cap = self.speed
+        self.distance = None
+        if channels:
+            if self.sensor.stale():
+                cap = min(cap, STALE_PWM)
+            else:
+                distances = self.sensor.history.median()
+                if distances is not None:
+                    self.distance = distance = int(min(distances[channels]))
+                    if distance < len(self.table):
+                        cap = min(cap, self.table[max(distance, 0)])
+        if cap < self.speed:
+            self.limited += 1
+        self.cap = motor.MAX_PWM = cap
+
+
+if __name__ == '__main__': # replay simulated sensor traces, check the stopping distance at each speed setting
+    import contextlib
+    import io
+    import os
+    import random
+    import sys
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    os.environ.setdefault('UVROBOT_BACKEND', 'sim') # never the robot hardware
+    import usb_peripherals
+    from hal.sim_robot import SimRobot, SimMotorDriver
+    from usb_peripherals import MOTOR_BAUDRATE, MAX_SPEED
+    from usb_peripherals.motor import MotorUART_PWM
+    from usb_peripherals.history import SensorHistory
+    from usb_peripherals.ultrasonics import CHANNELS
+
+    TICK = 0.01 # secs, control loop period
+    FRAME = 0.03 # secs, Nano frame period
+    NOISE = 1.0 # cm, sensor noise
+    SPEEDS = (MAX_SPEED // 3, 2 * MAX_SPEED // 3, MAX_SPEED) # LOW_SPEED ... HIGH_SPEED of main.py
+
+    class VirtualClock(object):
+        def __init__(self):
+            self.now = 0.0
+        def __call__(self):
+            return self.now
+
+    class SimSensor(object): # the history an Ultrasonics would fill, never stale
+        def __init__(self):
+            self.history = SensorHistory(CHANNELS)
+        def stale(self):
+            return False
+
+    def braking(speed, decel): # cm needed to stop from speed, see speed_table()
+        return CM_PER_PWM*(speed*LATENCY + speed**2/(2.0*decel))
+
+    def run(driver, speed, wall, appear=SENSOR_RANGE, seed=0):
+        """
+        Drive forward at full stick toward a wall, return the closest distance reached, the final pwm and the braking ramp
+        @param driver: a SimMotorDriver, takes the frames of the motor
+        @param wall: a float in cm, distance of the wall at the start
+        @param appear: a float in cm, the wall is only seen from this distance on (someone steps in)
+        """
+        rng = random.Random(seed)
+        clock = VirtualClock()
+        with contextlib.redirect_stdout(io.StringIO()): # the port and ready messages, once per run
+            motor = MotorUART_PWM(baudRate=MOTOR_BAUDRATE, speed=speed, port=driver.port, clock=clock)
+        sensor = SimSensor()
+        governor = Governor(motor, sensor)
+        governor.speed = speed
+        position = 0.0
+        closest = wall
+        next_frame = 0.0
+        secs = wall/(CM_PER_PWM*speed) + 6 # long enough to reach the wall and creep to the stop
+        try:
+            for tick in range(int(secs/TICK)):
+                clock.now = tick*TICK
+                distance = wall - position
+                if clock.now >= next_frame: # a new Nano frame
+                    next_frame += FRAME
+                    seen = distance + rng.gauss(0, NOISE) if distance <= appear else 999
+                    if rng.random() < 0.02: # single sample spike
+                        seen = rng.choice((3, 999))
+                    sensor.history.push([999, 999, seen, seen + 5, 999, 999])
+                motor.set_twist(1.0, 0.0) # UP held all along
+                governor.update()
+                motor.update()
+                motor.flush()
+                position += CM_PER_PWM*motor.pwm_1*TICK
+                closest = min(closest, wall - position)
+        finally:
+            with contextlib.redirect_stdout(io.StringIO()):
+                motor.clean()
+        return closest, motor.pwm_1, motor.decel
+
+    usb_peripherals.sensor.clean() # the peripherals of the sim backend, not used here
+    usb_peripherals.motor.clean()
+    driver = SimMotorDriver(SimRobot())
+    driver.start()
+    failed = False
+    try:
+        print('%-6s %-16s %-10s %s' % ('speed', 'trace', 'closest', 'expected'))
+        for speed in SPEEDS:
+            for name, appear in (('approach', SENSOR_RANGE), ('sudden at 60cm', 60.0), ('sudden at 40cm', 40.0)):
+                worst = SENSOR_RANGE
+                for seed in range(10):
+                    closest, pwm, decel = run(driver, speed, 300.0, appear, seed)
+                    # outside STOP_DISTANCE, unless the obstacle appeared closer than the robot can brake
+                    expected = min(STOP_DISTANCE, appear - braking(speed, decel)) - 3*NOISE
+                    worst = min(worst, closest)
+                    if closest < expected or pwm != 0:
+                        failed = True
+                        print('FAILED: seed %d stopped at %.1fcm, pwm %d' % (seed, closest, pwm))
+                print('%-6d %-16s %-10.1f >= %.1f' % (speed, name, worst, expected))
+    finally:
+        driver.stop()
+    assert not failed, 'the robot did not stop in time'
+    assert driver.commands, 'no frame reached the motor driver'
+    print('All traces stopped in time')
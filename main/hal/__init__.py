@@ -0,0 +1,11 @@
+"""------------------------------------------------------------*-
+  Init module for the hardware abstraction layer
+ --------------------------------------------------------------
+ * Real and simulated hardware behind one registry, so the
+ * control stack can run on a normal Linux box.
+ * The backend is chosen with UVROBOT_BACKEND=real|sim.
+ *
+ --------------------------------------------------------------"""
+from hal.registry import BACKEND, register, get, simulated
+from hal.fake_gpio import FakeGPIO
+import hal.backends # registers the real and sim components
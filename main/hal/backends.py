@@ -0,0 +1,70 @@
+"""------------------------------------------------------------*-
+  Real and simulated backends of UV Robot
+ --------------------------------------------------------------
+ * 'real': RPi.GPIO, the USB serial adapters found by
+ * usb_peripherals.discovery, the ps2x binary, server_control.py
+ * and the picamera streaming server. What the robot always did.
+ *
+ * 'sim': FakeGPIO, the pty emulators of the motor driver and of
+ * the Nano moving a SimRobot, the scripted PS2 controller, a
+ * heartbeat-only control server and the synthetic camera.
+ * Run the whole control stack on a laptop with:
+ *      UVROBOT_BACKEND=sim python3 main.py
+ *
+ --------------------------------------------------------------"""
+import os
+import sys
+from hal.registry import register, get
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+# ---------------------------------- real -------------------------------------
+def _real_gpio():
+    import RPi.GPIO as GPIO
+    return GPIO
+
+def _real_ports():
+    from usb_peripherals.discovery import discover
+    return discover() # role --> port, by udev symlink or USB VID/PID, probing only unknown adapters
+
+def _real_camera_server():
+    from server_camera import CameraServer
+    return CameraServer
+
+register('real', 'gpio', _real_gpio)
+register('real', 'ports', _real_ports)
+register('real', 'ps2_command', lambda: ['sudo', '/ps2x/ps2x']) # absolute directory, must run ps2_bin_reset.sh before
+register('real', 'web_command', lambda: ['sudo', 'python3', 'server_control.py'])
+register('real', 'camera_server', _real_camera_server)
+
+
+# ---------------------------------- sim --------------------------------------
+def _sim_gpio():
+    from hal.fake_gpio import FakeGPIO
+    return FakeGPIO()
+
+def _sim_world():
+    from hal.sim_robot import SimRobot
+    return SimRobot()
+
+def _sim_ports():
+    from hal.sim_robot import SimMotorDriver, SimNano
+    robot = get('world')
+    driver = SimMotorDriver(robot)
+    nano = SimNano(robot)
+    driver.start()
+    nano.start()
+    print('Simulated peripherals: sensor on %s, motor on %s' % (nano.port, driver.port))
+    return {'sensor': nano.port, 'motor': driver.port}
+
+def _sim_camera_server():
+    from hal.sim_camera import CameraServer
+    return CameraServer
+
+register('sim', 'gpio', _sim_gpio)
+register('sim', 'world', _sim_world)
+register('sim', 'ports', _sim_ports)
+register('sim', 'ps2_command', lambda: [sys.executable, os.path.join(HERE, 'sim_ps2.py')])
+register('sim', 'web_command', lambda: [sys.executable, os.path.join(HERE, 'sim_web.py')])
+register('sim', 'camera_server', _sim_camera_server)
@@ -0,0 +1,102 @@
+"""------------------------------------------------------------*-
+  Fake GPIO backend for UV Robot
+ --------------------------------------------------------------
+ * Drop-in for the part of RPi.GPIO the robot uses: setmode,
+ * setup, input, output, add_event_detect and cleanup.
+ *
+ * Input levels are driven from outside with set_input(), which
+ * fires the edge callbacks like RPi.GPIO does, on the caller's
+ * thread, honouring the bouncetime of each pin.
+ *
+ --------------------------------------------------------------"""
+import threading
+import time
+
+
+class FakeGPIO(object):
+    """
+    A python written in-memory replacement of RPi.GPIO.
+
+    """
+    BCM = 11
+    BOARD = 10
+    IN = 1
+    OUT = 0
+    LOW = 0
+    HIGH = 1
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+    FALLING = 32
+    RISING = 31
+    BOTH = 33
+
+    def __init__(self, clock=time.monotonic):
+        """
+        Constructor
+        @param clock: a callable returning monotonic time in secs, used for the bouncetime
+        """
+        self.clock = clock
+        self.mode = None
+        self.levels = {} # pin --> current level
+        self.directions = {} # pin --> IN or OUT
+        self.events = {} # pin --> [edge, callbacks, bouncetime in secs, time of the last accepted edge]
+        self.__lock = threading.Lock()
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, direction, pull_up_down=PUD_OFF, initial=None):
+        self.directions[pin] = direction
+        if direction == self.OUT:
+            self.levels[pin] = self.LOW if initial is None else initial
+        elif pin not in self.levels: # floating input settles on its pull
+            self.levels[pin] = self.HIGH if pull_up_down == self.PUD_UP else self.LOW
+
+    def input(self, pin):
+        return self.levels[pin]
+
+    def output(self, pin, level):
+        if self.directions.get(pin) != self.OUT:
+            raise RuntimeError('The GPIO channel has not been set up as an OUTPUT')
+        self.levels[pin] = level
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        if self.directions.get(pin) != self.IN:
+            raise RuntimeError('You must setup() the GPIO channel as an input first')
+        self.events[pin] = [edge, [callback] if callback else [], (bouncetime or 0)/1000.0, None]
+
+    def add_event_callback(self, pin, callback):
+        self.events[pin][1].append(callback)
+
+    def remove_event_detect(self, pin):
+        self.events.pop(pin, None)
+
+    def cleanup(self, pin=None):
+        if pin is None:
+            self.levels.clear()
+            self.directions.clear()
+            self.events.clear()
+        else:
+            for table in (self.levels, self.directions, self.events):
+                table.pop(pin, None)
+
+    def set_input(self, pin, level): # drive an input pin from outside, e.g. a switch being hit
+        with self.__lock:
+            old = self.levels.get(pin)
+            self.levels[pin] = level
+            event = self.events.get(pin)
+            if event is None or old == level:
+                return
+            edge, callbacks, bouncetime, last = event
+            if edge != self.BOTH and edge != (self.RISING if level == self.HIGH else self.FALLING):
+                return
+            now = self.clock()
+            if last is not None and now - last < bouncetime: # bouncing, RPi.GPIO drops it too
+                return
+            event[3] = now
+        for callback in callbacks:
+            callback(pin)
@@ -0,0 +1,61 @@
+"""------------------------------------------------------------*-
+  Backend registry for UV Robot
+ --------------------------------------------------------------
+ * Every piece of hardware the control stack touches is a
+ * component, built by the factory its backend registered:
+ *      'gpio'          RPi.GPIO, or anything with its interface
+ *      'ports'         dict role --> serial port of the sensor
+ *                      Nano and the motor driver
+ *      'ps2_command'   command line of the ps2x process, its
+ *                      pin arguments are appended by PS2X
+ *      'web_command'   command line of the control server
+ *      'camera_server' class of the video streaming server
+ *      'world'         the simulated robot behind the sim
+ *                      peripherals (sim backend only)
+ *
+ * The backend is chosen once, by the UVROBOT_BACKEND environment
+ * variable: 'real' (default, on the robot) or 'sim'.
+ * Factories run on the first get() only, so the real hardware
+ * modules are never imported by the sim backend and the other
+ * way round.
+ *
+ --------------------------------------------------------------"""
+import os
+
+ENV = 'UVROBOT_BACKEND'
+DEFAULT = 'real'
+BACKEND = os.environ.get(ENV, DEFAULT)
+
+BACKENDS = {} # backend --> {component --> factory}
+_instances = {} # component --> what its factory returned
+
+
+def register(backend, component, factory):
+    """
+    Add a component to a backend
+    @param backend: a string, the value of UVROBOT_BACKEND selecting it
+    @param component: a string, see the list above
+    @param factory: a callable without argument, building the component
+    """
+    BACKENDS.setdefault(backend, {})[component] = factory
+
+
+def get(component):
+    """
+    The component of the selected backend, built on the first call
+    @param component: a string, see the list above
+    @return whatever the factory built
+    """
+    if component in _instances:
+        return _instances[component]
+    if BACKEND not in BACKENDS:
+        raise ValueError('Unknown backend %s=%s, use one of: %s' % (ENV, BACKEND, ', '.join(sorted(BACKENDS))))
+    factories = BACKENDS[BACKEND]
+    if component not in factories:
+        raise ValueError('The %s backend has no %s' % (BACKEND, component))
+    instance = _instances[component] = factories[component]()
+    return instance
+
+
+def simulated(): # True when no real hardware is used
+    return BACKEND != DEFAULT
@@ -0,0 +1,120 @@
+"""------------------------------------------------------------*-
+  Synthetic camera and its streaming server for UV Robot
+ --------------------------------------------------------------
+ * Stands in for the picamera and the Flask/gevent streaming
+ * server of server_camera.py when no Pi camera is there:
+ * - Camera.frames() yields 640x480 grey JPEG frames at FRAME_RATE
+ *   with a white bar sweeping across, encoded here with no
+ *   imaging library. The frame number and the capture time are
+ *   written in a JPEG comment, to measure the streaming latency.
+ * - CameraServer serves them on /video_feed as multipart MJPEG,
+ *   same as streaming_app, with start() and shutdown().
+ *
+ --------------------------------------------------------------"""
+import os
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WIDTH = 640 # same as camera_pi.py
+HEIGHT = 480
+FRAME_RATE = 20
+BAR_WIDTH = 4 # blocks of 8 pixels
+PORT = int(os.environ.get('UVROBOT_CAMERA_PORT', 8720)) # the real server uses 720, that needs root. 0 for any free port
+DC_LEVEL = 127 # DC of a white block once quantized by 8, grey blocks are 0
+
+
+def _segment(marker, payload):
+    return struct.pack('>BBH', 0xFF, marker, len(payload) + 2) + payload
+
+# every block is flat, so only its DC is coded: grey (0), or a jump of +-DC_LEVEL (size 7)
+# DC huffman: size 0 --> '0', size 7 --> '10'. AC huffman: end of block --> '0'
+_HEADER = (b'\xff\xd8'
+           + _segment(0xDB, b'\x00' + bytes([8] + [1] * 63)) # quantization: DC by 8
+           + _segment(0xC0, struct.pack('>BHHBBBB', 8, HEIGHT, WIDTH, 1, 1, 0x11, 0)) # baseline, 1 grey component
+           + _segment(0xC4, b'\x00' + bytes([1, 1] + [0] * 14) + b'\x00\x07') # DC table 0
+           + _segment(0xC4, b'\x10' + bytes([1] + [0] * 15) + b'\x00')) # AC table 0
+_SCAN = _segment(0xDA, b'\x01\x01\x00\x00\x3f\x00')
+
+
+def jpeg(bar, comment=b''):
+    """
+    A grey frame with a white vertical bar
+    @param bar: an integer, column of blocks where the bar starts
+    @param comment: bytes written in a COM segment
+    @return the JPEG file as bytes
+    """
+    columns = WIDTH//8
+    bits = []
+    previous = 0
+    for row in range(HEIGHT//8):
+        for column in range(columns):
+            level = DC_LEVEL if bar <= column < bar + BAR_WIDTH else 0
+            diff = level - previous
+            previous = level
+            if diff == 0:
+                bits.append('00') # DC size 0, end of block
+            else: # size 7, the value in ones' complement if negative
+                bits.append('10' + format(diff if diff > 0 else diff + 127, '07b') + '0')
+    bits = ''.join(bits)
+    bits += '1' * (-len(bits) % 8) # pad with ones
+    data = int(bits, 2).to_bytes(len(bits)//8, 'big').replace(b'\xff', b'\xff\x00') # byte stuffing
+    com = _segment(0xFE, comment) if comment else b''
+    return _HEADER + com + _SCAN + data + b'\xff\xd9'
+
+
+class Camera(object):
+    """
+    A python written synthetic camera.
+
+    """
+    @staticmethod
+    def frames():
+        number = 0
+        while True:
+            start = time.monotonic()
+            bar = number % (WIDTH//8)
+            yield jpeg(bar, b'frame %d t=%.6f' % (number, time.time()))
+            number += 1
+            time.sleep(max(1.0/FRAME_RATE - (time.monotonic() - start), 0))
+
+
+class _Stream(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/video_feed':
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=frame')
+        self.end_headers()
+        try:
+            for frame in Camera.frames():
+                self.wfile.write(b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+        except (BrokenPipeError, ConnectionResetError): # the client left
+            return
+
+    def log_message(self, format, *args): # quiet, the control loop prints enough
+        pass
+
+
+class CameraServer(threading.Thread):
+    """
+    A python written MJPEG server of the synthetic camera.
+
+    """
+    def __init__(self, port=PORT):
+        super().__init__()
+        self.daemon = True
+        self.server = ThreadingHTTPServer(('0.0.0.0', port), _Stream)
+        self.server.daemon_threads = True
+
+    def run(self):
+        print('Simulated camera on http://localhost:%d/video_feed' % self.server.server_address[1])
+        self.server.serve_forever()
+
+    def shutdown(self):
+        print(f'Shutting down camera server...\n')
+        if self.is_alive(): # shutdown() waits for serve_forever() to return
+            self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""------------------------------------------------------------*-
+  Scripted PS2 controller for UV Robot
+ --------------------------------------------------------------
+ * Stands in for the /ps2x/ps2x binary: prints the same
+ * "Data: <buttons> <Lsticks>" lines every PERIOD, from a script
+ * instead of the SPI bus. The pin arguments are accepted and
+ * ignored.
+ *
+ * The script is a JSON file, UVROBOT_PS2_SCRIPT or ps2_script.json
+ * next to this file:
+ *      {"loop": true,
+ *       "steps": [{"secs": 2, "buttons": ["UP"], "lx": 128, "ly": 127}, ...]}
+ * buttons are the PS2X constant names, held for secs. lx and ly
+ * are the Left stick, centered when left out.
+ *
+ * With UVROBOT_SIM_TRACE set to a directory, the monotonic time
+ * each step starts is appended to ps2.log: "<secs> <step> <frame>".
+ *
+ --------------------------------------------------------------"""
+import json
+import os
+import sys
+import time
+
+PERIOD = 0.1 # secs - ps2x resends the state every 100ms
+TRACE = os.environ.get('UVROBOT_SIM_TRACE') # directory of the input traces, None for no trace
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ps2_script.json')
+BUTTONS = {'SELECT': 0x0001, 'L3': 0x0002, 'R3': 0x0004, 'START': 0x0008,
+           'UP': 0x0010, 'RIGHT': 0x0020, 'DOWN': 0x0040, 'LEFT': 0x0080,
+           'L2': 0x0100, 'R2': 0x0200, 'L1': 0x0400, 'R1': 0x0800,
+           'TRIANGLE': 0x1000, 'CIRCLE': 0x2000, 'CROSS': 0x4000, 'SQUARE': 0x8000}
+LX_CENTER = 128 # as ps2x.response
+LY_CENTER = 127
+
+
+def frame(step): # (buttons, Lsticks) as ps2x prints them, buttons are active low
+    buttons = 0xFFFF
+    for name in step.get('buttons', []):
+        buttons &= ~BUTTONS[name]
+    return buttons, step.get('lx', LX_CENTER) << 8 | step.get('ly', LY_CENTER)
+
+
+def main():
+    with open(os.environ.get('UVROBOT_PS2_SCRIPT', SCRIPT)) as file:
+        script = json.load(file)
+    print('Scripted PS2 controller, %d steps' % len(script['steps']), flush=True)
+    trace = open(os.path.join(TRACE, 'ps2.log'), 'w', buffering=1) if TRACE else None
+    while True:
+        for index, step in enumerate(script['steps']):
+            data = 'Data: %d %d' % frame(step)
+            start = time.monotonic()
+            if trace is not None:
+                trace.write('%.6f %d %s\n' % (start, index, data[6:]))
+            end = start + step['secs']
+            while time.monotonic() < end:
+                print(data, flush=True)
+                time.sleep(min(PERIOD, max(end - time.monotonic(), 0)))
+        if not script.get('loop'):
+            break
+    data = 'Data: %d %d' % frame({}) # released, keep the heartbeat going
+    while True:
+        print(data, flush=True)
+        time.sleep(PERIOD)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except (KeyboardInterrupt, BrokenPipeError):
+        sys.exit(0)
@@ -0,0 +1,300 @@
+"""------------------------------------------------------------*-
+  Simulated robot and serial peripherals for UV Robot
+ --------------------------------------------------------------
+ * SimRobot is a differential drive robot in a rectangular room,
+ * with two hands moving up and down. Two emulated devices sit on
+ * pseudo terminals, so usb_peripherals opens them with pyserial
+ * exactly like the USB adapters:
+ * - SimMotorDriver, the MSD_EM driver: parses {N.. M..} and
+ *   {N.. P..} commands. Each wheel speed follows its pwm with a
+ *   first order lag, nothing turns inside the dead band.
+ * - SimNano, the ultrasonic Nano: sends the 6 distances seen from
+ *   the robot every FRAME_PERIOD, ASCII by default, binary frames
+ *   after a 'B' (see nano_transmitter.ino). Channels 0 and 1 are
+ *   the heights of the hands, 2 and 3 look forward, 4 and 5 look
+ *   backward.
+ *
+ * The frame format is written again here on purpose, as the
+ * firmware does, so the simulation also checks the parser.
+ *
+ * With UVROBOT_SIM_TRACE set to a directory, every command the
+ * driver gets is appended to motor.log with the monotonic time
+ * its bytes arrived: "<secs> <channel> <M|P> <value>".
+ *
+ --------------------------------------------------------------"""
+import math
+import os
+import pty
+import random
+import re
+import select
+import struct
+import threading
+import time
+import tty
+
+ROOM = (400.0, 300.0) # cm - walls of the room around the robot
+TRACK = 40.0 # cm - between the wheels
+CM_PER_PWM = 0.1 # cm/s of a wheel per pwm unit, as governor.CM_PER_PWM
+WHEEL_TAU = 0.15 # secs - time constant of a wheel reaching the speed of its pwm
+DEAD_PWM = 90 # the wheels don't turn below this, as motor.STOP_PWM
+HAND_RATE = 10.0 # cm/s of a hand at pwm 300
+HAND_RANGE = (15.0, 90.0) # cm - lowest and highest height of a hand
+SENSOR_RANGE = 150 # cm - farther reads 999, as the Nano
+NOISE = 0.5 # cm - standard deviation of the distances
+TRACE = os.environ.get('UVROBOT_SIM_TRACE') # directory of the command traces, None for no trace
+
+FRAME_PERIOD = 0.03 # secs - the Nano sends a frame every ~30ms
+FRAME_SYNC = 0xA5
+FRAME = struct.Struct('<BB6HB') # sync, seq, distances, crc8
+COMMAND = re.compile(rb'\{N(\d)\s*([MP])\s*(-?\d+)\}')
+MAX_COMMAND = 32 # bytes - longer garbage without a command is dropped
+
+
+def crc8(data): # CRC-8/SMBUS, poly 0x07, as crc8() in nano_transmitter.ino
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+def _ray(x, y, angle, room=ROOM): # cm from (x, y) to the wall in the direction of angle
+    dx = math.cos(angle)
+    dy = math.sin(angle)
+    hits = []
+    if dx > 1e-9:
+        hits.append((room[0] - x)/dx)
+    elif dx < -1e-9:
+        hits.append(-x/dx)
+    if dy > 1e-9:
+        hits.append((room[1] - y)/dy)
+    elif dy < -1e-9:
+        hits.append(-y/dy)
+    return min(hits)
+
+
+class SimRobot(object):
+    """
+    A python written model of the UV robot in a room.
+
+    """
+    def __init__(self, x=ROOM[0]/2, y=ROOM[1]/2, heading=0.0, seed=None):
+        """
+        Constructor
+        @param x: a float in cm, starting position in the room
+        @param y: a float in cm
+        @param heading: a float in rad, 0 faces the wall at x = ROOM[0]
+        @param seed: for the sensor noise, None for a random one
+        """
+        self.x = x
+        self.y = y
+        self.heading = heading
+        self.pwm = [0, 0, 0, 0, 0] # last pwm of each channel N0-N4 given by the driver
+        self.speed = [0.0, 0.0] # cm/s of the left and right wheels
+        self.height = [50.0, 50.0] # cm of the left and right hands
+        self.collisions = 0 # number of times the robot hit a wall
+        self.__rng = random.Random(seed)
+        self.__lock = threading.Lock()
+        self.__last = time.monotonic()
+
+    def command(self, channel, pwm): # the driver got {N<channel> P<pwm>}
+        with self.__lock:
+            self.__advance()
+            if channel == 0:
+                self.pwm[1:] = [pwm] * 4
+            elif channel < len(self.pwm):
+                self.pwm[channel] = pwm
+
+    def __advance(self): # integrate the motion since the last call, lock held
+        now = time.monotonic()
+        secs = now - self.__last
+        self.__last = now
+        lag = 1 - math.exp(-secs/WHEEL_TAU)
+        for wheel, channel in ((0, 1), (1, 2)):
+            pwm = self.pwm[channel]
+            target = CM_PER_PWM*pwm if abs(pwm) >= DEAD_PWM else 0.0
+            self.speed[wheel] += (target - self.speed[wheel])*lag
+        left, right = self.speed
+        linear = (left + right)/2
+        self.heading += (right - left)/TRACK*secs
+        x = self.x + linear*math.cos(self.heading)*secs
+        y = self.y + linear*math.sin(self.heading)*secs
+        inside_x = min(max(x, 0.0), ROOM[0])
+        inside_y = min(max(y, 0.0), ROOM[1])
+        if (inside_x, inside_y) != (x, y): # stopped by the wall
+            self.collisions += 1
+            self.speed = [0.0, 0.0]
+        self.x, self.y = inside_x, inside_y
+        for hand, channel in ((0, 3), (1, 4)):
+            height = self.height[hand] + HAND_RATE*self.pwm[channel]/300.0*secs
+            self.height[hand] = min(max(height, HAND_RANGE[0]), HAND_RANGE[1])
+
+    def distances(self): # what the 6 ultrasonic sensors see now, in cm
+        with self.__lock:
+            self.__advance()
+            front = _ray(self.x, self.y, self.heading)
+            rear = _ray(self.x, self.y, self.heading + math.pi)
+            seen = self.height + [front, front, rear, rear]
+        values = []
+        for distance in seen:
+            distance += self.__rng.gauss(0, NOISE)
+            values.append(999 if distance > SENSOR_RANGE else max(int(round(distance)), 0))
+        return values
+
+
+class PtyDevice(threading.Thread):
+    """
+    A serial device emulated on the master side of a pseudo terminal.
+
+    """
+    def __init__(self, period):
+        """
+        Constructor
+        @param period: a float in secs, tick() is called at least this often
+        """
+        super().__init__()
+        self.daemon = True
+        self.period = period
+        self.__master, self.__slave = pty.openpty() # the slave stays open, so the master never sees a hang up
+        tty.setraw(self.__slave) # no echo nor line editing, as a USB serial adapter
+        os.set_blocking(self.__master, False)
+        self.port = os.ttyname(self.__slave) # for pyserial
+        self.dropped = 0 # bytes lost because nobody read the port
+        self.__running = True
+
+    def run(self):
+        while self.__running:
+            ready = select.select([self.__master], [], [], self.period)[0]
+            if ready:
+                try:
+                    data = os.read(self.__master, 4096)
+                except (BlockingIOError, OSError):
+                    data = b''
+                if data:
+                    self.received(data)
+            self.tick()
+
+    def send(self, data): # never blocks, bytes nobody reads are dropped like on a real wire
+        try:
+            os.write(self.__master, data)
+        except (BlockingIOError, OSError):
+            self.dropped += len(data)
+
+    def received(self, data):
+        pass
+
+    def tick(self):
+        pass
+
+    def stop(self):
+        self.__running = False
+
+
+class SimMotorDriver(PtyDevice):
+    """
+    A python written emulator of the MSD_EM motor driver.
+
+    """
+    def __init__(self, robot):
+        """
+        Constructor
+        @param robot: a SimRobot, moved by the commands
+        """
+        super().__init__(0.1)
+        self.robot = robot
+        self.mode = [None] * 5 # M command of each channel, 6 is PWM
+        self.commands = 0 # number of commands parsed
+        self.reads = 0 # number of chunks read from the pty, about one per write of the host
+        self.bytes = 0
+        self.__buffer = b''
+        self.__trace = open(os.path.join(TRACE, 'motor.log'), 'w', buffering=1) if TRACE else None
+
+    def received(self, data):
+        now = time.monotonic() # when the bytes hit the driver
+        self.reads += 1
+        self.bytes += len(data)
+        buffer = self.__buffer + data
+        end = 0
+        for match in COMMAND.finditer(buffer):
+            channel, kind, value = int(match.group(1)), match.group(2), int(match.group(3))
+            if kind == b'M':
+                for c in (range(1, 5) if channel == 0 else (channel,)):
+                    self.mode[c] = value
+            else:
+                self.robot.command(channel, value)
+            if self.__trace is not None:
+                self.__trace.write('%.6f %d %s %d\n' % (now, channel, kind.decode('ascii'), value))
+            self.commands += 1
+            end = match.end()
+        buffer = buffer[end:]
+        self.__buffer = buffer[-MAX_COMMAND:] # keep a partial command for the next read
+
+
+class SimNano(PtyDevice):
+    """
+    A python written emulator of the ultrasonic Nano.
+
+    """
+    def __init__(self, robot):
+        """
+        Constructor
+        @param robot: a SimRobot, measured every frame
+        """
+        super().__init__(FRAME_PERIOD/3)
+        self.robot = robot
+        self.binary = False
+        self.seq = 0
+        self.frames = 0 # number of frames sent
+        self.__next = time.monotonic()
+
+    def received(self, data):
+        for byte in data:
+            if byte == ord('B'):
+                self.binary = True
+            elif byte == ord('A'):
+                self.binary = False
+
+    def tick(self):
+        now = time.monotonic()
+        if now < self.__next:
+            return
+        self.__next = max(self.__next + FRAME_PERIOD, now - FRAME_PERIOD) # don't burst after a stall
+        values = self.robot.distances()
+        if self.binary:
+            self.seq = (self.seq + 1) & 0xFF
+            frame = bytearray(FRAME.pack(FRAME_SYNC, self.seq, *(values + [0])))
+            frame[-1] = crc8(frame[1:-1])
+            self.send(bytes(frame))
+        else:
+            self.send((' '.join(str(value) for value in values) + ' \n').encode('utf-8'))
+        self.frames += 1
+
+
+if __name__ == '__main__': # drive the emulated driver through pyserial, watch the Nano frames
+    import serial
+
+    robot = SimRobot(seed=0)
+    driver = SimMotorDriver(robot)
+    nano = SimNano(robot)
+    driver.start()
+    nano.start()
+    motor = serial.Serial(driver.port, 250000, timeout=1)
+    sensor = serial.Serial(nano.port, 9600, timeout=1)
+    motor.write(b'{N0 M6}{N0 P0}')
+    sensor.reset_input_buffer()
+    print('start:', sensor.readline().decode('utf-8').strip())
+    motor.write(b'{N1 P400}{N2 P400}{N3 P300}')
+    time.sleep(2)
+    print('after 2s forward:', sensor.readline().decode('utf-8').strip(), 'x = %.1fcm' % robot.x)
+    sensor.write(b'B')
+    time.sleep(0.1)
+    sensor.reset_input_buffer()
+    frame = sensor.read(FRAME.size*3)
+    print('binary:', frame.hex())
+    motor.write(b'{N0 P0}')
+    time.sleep(1)
+    assert driver.mode[1:] == [6, 6, 6, 6] and driver.commands == 6, (driver.mode, driver.commands)
+    assert robot.x > ROOM[0]/2 + 40 and robot.height[0] > 50 and abs(robot.speed[0]) < 1, (robot.x, robot.height, robot.speed)
+    print('Simulated peripherals OK')
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""------------------------------------------------------------*-
+  Simulated control server for UV Robot
+ --------------------------------------------------------------
+ * Stands in for server_control.py when Flask isn't there: sends
+ * the heartbeat the main process watches and, if a script is
+ * given, the key frames of a browser holding keys down, on the
+ * same control link (see ipc).
+ *
+ * The script is a JSON file given by UVROBOT_WEB_SCRIPT:
+ *      {"loop": false, "steps": [{"secs": 1, "key": "UP"}, ...]}
+ * a list of keys, e.g. "key": ["UP", "LE"], holds them together.
+ * as code.js does, the keys are sent when a step changes them
+ * (0 for a step without key) and resent every KEY_HEARTBEAT
+ * while held.
+ *
+ * With UVROBOT_SIM_TRACE set to a directory, the monotonic time
+ * each step starts is appended to web.log: "<secs> <step> <key>".
+ *
+ --------------------------------------------------------------"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # run as a script from hal/
+from ipc import ControlClient, key_bits
+
+HEARTBEAT_TIME = 0.1 # secs - as server_control.py
+KEY_HEARTBEAT = 0.25 # secs - as HEARTBEAT_MS in code.js
+TRACE = os.environ.get('UVROBOT_SIM_TRACE') # directory of the input traces, None for no trace
+CLIENT = 1 # client id of the scripted browser
+
+
+def main():
+    path = os.environ.get('UVROBOT_WEB_SCRIPT')
+    steps = []
+    loop = False
+    if path:
+        with open(path) as file:
+            script = json.load(file)
+        steps = script['steps']
+        loop = script.get('loop', False)
+    trace = open(os.path.join(TRACE, 'web.log'), 'w', buffering=1) if TRACE else None
+    link = ControlClient()
+    heartbeat = 0
+    held = 0
+    while True:
+        for index, step in enumerate(steps):
+            keys = step.get('key')
+            keys = keys if isinstance(keys, list) else [keys] if keys else []
+            start = time.monotonic()
+            if trace is not None:
+                trace.write('%.6f %d %s\n' % (start, index, '+'.join(keys) or '-'))
+            bits = 0
+            for key in keys:
+                bits |= key_bits(key)
+            if bits != held: # on change only
+                held = bits
+                link.send(CLIENT, held)
+                resent = start
+            end = start + step['secs']
+            while time.monotonic() < end:
+                now = time.monotonic()
+                if held and now - resent >= KEY_HEARTBEAT:
+                    link.send(CLIENT, held)
+                    resent = now
+                if now - heartbeat >= HEARTBEAT_TIME:
+                    link.send(0)
+                    link.replies()
+                    heartbeat = now
+                time.sleep(min(HEARTBEAT_TIME, max(end - time.monotonic(), 0)))
+        if not loop:
+            break
+    while True:
+        link.send(0)
+        link.replies()
+        time.sleep(HEARTBEAT_TIME)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -0,0 +1,10 @@
+"""------------------------------------------------------------*-
+  Init module for the control link
+ --------------------------------------------------------------
+ * Fixed-size key state frames from the web control server to
+ * main.py over a Unix datagram socket, light and speed state
+ * in the replies, delta encoded telemetry back to the server.
+ *
+ --------------------------------------------------------------"""
+from ipc.ipc import ControlLink, ControlClient, KEYS, COMMANDS, LIGHT_ON, LIGHT_OFF, HIGHSPEED, LOWSPEED, ESTOP, key_bits
+from ipc.telemetry import TelemetryPublisher, TelemetryState, FIELDS
@@ -0,0 +1,264 @@
+"""------------------------------------------------------------*-
+  Control link between the web control server and main.py
+ --------------------------------------------------------------
+ * A Unix datagram socket in the abstract namespace, so nothing
+ * is created on the read-only root and nothing is left behind.
+ *
+ * server_control.py (ControlClient) sends REQUEST frames:
+ *      version, flags, client id, seq, buttons, command
+ * - buttons: bitmap of the held keys, bit i is KEYS[i]
+ * - command: one-shot command, index in COMMANDS, 0 for none.
+ *   ESTOP is kept apart, another command can't overwrite it
+ * - flags NO_KEYS: the buttons are not given, e.g. a heartbeat
+ *   or a command, the held keys stay as they are
+ * main.py (ControlLink) answers every frame with a REPLY frame:
+ *      version, flags, client id, seq, light, speed
+ * with the state of the UV lights and of the speed setting.
+ * main.py also sends TELEMETRY frames, see ipc.telemetry, to the
+ * client of the last request. A client with the flag
+ * KEYFRAME_WANTED set asks for a full one.
+ *
+ * A datagram is a whole frame, so there is nothing to parse
+ * nor to queue: the reader thread keeps a state table of the
+ * keys held by each client and the newest command.
+ *
+ * A client sends its keys when they change and resends them as
+ * a heartbeat. Its keys are held until it sends 0, or until its
+ * lease runs out without any frame from it: a lost browser stops
+ * the robot after a known time, a late frame can't release it.
+ * With several clients holding keys, the arbiter of main.py picks
+ * the one that drives.
+ *
+ * Run this file (python3 -m ipc.ipc, from main/) to check both
+ * ends on a private socket.
+ *
+ --------------------------------------------------------------"""
+import os
+import socket
+import struct
+import threading
+import time
+from ipc.telemetry import TelemetryState, is_telemetry, MAX_FRAME
+
+SOCKET = os.environ.get('UVROBOT_CONTROL_SOCKET', '\0uvrobot-control') # leading NUL --> abstract namespace
+VERSION = 1
+REQUEST = struct.Struct('<BBHIHBx') # version, flags, client id, seq, buttons, command
+REPLY = struct.Struct('<BBHIBBxx') # version, flags, client id, seq answered, light, speed
+NO_KEYS = 0x01 # request flag: the buttons field is not given
+KEYFRAME_WANTED = 0x02 # request flag: the client lost telemetry, the next frame must have every field
+
+KEYS = ('UP', 'DO', 'LE', 'RI', 'LU', 'LD', 'RU', 'RD') # bit i of the buttons bitmap, as the signals of code.js
+COMMANDS = (None, 'LO', 'LF', 'HS', 'LS', 'ES') # light on, light off, high speed, low speed, emergency stop
+LIGHT_ON, LIGHT_OFF, HIGHSPEED, LOWSPEED, ESTOP = 1, 2, 3, 4, 5
+READ_TIMEOUT = 0.5 # secs - the reader thread checks it should still run this often
+
+
+def key_bits(signal): # bitmap of a key signal, 0 if unknown
+    return 1 << KEYS.index(signal) if signal in KEYS else 0
+
+
+class ControlLink(threading.Thread):
+    """
+    A python written receiver of control frames, run by main.py.
+
+    """
+    def __init__(self, name=SOCKET, status=None):
+        """
+        Constructor
+        @param name: a string, the socket name, abstract if it starts with NUL
+        @param status: a callable returning (light, speed) for the replies, called on the reader thread
+        """
+        super().__init__()
+        self.daemon = True
+        self.name = name
+        self.status = status
+        self.frames = 0 # number of good frames received
+        self.bad_frames = 0 # wrong size or version
+        self.lost = 0 # frames missing from the sequence numbers of a client
+        self.dropped = 0 # commands the control loop was too slow to see
+        self.expired = 0 # leases run out while the client held keys
+        self.estops = 0 # emergency stops asked
+        self.last = None # time.monotonic() of the newest frame, heartbeats included
+        self.peer = None # address of the client of the last request, the telemetry goes there
+        self.keyframe_wanted = False # set by a client, cleared by the telemetry publisher
+        self.__table = {} # client id --> (buttons, time of its last key frame, time its buttons changed)
+        self.__command = None # (newest command, client id), not taken yet
+        self.__estop = False # an emergency stop was asked, not taken yet
+        self.__seq = {} # client id --> seq of its last frame
+        self.__lock = threading.Lock()
+        self.__running = True
+        if not name.startswith('\0') and os.path.exists(name): # left by a crash
+            os.unlink(name)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(name)
+        self.sock.settimeout(READ_TIMEOUT)
+
+    def run(self):
+        while self.__running:
+            try:
+                data, address = self.sock.recvfrom(REQUEST.size + 1)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            if len(data) != REQUEST.size:
+                self.bad_frames += 1
+                continue
+            version, flags, client, seq, buttons, command = REQUEST.unpack(data)
+            if version != VERSION:
+                self.bad_frames += 1
+                continue
+            self.__take(flags, client, seq, buttons, command)
+            if address: # the client bound a name to get the replies
+                self.peer = address
+                if flags & KEYFRAME_WANTED:
+                    self.keyframe_wanted = True
+                light, speed = self.status() if self.status is not None else (False, False)
+                try:
+                    self.sock.sendto(REPLY.pack(VERSION, 0, client, seq, light, speed), address)
+                except OSError: # the client is gone, it will get the state with its next frame
+                    pass
+
+    def __take(self, flags, client, seq, buttons, command): # reader thread
+        last = self.__seq.get(client)
+        if last is not None and seq > last: # a smaller seq is a restarted client
+            self.lost += seq - last - 1
+        self.__seq[client] = seq
+        with self.__lock:
+            self.last = now = time.monotonic()
+            self.frames += 1
+            if not flags & NO_KEYS:
+                state = self.__table.get(client)
+                if not buttons: # released everything
+                    self.__table.pop(client, None)
+                elif state is None or state[0] != buttons:
+                    self.__table[client] = (buttons, now, now)
+                else: # a heartbeat of the same keys renews the lease
+                    self.__table[client] = (buttons, now, state[2])
+            if command == ESTOP:
+                self.__estop = True
+                self.estops += 1
+            elif 0 < command < len(COMMANDS):
+                if self.__command is not None:
+                    self.dropped += 1
+                self.__command = (COMMANDS[command], client)
+
+    def table(self, lease): # client id --> (buttons, time they changed), of every client holding keys
+        now = time.monotonic()
+        held = {}
+        with self.__lock:
+            for client, (keys, seen, since) in list(self.__table.items()):
+                if now - seen > lease: # gone silent while holding keys
+                    del self.__table[client]
+                    self.expired += 1
+                else:
+                    held[client] = (keys, since)
+        return held
+
+    def command(self): # (newest command signal, client id) since the last call, or (None, None)
+        with self.__lock:
+            command = self.__command
+            self.__command = None
+        return command if command is not None else (None, None)
+
+    def estop(self): # True if an emergency stop was asked since the last call
+        with self.__lock:
+            estop = self.__estop
+            self.__estop = False
+        return estop
+
+    def age(self): # secs since the newest frame, infinite if nothing came yet
+        last = self.last
+        return time.monotonic() - last if last is not None else float('inf')
+
+    def stop(self):
+        self.__running = False
+        self.sock.close()
+        if not self.name.startswith('\0') and os.path.exists(self.name):
+            os.unlink(self.name)
+
+
+class ControlClient(object):
+    """
+    A python written sender of control frames, run by the control server.
+
+    """
+    def __init__(self, name=SOCKET):
+        """
+        Constructor
+        @param name: a string, the socket name of main.py
+        """
+        self.name = name
+        self.light = False # last state replied by main.py
+        self.speed = False # True for high speed
+        self.sent = 0
+        self.errors = 0 # frames main.py wasn't there to take
+        self.telemetry = TelemetryState() # robot state from the telemetry frames
+        self.__seq = {} # client id --> seq of its last frame
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind('\0uvrobot-client-%d' % os.getpid()) # a name, so replies can come back
+        self.sock.setblocking(False)
+
+    def send(self, client, buttons=None, command=0): # never blocks, False if main.py didn't get it. No buttons: a heartbeat
+        seq = self.__seq[client] = (self.__seq.get(client, 0) + 1) & 0xFFFFFFFF
+        flags = (NO_KEYS if buttons is None else 0) | (KEYFRAME_WANTED if self.telemetry.gap else 0)
+        frame = REQUEST.pack(VERSION, flags, client, seq, buttons or 0, command)
+        try:
+            self.sock.sendto(frame, self.name)
+        except OSError: # main.py not started yet, or its socket buffer is full
+            self.errors += 1
+            return False
+        self.sent += 1
+        return True
+
+    def replies(self): # read every reply and telemetry frame waiting, True if the light or speed state changed
+        changed = False
+        while True:
+            try:
+                data = self.sock.recv(MAX_FRAME + 1)
+            except (BlockingIOError, InterruptedError):
+                return changed
+            except OSError:
+                return changed
+            if is_telemetry(data):
+                self.telemetry.apply(data)
+                continue
+            if len(data) != REPLY.size:
+                continue
+            version, flags, client, seq, light, speed = REPLY.unpack(data)
+            if version != VERSION:
+                continue
+            if (bool(light), bool(speed)) != (self.light, self.speed):
+                self.light, self.speed = bool(light), bool(speed)
+                changed = True
+
+
+if __name__ == '__main__': # both ends on a private socket
+    name = '\0uvrobot-control-check-%d' % os.getpid()
+    state = {'light': False}
+    link = ControlLink(name, status=lambda: (state['light'], False))
+    link.start()
+    client = ControlClient(name)
+    assert client.send(1, key_bits('UP')) and client.send(1, key_bits('LU') | key_bits('UP'))
+    assert client.send(2, command=LIGHT_ON)
+    time.sleep(0.1)
+    keys = lambda lease: {client: buttons for client, (buttons, since) in link.table(lease).items()}
+    assert keys(1) == {1: key_bits('UP') | key_bits('LU')}, 'key frames'
+    assert link.command() == ('LO', 2) and link.command() == (None, None), 'commands'
+    client.send(2, key_bits('DO'), command=ESTOP)
+    client.send(1, key_bits('LU') | key_bits('UP')) # a heartbeat, keeps its lease only
+    time.sleep(0.1)
+    assert keys(1) == {1: key_bits('UP') | key_bits('LU'), 2: key_bits('DO')}, 'two clients'
+    assert link.estop() and not link.estop() and link.command() == (None, None), 'emergency stop'
+    client.send(2, 0)
+    time.sleep(0.1)
+    assert keys(1) == {1: key_bits('UP') | key_bits('LU')}, 'release'
+    time.sleep(0.2)
+    assert keys(0.25) == {} and link.expired == 1, 'lease'
+    state['light'] = True
+    client.send(0)
+    time.sleep(0.1)
+    assert keys(1) == {} and link.age() < 0.5, 'heartbeat'
+    assert client.replies() and client.light and not client.replies(), 'replies'
+    link.stop()
+    print('Control link OK: %d frames, %d lost' % (link.frames, link.lost))
@@ -0,0 +1,209 @@
+"""------------------------------------------------------------*-
+  Telemetry frames from main.py to the web control server
+ --------------------------------------------------------------
+ * main.py samples the robot state at a fixed rate and sends it
+ * on the control link (see ipc), to the server that sent the
+ * last request. A TELEMETRY frame is:
+ *      version, flags, seq, mask, values...
+ * - mask: bit i set if FIELDS[i] is in the frame
+ * - values: one int16 per set bit, in the order of FIELDS
+ * - flags TELEMETRY tells it from a REPLY, KEYFRAME marks a
+ *   frame with every field
+ *
+ * Only the fields that changed since the previous frame are
+ * sent, nothing at all if none did. A keyframe goes out every
+ * KEYFRAME_TIME, and at once when the server asks for one: it
+ * saw a gap in the seq, or it just started.
+ *
+ * The frames are sent with MSG_DONTWAIT: when the server is too
+ * slow to read them, they are dropped and counted, the control
+ * loop never waits for it.
+ *
+ --------------------------------------------------------------"""
+import socket
+import struct
+import time
+
+VERSION = 1 # as ipc.VERSION
+TELEMETRY = 0x80 # frame flags, a REPLY has none of them
+KEYFRAME = 0x40
+HEADER = struct.Struct('<BBHI') # version, flags, seq, mask of the fields in the frame
+VALUE = struct.Struct('<h')
+INT16_MIN, INT16_MAX = -32768, 32767
+
+# bit i of the mask, as shown by code.js
+FIELDS = ('pwm_1', 'pwm_2', # wheels, left and right
+          'light', 'speed', 'degraded', # UV relay on, speed setting in pwm, failsafe tripped
+          'limits', # limit switches pressed, see limits.L_UP...
+          'cap', # pwm cap of the governor
+          'd0', 'd1', 'd2', 'd3', 'd4', 'd5', # ultrasonic distances in cm, -1 when stale
+          'tick_100us', # longest tick since the previous sample, in 0.1ms: up to 3.2s
+          'overruns', # ticks over the period since the previous sample
+          'jitter_100us', # worst lateness of a tick start since the previous sample, in 0.1ms
+          'holder', # of the control lease: -1 PS2, 0 nobody, else the web client id
+          'estop') # stopped until every input is released
+MAX_FRAME = HEADER.size + VALUE.size * len(FIELDS)
+KEYFRAME_TIME = 2 # secs between two keyframes
+
+
+def is_telemetry(data): # True for a TELEMETRY frame, False for a REPLY
+    return len(data) >= HEADER.size and data[0] == VERSION and bool(data[1] & TELEMETRY)
+
+
+class TelemetryPublisher(object):
+    """
+    A python written sender of delta encoded telemetry, run by main.py.
+
+    """
+    def __init__(self, link, sample, clock=time.monotonic):
+        """
+        Constructor
+        @param link: the ControlLink, its socket and the address of the server are used
+        @param sample: a callable returning a value per field of FIELDS, called on each publish()
+        @param clock: a callable returning monotonic time in secs
+        """
+        self.link = link
+        self.sample = sample
+        self.clock = clock
+        self.seq = 0
+        self.published = 0 # frames sent
+        self.dropped = 0 # frames the server wasn't there, or was too slow, to take
+        self.keyframes = 0
+        self.__last = [None] * len(FIELDS) # values in the last frame sent
+        self.__peer = None # server the last keyframe went to
+        self.__keyframe = float('-inf') # time of the last keyframe
+
+    def encode(self, values, keyframe=False): # TELEMETRY frame of the changed values, None if nothing changed
+        last = self.__last
+        mask = 0
+        data = []
+        for i, value in enumerate(values):
+            value = int(min(max(value, INT16_MIN), INT16_MAX))
+            if keyframe or value != last[i]:
+                mask |= 1 << i
+                data.append(value)
+                last[i] = value
+        if not mask:
+            return None
+        self.seq = (self.seq + 1) & 0xFFFF
+        flags = TELEMETRY | (KEYFRAME if keyframe else 0)
+        return HEADER.pack(VERSION, flags, self.seq, mask) + struct.pack('<%dh' % len(data), *data)
+
+    def publish(self): # control loop: sample, then send the changes, never blocks
+        peer = self.link.peer
+        if peer is None: # no server yet
+            return
+        now = self.clock()
+        keyframe = (peer != self.__peer or self.link.keyframe_wanted or
+                    now - self.__keyframe >= KEYFRAME_TIME)
+        frame = self.encode(self.sample(), keyframe)
+        if keyframe:
+            self.__peer = peer
+            self.__keyframe = now
+            self.link.keyframe_wanted = False
+            self.keyframes += 1
+        if frame is None:
+            return
+        try:
+            self.link.sock.sendto(frame, socket.MSG_DONTWAIT, peer)
+        except OSError: # buffer full or server gone: the next keyframe catches up
+            self.dropped += 1
+            self.__keyframe = float('-inf')
+            return
+        self.published += 1
+
+
+class TelemetryState(object):
+    """
+    A python written decoder of telemetry frames, run by the control server.
+
+    """
+    def __init__(self):
+        self.values = {} # field name --> newest value, only the fields known so far
+        self.seq = None # of the last frame
+        self.frames = 0
+        self.lost = 0 # frames missing from the seq
+        self.gap = True # a frame was lost, or none came yet: the state needs a keyframe
+
+    def apply(self, data): # a TELEMETRY frame, True if a value changed
+        if len(data) < HEADER.size:
+            return False
+        version, flags, seq, mask = HEADER.unpack_from(data)
+        count = bin(mask).count('1')
+        if version != VERSION or len(data) != HEADER.size + VALUE.size * count or mask >> len(FIELDS):
+            return False
+        if self.seq is not None and seq != (self.seq + 1) & 0xFFFF:
+            self.lost += (seq - self.seq - 1) & 0xFFFF
+            self.gap = True
+        self.seq = seq
+        self.frames += 1
+        if flags & KEYFRAME:
+            self.gap = False
+        values = struct.unpack_from('<%dh' % count, data, HEADER.size)
+        changed = False
+        index = 0
+        for i, name in enumerate(FIELDS):
+            if mask & (1 << i):
+                if self.values.get(name) != values[index]:
+                    self.values[name] = values[index]
+                    changed = True
+                index += 1
+        return changed
+
+    def delta(self, sent): # {field: value} not in, or changed from, the dict of values sent to a client, which is updated
+        changes = {}
+        for name, value in self.values.items():
+            if sent.get(name) != value:
+                changes[name] = sent[name] = value
+        return changes
+
+
+if __name__ == '__main__': # encode on one side, decode on the other, without a socket
+    class FakeLink(object):
+        def __init__(self):
+            self.peer = 'server'
+            self.keyframe_wanted = False
+            self.sock = self
+            self.frames = []
+        def sendto(self, data, flags, address):
+            self.frames.append(data)
+
+    class FakeClock(object):
+        def __init__(self):
+            self.now = 0.0
+        def __call__(self):
+            return self.now
+
+    sample = [0] * len(FIELDS)
+    link = FakeLink()
+    clock = FakeClock()
+    publisher = TelemetryPublisher(link, lambda: sample, clock)
+    state = TelemetryState()
+    publisher.publish() # first frame to a server: a keyframe
+    assert len(link.frames) == 1 and len(link.frames[0]) == MAX_FRAME and is_telemetry(link.frames[0])
+    assert state.apply(link.frames[0]) and not state.gap and state.values['pwm_1'] == 0
+    clock.now += 0.1
+    publisher.publish() # nothing changed
+    assert len(link.frames) == 1, 'no change, no frame'
+    sample[FIELDS.index('pwm_1')] = 250
+    sample[FIELDS.index('d3')] = 40000 # clamped
+    clock.now += 0.1
+    publisher.publish()
+    assert len(link.frames[1]) == HEADER.size + 2 * VALUE.size, 'delta'
+    assert state.apply(link.frames[1]) and state.values['pwm_1'] == 250 and state.values['d3'] == INT16_MAX
+    sent = {}
+    assert state.delta(sent) == state.values and state.delta(sent) == {}, 'first delta is everything'
+    sample[FIELDS.index('pwm_2')] = -120
+    clock.now += 0.1
+    publisher.publish() # lost on the way
+    sample[FIELDS.index('light')] = 1
+    clock.now += 0.1
+    publisher.publish()
+    assert state.apply(link.frames[3]) and state.gap and state.lost == 1, 'gap'
+    link.keyframe_wanted = True # asked by the server
+    clock.now += 0.1
+    publisher.publish()
+    assert state.apply(link.frames[4]) and not state.gap and state.values['pwm_2'] == -120, 'keyframe'
+    assert state.delta(sent) == {'pwm_2': -120, 'light': 1}
+    assert not is_telemetry(bytes(12)) # a REPLY
+    print('Telemetry OK: %d frames, %d keyframes, %d lost' % (state.frames, publisher.keyframes, state.lost))
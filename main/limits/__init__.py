@@ -0,0 +1,8 @@
+"""------------------------------------------------------------*-
+  Init module for the hand limit switches
+ --------------------------------------------------------------
+ * Interrupt driven limit switches: a hit stops the hand at
+ * once and is latched for the control loop.
+ *
+ --------------------------------------------------------------"""
+from limits.limits import LimitSwitches, L_UP, L_DOWN, R_UP, R_DOWN, LEFT, RIGHT
@@ -0,0 +1,130 @@
+"""------------------------------------------------------------*-
+  Limit switch module for the hands of UV Robot
+ --------------------------------------------------------------
+ * The four limit switches pull their pin LOW when hit. Each pin
+ * gets an edge interrupt with a debounce time, and on a hit the
+ * callback, on the GPIO event thread:
+ * - stops the hand through motor.hand_limit(), which jumps the
+ *   writer queue and blocks that direction of the hand,
+ * - sets the bit of the switch in state (pressed now) and in
+ *   latched (hit since the last take()).
+ * The control loop only reads the bitmaps, no GPIO.input().
+ *
+ * Works with RPi.GPIO or any module with the same interface,
+ * e.g. hal.FakeGPIO. Run this file for a check with the fake.
+ *
+ --------------------------------------------------------------"""
+import threading
+
+L_UP = 0x01
+L_DOWN = 0x02
+R_UP = 0x04
+R_DOWN = 0x08
+LEFT = L_UP | L_DOWN
+RIGHT = R_UP | R_DOWN
+
+# switch bit --> (motor channel, direction it stops), Lhand is N3, Rhand is N4, up is positive
+STOPS = {L_UP: (3, 1), L_DOWN: (3, -1), R_UP: (4, 1), R_DOWN: (4, -1)}
+BOUNCE_TIME = 20 # ms
+
+
+class LimitSwitches(object):
+    """
+    A python written interrupt driven set of limit switches.
+
+    """
+    def __init__(self, gpio, motor, pins, bouncetime=BOUNCE_TIME):
+        """
+        Constructor
+        @param gpio: RPi.GPIO, or a fake with the same interface, already in BCM mode
+        @param motor: a MotorUART_PWM, or anything with hand_limit() and hand_unlimit()
+        @param pins: a dict switch bit --> bcm pin
+        @param bouncetime: an integer in ms, edges closer than this are ignored
+        """
+        self.gpio = gpio
+        self.motor = motor
+        self.pins = dict(pins)
+        self.state = 0 # switches pressed now
+        self.latched = 0 # switches hit since the last take()
+        self.hits = 0
+        self.tap = None # callable(bit, pressed) seeing every edge, e.g. a recorder
+        self.__lock = threading.Lock()
+
+        for bit, pin in self.pins.items():
+            gpio.setup(pin, gpio.IN, pull_up_down=gpio.PUD_UP) # pulling up
+            gpio.add_event_detect(pin, gpio.BOTH,
+                                  callback=lambda channel, bit=bit: self.__edge(bit),
+                                  bouncetime=bouncetime)
+        self.resync() # a switch may be pressed already
+
+    def __edge(self, bit): # GPIO event thread
+        channel, direction = STOPS[bit]
+        pressed = self.gpio.input(self.pins[bit]) == self.gpio.LOW
+        if self.tap is not None:
+            self.tap(bit, pressed)
+        if pressed: # hit
+            self.motor.hand_limit(channel, direction) # first, before anything else
+            with self.__lock:
+                self.state |= bit
+                self.latched |= bit
+                self.hits += 1
+        else: # released
+            self.motor.hand_unlimit(channel, direction)
+            with self.__lock:
+                self.state &= ~bit
+
+    def resync(self): # read the levels again, in case a release edge was lost in the debounce time
+        for bit in self.pins:
+            pressed = self.gpio.input(self.pins[bit]) == self.gpio.LOW
+            if pressed != bool(self.state & bit):
+                self.__edge(bit)
+
+    def pressed(self, bits): # True if any of the switches is pressed now
+        return (self.state & bits) != 0
+
+    def take(self): # switches hit since the last call, then forget them
+        with self.__lock:
+            latched = self.latched
+            self.latched = 0
+        return latched
+
+
+if __name__ == '__main__': # check with the fake GPIO backend: python3 limits/limits.py from main/
+    import os
+    import sys
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from hal.fake_gpio import FakeGPIO
+
+    class Motor(object):
+        def __init__(self):
+            self.calls = []
+        def hand_limit(self, channel, direction):
+            self.calls.append(('limit', channel, direction))
+        def hand_unlimit(self, channel, direction):
+            self.calls.append(('unlimit', channel, direction))
+
+    now = [0.0]
+    gpio = FakeGPIO(clock=lambda: now[0])
+    gpio.setmode(gpio.BCM)
+    motor = Motor()
+    limits = LimitSwitches(gpio, motor, {L_UP: 5, L_DOWN: 6, R_UP: 19, R_DOWN: 26})
+
+    gpio.set_input(5, gpio.LOW) # left hand hits its upper switch...
+    now[0] += 0.005
+    gpio.set_input(5, gpio.HIGH) # ...bounces...
+    gpio.set_input(5, gpio.LOW)
+    assert motor.calls == [('limit', 3, 1)], motor.calls
+    assert limits.pressed(L_UP) and not limits.pressed(RIGHT)
+    assert limits.take() == L_UP and limits.take() == 0
+
+    now[0] += 1
+    gpio.set_input(5, gpio.HIGH) # moves away
+    assert not limits.pressed(LEFT) and motor.calls[-1] == ('unlimit', 3, 1)
+
+    gpio.set_input(26, gpio.LOW) # right hand hits the bottom, its release gets lost in the debounce time
+    now[0] += 0.001
+    gpio.set_input(26, gpio.HIGH)
+    assert limits.pressed(R_DOWN)
+    limits.resync()
+    assert not limits.pressed(R_DOWN) and motor.calls[-1] == ('unlimit', 4, -1)
+    print('Limit switches OK:', motor.calls)
@@ -11,13 +11,24 @@
 from server import WebServer
 # import server
 from usb_peripherals import sensor, motor
-from ps2x import ps2
-import RPi.GPIO as GPIO
+from ps2x import ps2, stick
+from scheduler import Scheduler
+from governor import Governor
+from failsafe import Watchdog
+from monitor import stats
+from eventlog import events
+from limits import LimitSwitches, L_UP, L_DOWN, R_UP, R_DOWN, LEFT, RIGHT
+from recorder import Recorder
+from ipc import TelemetryPublisher
+from arbiter import Arbiter, PS2, NOBODY
+import hal
 import subprocess as sp
 import signal
 import os
 import time
 
+GPIO = hal.get('gpio') # RPi.GPIO on the robot, FakeGPIO with UVROBOT_BACKEND=sim
+
 # ---------------------------- Configurable parameters -------------------------
 RELAY_01_PIN = 4  # BCM mode
 
@@ -29,18 +40,42 @@ R_LIMIT_DOWN_PIN = 26 # bcm mode - WARNING
 # for pwm control
 HIGH_SPEED = 600
 LOW_SPEED = 200
-PWM_STEP = 30 # accel must be multiple of PWM_STEP = 10
-ACCEL = 50 # ms
 SAFETY_TIME = 300 #ms --> 1s
-DANGER_FLAG = False
+TURN_RATE = 0.5 # angular speed given by the LEFT/RIGHT arrows, see motor.set_twist()
 FORWARD_FLAG = True # flag for turning, defaut in forward direction
+TWIST = (0.0, 0.0) # last (linear, angular) target, for printing changes only
+
+# for the control loop - period and deadline of each stage, in secs
+LOOP_PERIOD = 0.01 # 100Hz control tick
+INPUT_PERIOD = 0.01
+INPUT_DEADLINE = 0.002
+SENSOR_PERIOD = 0.02 # the reader thread keeps the newest frame, the Nano sends one every ~30ms
+SENSOR_DEADLINE = 0.002
+CMD_PERIOD = 0.01
+CMD_DEADLINE = 0.002
+MOTOR_PERIOD = 0.01
+MOTOR_DEADLINE = 0.002
+HAND_PERIOD = 0.01
+HAND_DEADLINE = 0.002
+GOVERNOR_PERIOD = 0.01 # every tick, so a new sensor frame is acted on at the next one
+GOVERNOR_DEADLINE = 0.002
+RAMP_PERIOD = 0.01
+RAMP_DEADLINE = 0.002
+FLUSH_PERIOD = 0.01 # every command of a tick goes out in one write
+FLUSH_DEADLINE = 0.002
+FAILSAFE_PERIOD = 0.01
+FAILSAFE_DEADLINE = 0.002
+STICK_RELOAD_PERIOD = 1 # check ps2x/response.json for changes every second
+LIMITS_RESYNC_PERIOD = 0.5 # re-read the limit switches, in case an edge was lost in the debounce time
+TELEMETRY_RATE = float(os.environ.get('UVROBOT_TELEMETRY_RATE', 10)) # Hz, robot state pushed to the web clients, 0 for none
+TELEMETRY_DEADLINE = 0.002
+ARBITER_PERIOD = 0.01 # every tick, right after the inputs
+ARBITER_DEADLINE = 0.001
+RECORD_PATH = os.environ.get('UVROBOT_RECORD') # e.g. /tmp/MIS_logs/session.uvrl to record the session for recorder/replay.py
 
 millis = lambda: int(time.time() * 1000)
 # --------------------------- Set Up ----------------------------------------
 # start to count time
-U_watchdog = D_watchdog = L_watchdog = R_watchdog = A_watchdog = millis() # monitoring interval for arrow buttons
-STOP_millis = millis() # time flag to trigger auto stop
-
 # L1_watchdog = L2_watchdog = R1_watchdog = R2_watchdog = millis() # monitoring interval for L, R buttons
 # L1_FLAG = L2_FLAG = R1_FLAG = R2_FLAG = True
 SQ_watchdog = millis() # monitor interval for SQUARE button
@@ -50,10 +85,45 @@ MIN_HEIGHT = 30 #cm
 LR_PRESS_FLAG = True
 L_UL_FLAG = False # will be automatically updated to true
 R_UL_FLAG = False # will be automatically updated to true
+SENSOR_STALE = False # the ultrasonic sample is too old, see sensor.stale()
+LOOP_OVERRUNS = 0 # loop overruns at the last telemetry sample
+HOLDER = NOBODY # of the control lease on the last tick, see arbitrate()
+
+# staleness budgets, in secs: past that without a frame the robot goes to degraded mode
+SENSOR_BUDGET = 0.5 # Nano frame every ~30ms
+MOTOR_BUDGET = 2.5 # the driver gets a refresh frame at least every second
+PS2_BUDGET = 0.5 # ps2x resends its state every 100ms
+PS2_HEARTBEAT = 0.1 # an old ps2x binary sends on changes only: watched once this heartbeat is seen, see ps2_bin_reset.sh
+WEB_BUDGET = 2 # server_control.py sends a heartbeat every 0.1s
 
 
 # server initialize
 sv = WebServer()
+# caps motor.MAX_PWM by the distance to obstacles, speed settings go to governor.speed
+governor = Governor(motor, sensor)
+limits = None # LimitSwitches, needs the GPIO mode set in gpio_init()
+recorder = Recorder(RECORD_PATH) if RECORD_PATH else None
+telemetry = TelemetryPublisher(sv.link, None) # sampled by telemetry_sample(), see control_loop()
+
+# events of the control loop, formatted and written by the events thread, never printed from the loop
+EV_SQUARE_RELEASED = events.event('square.released', 'SQUARE released')
+EV_START = events.event('start', 'START pressed - relays turned off')
+EV_HIGH_SPEED = events.event('high_speed', 'TRIANGLE pressed - high speed mode')
+EV_LOW_SPEED = events.event('low_speed', 'CROSS pressed - low speed mode')
+EV_SQUARE = events.event('square', 'SQUARE pressed')
+EV_RELAYS = events.event('relays', 'relays toggled')
+EV_LIGHTS_BLOCKED = events.event('lights.blocked', 'UV lights stay off in degraded mode')
+EV_TWIST = events.event('twist', 'twist %.2f %.2f', scale=1000) # every change of the stick, rate limited
+EV_SENSOR_STALE = events.event('sensor.stale', 'Ultrasonic data stale (%.2fs old) - hands stopped', scale=1000)
+EV_LHAND_RELEASED = events.event('lhand.released', 'Left Hand Released')
+EV_RHAND_RELEASED = events.event('rhand.released', 'Right Hand Released')
+EV_LHAND_UP = events.event('lhand.up', 'L1 pressed - Lhand move up')
+EV_LHAND_DOWN = events.event('lhand.down', 'L2 pressed - Lhand move down')
+EV_RHAND_UP = events.event('rhand.up', 'R1 pressed - Rhand move up')
+EV_RHAND_DOWN = events.event('rhand.down', 'R2 pressed - Rhand move down')
+EV_ESTOP = events.event('estop', 'EMERGENCY STOP - everything off until every input is released', rate=None)
+EV_LEASE = events.event('lease', lambda a, b: 'control lease: ' + ('PS2' if a == PS2 else
+                                                                  'web client %d' % a if a != NOBODY else 'nobody'))
 
 # =================================== admin command =============================================
 def cmd_update():
@@ -61,170 +131,128 @@ def cmd_update():
 
     if sv.buttonPressing():
         if sv.pressed(sv.LIGHT_ON):
-            GPIO.output(RELAY_01_PIN, GPIO.LOW) # turn on the relay
+            relay_on()
         elif sv.pressed(sv.LIGHT_OFF):
             GPIO.output(RELAY_01_PIN, GPIO.HIGH) # turn off the relay
         elif sv.pressed(sv.LOWSPEED):
-            motor.MAX_PWM = LOW_SPEED
+            governor.speed = LOW_SPEED
         elif sv.pressed(sv.HIGHSPEED):
-            motor.MAX_PWM = HIGH_SPEED
+            governor.speed = HIGH_SPEED
 
     # ------------ Confirm release buttons ---------------------
     if ps2.released(ps2.SQUARE):
-        print('SQUARE released')
+        events.log(EV_SQUARE_RELEASED)
         SQ_FLAG = True # reset flag for next use
 
     # ------------- Confirm pressing buttons -------------------
     if ps2.cmdPressing():
          # --- START - turn off all relays
         if ps2.pressed(ps2.START):
-            print('START pressed - relays turned off')
+            events.log(EV_START)
             GPIO.output(RELAY_01_PIN, GPIO.HIGH) # turn off the relay
             
         # --- TRIANGLE - high speed
         if ps2.pressed(ps2.TRIANGLE):
-            print('TRIANGLE pressed - high speed mode')
-            motor.MAX_PWM = HIGH_SPEED
+            events.log(EV_HIGH_SPEED)
+            governor.speed = HIGH_SPEED
         # --- CROSS - low speed
         if ps2.pressed(ps2.CROSS):
-            print('CROSS pressed - low speed mode')
-            motor.MAX_PWM = LOW_SPEED
+            events.log(EV_LOW_SPEED)
+            governor.speed = LOW_SPEED
         # --- SQUARE - turn on UV lights
         if ps2.pressed(ps2.SQUARE):
-            print('SQUARE pressed')
+            events.log(EV_SQUARE)
             SQ_watchdog = millis() # for recalculating interval
         elif ps2.isPressing(ps2.SQUARE) & ((millis() - SQ_watchdog) > SAFETY_TIME*2) & SQ_FLAG:
-            print('relays toggled')
+            events.log(EV_RELAYS)
             if GPIO.input(RELAY_01_PIN)==GPIO.LOW: # toggle
                 GPIO.output(RELAY_01_PIN, GPIO.HIGH) # turn off the relay
             else:
-                GPIO.output(RELAY_01_PIN, GPIO.LOW) # turn on the relay
+                relay_on()
             SQ_FLAG = False
 
+def relay_on(): # turn on the UV lights, never in degraded mode
+    if watchdog.degraded:
+        events.log(EV_LIGHTS_BLOCKED)
+        return
+    GPIO.output(RELAY_01_PIN, GPIO.LOW) # turn on the relay
+
 # =================================== motor control =============================================
 def motor_controller():
-    global DANGER_FLAG, FORWARD_FLAG, STOP_millis, U_watchdog, D_watchdog, L_watchdog, R_watchdog, A_watchdog
-    
+    global FORWARD_FLAG, TWIST
+    linear = angular = 0.0 # no input --> ramp down to a stop
+
     # ================== Digital control ==================
     if ps2.arrowPressing() or sv.arrowPressing():
-        # --- UP
-        if ((ps2.isPressing(ps2.UP) or sv.isPressing(sv.UP))
-         & ((millis() - U_watchdog) > ACCEL)):
-            print('UP pressed')
-            motor.move_fw(PWM_STEP) # increasing algorithm integrated
-            U_watchdog = millis() # for recalculating interval
-            FORWARD_FLAG = True
-        # --- DOWN
-        if ((ps2.isPressing(ps2.DOWN) or sv.isPressing(sv.DOWN))
-         & ((millis() - D_watchdog) > ACCEL)):
-            print('DOWN pressed')
-            motor.move_bw(PWM_STEP) # increasing algorithm integrated
-            D_watchdog = millis() # for recalculating interval
-            FORWARD_FLAG = False
-        # --- LEFT
-        if ((ps2.isPressing(ps2.LEFT) or sv.isPressing(sv.LEFT))
-         & ((millis() - L_watchdog) > ACCEL)):
-            print('LEFT pressed')
-            motor.turn_left(FORWARD_FLAG,PWM_STEP) # increasing algorithm integrated
-            L_watchdog = millis() # for recalculating interval
-        # --- RIGHT
-        if ((ps2.isPressing(ps2.RIGHT) or sv.isPressing(sv.RIGHT))
-         & ((millis() - R_watchdog) > ACCEL)):
-            print('RIGHT pressed')
-            motor.turn_right(FORWARD_FLAG,PWM_STEP) # increasing algorithm integrated
-            R_watchdog = millis() # for recalculating interval
-        # whether what arrow buttons are pressed, they created movement
-        # so turn on dangerous flag for release motor mechanism 
-        DANGER_FLAG = True
-        STOP_millis = millis() # reset the flag so the motor won't stop
+        if ps2.isPressing(ps2.UP) or sv.isPressing(sv.UP):
+            linear += 1
+        if ps2.isPressing(ps2.DOWN) or sv.isPressing(sv.DOWN):
+            linear -= 1
+        if ps2.isPressing(ps2.LEFT) or sv.isPressing(sv.LEFT):
+            angular += TURN_RATE
+        if ps2.isPressing(ps2.RIGHT) or sv.isPressing(sv.RIGHT):
+            angular -= TURN_RATE
     # ================== Analog control ==================
-    elif ps2.LstickTouched() & ((millis() - A_watchdog) > ACCEL):
-        # print(ps2.LstickRead())
+    elif ps2.LstickTouched(): # the stick position is the speed, through the deadzone and expo tables
         [Lx, Ly] = ps2.LstickRead()
-        if Ly < 127: # moving forward
-            if Ly < 40:
-                print('forward+++')
-                motor.move_fw(PWM_STEP*2) # increasing algorithm integrated
-            elif Ly < 80: # 40 < Ly < 80
-                print('forward++')
-                motor.move_fw(PWM_STEP) # increasing algorithm integrated
-            else: # 80 < Ly < 127
-                print('forward+')
-                motor.move_fw(PWM_STEP/2) # increasing algorithm integrated
-            FORWARD_FLAG = True
-        elif Ly > 127: # moving backward
-            if Ly > 210:
-                print('backward+++')
-                motor.move_bw(PWM_STEP*2) # increasing algorithm integrated
-            elif Ly > 170: # 210 > Ly > 170
-                print('backward++')
-                motor.move_bw(PWM_STEP) # increasing algorithm integrated
-            else: # 170 > Ly > 127
-                print('backward+')
-                motor.move_bw(PWM_STEP/2) # increasing algorithm integrated
-            FORWARD_FLAG = False
-        
-        # for motor driver catching the information
-        time.sleep(0.001)  # sleep for 1ms
-
-        if Lx < 128: # turning left
-            if Lx < 40:
-                print('turn left+++')
-                motor.turn_left(FORWARD_FLAG,PWM_STEP*2) # increasing algorithm integrated
-            elif Lx < 80: # 40 < Lx < 80
-                print('turn left++')
-                motor.turn_left(FORWARD_FLAG,PWM_STEP) # increasing algorithm integrated
-            else: # 80 < Lx < 127
-                print('turn left+')
-                motor.turn_left(FORWARD_FLAG,PWM_STEP/2) # increasing algorithm integrated
-        elif Lx > 128: # turning right
-            if Lx > 210:
-                print('turn right+++')
-                motor.turn_right(FORWARD_FLAG,PWM_STEP*2) # increasing algorithm integrated
-            elif Lx > 170: # 210 > Lx > 170
-                print('turn right++')
-                motor.turn_right(FORWARD_FLAG,PWM_STEP) # increasing algorithm integrated
-            else: # 170 > Lx > 127
-                print('turn right+')
-                motor.turn_right(FORWARD_FLAG,PWM_STEP/2) # increasing algorithm integrated
-
-        #  turn on dangerous flag for release motor mechanism 
-        DANGER_FLAG = True
-        STOP_millis = A_watchdog = millis() # reset the flag so the motor won't stop
-    
-
-    # ================== Safety control ==================
-    if (DANGER_FLAG) & ((millis() - STOP_millis) > SAFETY_TIME): # if time flag isn't gotten reset, then stop
-        print('Releasing...')
-        DANGER_FLAG = motor.release() # will only return False when stopped
-        if not DANGER_FLAG:
-            print('motor stopped!')
+        linear, angular = stick.read(Lx, Ly)
+
+    if watchdog.degraded: # a peripheral went silent: ramp down to a stop
+        linear = angular = 0.0
+
+    if linear > 0:
+        FORWARD_FLAG = True
+    elif linear < 0:
+        FORWARD_FLAG = False
+    elif angular != 0: # turning only: one wheel drives, in the last moving direction
+        linear = abs(angular) if FORWARD_FLAG else -abs(angular)
+    if linear < 0: # backward, LEFT still drives the right wheel harder, like before
+        angular = -angular
+
+    if (linear, angular) != TWIST:
+        events.log(EV_TWIST, linear*1000, angular*1000)
+        TWIST = (linear, angular)
+    motor.set_twist(linear, angular) # ramped by motor.update(), after the governor capped the speed
 
 # =================================== init gpio, including relays =============================================
 def gpio_init():
     # GPIO.cleanup()
     GPIO.setmode(GPIO.BCM)
     GPIO.setup(RELAY_01_PIN, GPIO.OUT, initial=GPIO.HIGH) # relay init
-    GPIO.setup(L_LIMIT_UP_PIN, GPIO.IN, pull_up_down = GPIO.PUD_UP) # pulling up
-    GPIO.setup(L_LIMIT_DOWN_PIN, GPIO.IN, pull_up_down = GPIO.PUD_UP) # pulling up
-    GPIO.setup(R_LIMIT_UP_PIN, GPIO.IN, pull_up_down = GPIO.PUD_UP) # pulling up
-    GPIO.setup(R_LIMIT_DOWN_PIN, GPIO.IN, pull_up_down = GPIO.PUD_UP) # pulling up
+    global limits
+    # pulled up, a hit stops the hand from the GPIO interrupt and is latched for hand_controller()
+    limits = LimitSwitches(GPIO, motor, {L_UP: L_LIMIT_UP_PIN,
+                                         L_DOWN: L_LIMIT_DOWN_PIN,
+                                         R_UP: R_LIMIT_UP_PIN,
+                                         R_DOWN: R_LIMIT_DOWN_PIN})
 
 # =================================== ultrasonic update =============================================
 def ultrasonic_update():
-    global L_UL_FLAG, R_UL_FLAG
-    sensorval = sensor.read()
-    # print(sensorval)
+    global L_UL_FLAG, R_UL_FLAG, SENSOR_STALE
+    sensorval, age = sensor.read() # newest sample from the reader thread, never waits
+    # print(sensorval, age)
+    if sensor.stale(): # no fresh distance: never move the hands down blind
+        if not SENSOR_STALE:
+            events.log(EV_SENSOR_STALE, age*1000)
+            motor.Lhand_stop()
+            motor.Rhand_stop()
+        SENSOR_STALE = True
+        L_UL_FLAG = R_UL_FLAG = False
+        return
+    SENSOR_STALE = False
+    sensorval = sensor.history.median() # a single spike can't stop a hand
+    if sensorval is None: # history just restarted after a gap
+        return
 
     # left hand ultrasonics sensor
-    if int(sensorval[0]) > MIN_HEIGHT: # if sensor is greater than MIN_HEIGHT cm 
+    if sensorval[0] > MIN_HEIGHT: # if sensor is greater than MIN_HEIGHT cm 
         L_UL_FLAG = True
     else: # sensor value < MIN_HEIGHT
         L_UL_FLAG = False
         motor.Lhand_stop() # motor stop
 
     # right hand ultrasonics sensor
-    if int(sensorval[1]) > MIN_HEIGHT: # if sensor is greater than MIN_HEIGHT cm 
+    if sensorval[1] > MIN_HEIGHT: # if sensor is greater than MIN_HEIGHT cm 
         R_UL_FLAG = True
     else: # sensor value < MIN_HEIGHT
         R_UL_FLAG = False
@@ -234,66 +262,186 @@ def ultrasonic_update():
 def hand_controller():
 
     global LR_PRESS_FLAG
+    hits = limits.take() # limit switches hit since the last tick, the hand is already stopped
     # ------------ Confirm release buttons ---------------------
     if ((ps2.released(ps2.L1) or
         ps2.released(ps2.L2) or
         sv.released(sv.LHAND_UP) or
         sv.released(sv.LHAND_DOWN) or
-        GPIO.input(L_LIMIT_UP_PIN)==GPIO.LOW or 
-        GPIO.input(L_LIMIT_DOWN_PIN)==GPIO.LOW) and LR_PRESS_FLAG):
-        print('Left Hand Released')
+        hits & LEFT) and LR_PRESS_FLAG):
+        events.log(EV_LHAND_RELEASED)
         LR_PRESS_FLAG = False
         motor.Lhand_stop() # motor stop
     if ((ps2.released(ps2.R1) or
         ps2.released(ps2.R2) or
         sv.released(sv.RHAND_UP) or
         sv.released(sv.RHAND_DOWN) or
-        GPIO.input(R_LIMIT_UP_PIN)==GPIO.LOW or 
-        GPIO.input(R_LIMIT_DOWN_PIN)==GPIO.LOW) and LR_PRESS_FLAG):
-        print('Right Hand Released')
+        hits & RIGHT) and LR_PRESS_FLAG):
+        events.log(EV_RHAND_RELEASED)
         LR_PRESS_FLAG = False
         motor.Rhand_stop() # motor stop
 
+    if watchdog.degraded: # hands stay stopped until every peripheral is back
+        return
+
     # ------------- Confirm pressing buttons -------------------
     if ps2.LRpressing() or sv.LRpressing():
         LR_PRESS_FLAG = True
         # --- L1 pressed - Lhand move up
         if ((ps2.pressed(ps2.L1) or sv.pressed(sv.LHAND_UP)) and 
-            GPIO.input(L_LIMIT_UP_PIN)==GPIO.HIGH):
-            print('L1 pressed - Lhand move up')
+            not limits.pressed(L_UP)):
+            events.log(EV_LHAND_UP)
             motor.Lhand_up() # motor move up
         # --- L2 pressed - Lhand move down
         elif ((ps2.pressed(ps2.L2) or sv.pressed(sv.LHAND_DOWN)) and 
-            GPIO.input(L_LIMIT_DOWN_PIN)==GPIO.HIGH and L_UL_FLAG):
-            print('L2 pressed - Lhand move down')
+            not limits.pressed(L_DOWN) and L_UL_FLAG):
+            events.log(EV_LHAND_DOWN)
             motor.Lhand_down() # motor move down
         
         # --- R1 pressed - Rhand move up
         if ((ps2.pressed(ps2.R1) or sv.pressed(sv.RHAND_UP)) and
-            GPIO.input(R_LIMIT_UP_PIN)==GPIO.HIGH):
-            print('R1 pressed - Rhand move up')
+            not limits.pressed(R_UP)):
+            events.log(EV_RHAND_UP)
             motor.Rhand_up() # motor move up
         # --- R2 pressed - Rhand move down
         elif ((ps2.pressed(ps2.R2) or sv.pressed(sv.RHAND_DOWN)) and
-            GPIO.input(R_LIMIT_DOWN_PIN)==GPIO.HIGH and R_UL_FLAG):
-            print('R2 pressed - Rhand move down')
+            not limits.pressed(R_DOWN) and R_UL_FLAG):
+            events.log(EV_RHAND_DOWN)
             motor.Rhand_down() # motor move down
 
+# =================================== degraded mode =============================================
+def failsafe_degraded(stale): # a peripheral went silent, drive ramps down in motor_controller()
+    GPIO.output(RELAY_01_PIN, GPIO.HIGH) # turn off the relay
+    motor.Lhand_stop()
+    motor.Rhand_stop()
+
+def failsafe_recovered(): # control is back, the UV lights have to be turned on again by hand
+    pass
+
+watchdog = Watchdog(failsafe_degraded, failsafe_recovered, stats)
+
+# =================================== control lease =============================================
+def emergency_stop(): # from the PS2 SELECT button or any web client, ahead of everything queued
+    motor.stop()
+    GPIO.output(RELAY_01_PIN, GPIO.HIGH) # turn off the relay
+    events.log(EV_ESTOP)
+    if recorder is not None:
+        recorder.estop()
+
+arbiter = Arbiter(emergency_stop)
+
+def arbitrate(): # only the holder of the lease reaches cmd_update(), motor_controller() and hand_controller()
+    global HOLDER
+    web = {client: since for client, (buttons, since) in sv.held.items()}
+    buttons, Lsticks = ps2.frame # as sent, ps2.buttons may have been muted on the last tick
+    moved = stick.read(Lsticks >> 8, Lsticks & 0x00FF) != (0.0, 0.0) # a stick resting off center, inside the deadzone, is idle
+    holder = arbiter.update(buttons != 0xFFFF or moved, web,
+                            sv.estop or not buttons & ps2.SELECT) # held SELECT: one stop, until released
+    if holder != PS2: # idle anyway, unless stopped: what it still holds is ignored
+        ps2.buttons = 0xFFFF # all button released
+        ps2.Lsticks = 0x807F # stable state of the analog stick
+    # nobody drives: the light and speed commands of any web client still count
+    sv.select(holder if holder > 0 else None, holder == NOBODY and not arbiter.estopped)
+    if holder != HOLDER:
+        events.log(EV_LEASE, holder)
+        HOLDER = holder
+
+# =================================== telemetry =============================================
+def telemetry_sample(loop): # a value per field of ipc.telemetry.FIELDS, only the changed ones are sent
+    global LOOP_OVERRUNS
+    distances, age = sensor.read()
+    if sensor.stale():
+        distances = (-1,) * len(distances)
+    overruns = loop.overruns - LOOP_OVERRUNS
+    LOOP_OVERRUNS = loop.overruns
+    return ((motor.pwm_1, motor.pwm_2,
+             GPIO.input(RELAY_01_PIN) == GPIO.LOW, governor.speed, watchdog.degraded,
+             limits.state, governor.cap) +
+            tuple(distances) +
+            (loop.peak() * 10000, overruns, loop.jitter() * 10000, # 0.1ms units
+             HOLDER, arbiter.estopped))
+
 # =================================================================================================
 
 
 def main():  # Main program block
     gpio_init()
-    
+    stats.install(signal.SIGUSR1) # sudo kill -USR1 <pid> to print the loop latency stats
+    events.install(signal.SIGUSR2) # sudo kill -USR2 <pid> to dump the event ring to /tmp/MIS_logs
+    events.start()
+    stats.gauge('ps2.dropped', ps2.dropped)
+    stats.gauge('sv.dropped', sv.dropped)
+    stats.gauge('sv.expired', sv.expired)
+    stats.gauge('sensor.age', sensor.age)
+    stats.gauge('sensor.bad_frames', lambda: sensor.bad_frames)
+    stats.gauge('ps2.bad_frames', lambda: ps2.bad_frames)
+    stats.gauge('failsafe.trips', lambda: watchdog.trips)
+    stats.gauge('limits.hits', lambda: limits.hits)
+    stats.gauge('events.suppressed', lambda: sum(events.suppressed))
+    stats.gauge('events.lost', lambda: events.lost)
+    stats.gauge('governor.cap', lambda: governor.cap)
+    stats.gauge('governor.limited', lambda: governor.limited)
+    stats.gauge('motor.sent', lambda: motor.sent)
+    stats.gauge('motor.suppressed', lambda: motor.suppressed)
+    stats.gauge('motor.queue_depth', motor.writer.depth)
+    stats.gauge('motor.queue_max', lambda: motor.writer.max_depth)
+    stats.gauge('motor.overwritten', lambda: motor.writer.overwritten)
+    stats.gauge('motor.write_errors', lambda: motor.writer.errors)
+    stats.gauge('telemetry.published', lambda: telemetry.published)
+    stats.gauge('telemetry.dropped', lambda: telemetry.dropped)
+    stats.gauge('arbiter.handovers', lambda: arbiter.handovers)
+    stats.gauge('arbiter.estops', lambda: arbiter.estops)
+
+    watchdog.watch('sensor', sensor.age, SENSOR_BUDGET)
+    watchdog.watch('motor', motor.age, MOTOR_BUDGET)
+    watchdog.watch('ps2x', ps2.age, PS2_BUDGET, PS2_HEARTBEAT)
+    watchdog.watch('web', sv.age, WEB_BUDGET)
+    # light and speed state in the replies to the web control server
+    sv.link.status = lambda: (GPIO.input(RELAY_01_PIN) == GPIO.LOW, governor.speed == HIGH_SPEED)
+
+    if recorder is not None: # every sample, edge and frame, from the threads producing them
+        for frame in sensor.history.ordered(): # what the filters start from
+            recorder.sensor(frame)
+        for bit in limits.pins: # pressed before the recording started
+            if limits.pressed(bit):
+                recorder.limit(bit, True)
+        sensor.tap = recorder.sensor
+        limits.tap = recorder.limit
+        motor.writer.tap = recorder.motor
+        motor.refresh() # a replay starts from a full frame too
+
     # forever loop start...
-    while True:
-        ps2.update()
-        sv.update()
-        ultrasonic_update()
+    control_loop().run()
 
-        cmd_update()
-        motor_controller()
-        hand_controller()
+def control_loop(clock=time.monotonic, sleep=time.sleep, tasks={}):
+    """
+    Every stage of the robot, in order, on a Scheduler
+    @param clock: a callable returning monotonic time in secs
+    @param sleep: a callable used to wait for the next tick
+    @param tasks: a dict task name --> callable used instead of its callback, e.g. recorded inputs in a replay
+    """
+    loop = Scheduler(LOOP_PERIOD, clock, sleep, stats=stats)
+    motor.clock = lambda: loop.now # ramps and refreshes on the tick time, not on when their task happens to run
+    add = lambda name, callback, period, deadline=None: loop.add(name, tasks.get(name, callback), period, deadline)
+    add('ps2.update', ps2.update, INPUT_PERIOD, INPUT_DEADLINE) # latest frame only, never waits for the ps2x process
+    add('sv.update', sv.update, INPUT_PERIOD, INPUT_DEADLINE) # latest signal only, never waits for the control server
+    add('arbitrate', arbitrate, ARBITER_PERIOD, ARBITER_DEADLINE) # one input at a time from here on
+    add('ultrasonic_update', ultrasonic_update, SENSOR_PERIOD, SENSOR_DEADLINE)
+    add('failsafe', watchdog.update, FAILSAFE_PERIOD, FAILSAFE_DEADLINE) # before anything acts on the inputs
+    if recorder is not None:
+        add('recorder', lambda: recorder.tick(loop, ps2, sv, watchdog.degraded), LOOP_PERIOD)
+    add('cmd_update', cmd_update, CMD_PERIOD, CMD_DEADLINE)
+    add('motor_controller', motor_controller, MOTOR_PERIOD, MOTOR_DEADLINE)
+    add('governor.update', governor.update, GOVERNOR_PERIOD, GOVERNOR_DEADLINE)
+    add('motor.update', motor.update, RAMP_PERIOD, RAMP_DEADLINE) # ramp toward the twist, at motor.accel and motor.decel
+    add('hand_controller', hand_controller, HAND_PERIOD, HAND_DEADLINE)
+    add('motor.flush', motor.flush, FLUSH_PERIOD, FLUSH_DEADLINE)
+    add('stick.reload', stick.reload, STICK_RELOAD_PERIOD) # tune the stick feel without restarting
+    add('limits.resync', limits.resync, LIMITS_RESYNC_PERIOD)
+    if TELEMETRY_RATE > 0: # last, so it shows what this tick did
+        telemetry.sample = lambda: telemetry_sample(loop)
+        add('telemetry', telemetry.publish, 1.0 / TELEMETRY_RATE, TELEMETRY_DEADLINE)
+    return loop
 
 
 if __name__ == '__main__':
@@ -304,17 +452,28 @@ if __name__ == '__main__':
         GPIO.cleanup()
         ps2.clean()
         motor.clean()
+        sensor.clean()
         sv.shutdown()
+        if recorder is not None:
+            recorder.close()
+        events.stop()
         # turn on ro
-        sp.call(['sudo','mount','-o','remount,ro','/'], shell=False)
-        sp.call(['sudo','mount','-o','remount,ro','/boot'], shell=False)
+        if not hal.simulated(): # only the robot runs from a read-only root
+            sp.call(['sudo','mount','-o','remount,ro','/'], shell=False)
+            sp.call(['sudo','mount','-o','remount,ro','/boot'], shell=False)
         
     except (OSError, Exception) as e: # I/O error or exception
         print(e)
+        print('Event log dumped to', events.dump('after %s' % type(e).__name__))
         GPIO.cleanup()
         ps2.clean()
         motor.clean()
+        sensor.clean()
         sv.shutdown()
+        if recorder is not None:
+            recorder.close()
+        events.stop()
         # turn on ro
-        sp.call(['sudo','mount','-o','remount,ro','/'], shell=False)
-        sp.call(['sudo','mount','-o','remount,ro','/boot'], shell=False)
+        if not hal.simulated(): # only the robot runs from a read-only root
+            sp.call(['sudo','mount','-o','remount,ro','/'], shell=False)
+            sp.call(['sudo','mount','-o','remount,ro','/boot'], shell=False)
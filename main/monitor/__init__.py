@@ -0,0 +1,12 @@
+"""------------------------------------------------------------*-
+  Init module for the loop latency monitor
+ --------------------------------------------------------------
+ * Shared registry of stage latency histograms, so any module
+ * (main loop, motor driver, ...) records into the same place.
+ *
+ * Get a snapshot with: sudo kill -USR1 <pid of main.py>
+ *
+ --------------------------------------------------------------"""
+from monitor.monitor import Monitor, Histogram
+
+stats = Monitor()
@@ -0,0 +1,143 @@
+"""------------------------------------------------------------*-
+  Loop latency monitor module for UV Robot
+ --------------------------------------------------------------
+ * Low-overhead timing of each stage of the control loop.
+ *
+ * Durations are recorded in microseconds into fixed-size
+ * histograms with 4 logarithmic buckets per octave (~19% wide),
+ * covering 1us up to ~16s. Recording is a couple of integer
+ * operations and a list increment, so it can stay on in
+ * production. Percentiles are only computed when a snapshot
+ * is requested.
+ *
+ * Get a snapshot of a running robot with:
+ *      sudo kill -USR1 <pid of main.py>
+ * The summary is printed and saved to SNAPSHOT_FILE.
+ *
+ --------------------------------------------------------------"""
+import json
+import os
+import signal
+import time
+
+SNAPSHOT_DIR = '/tmp/MIS_logs' # tmpfs, since the root filesystem is read-only
+SNAPSHOT_FILE = SNAPSHOT_DIR + '/loop_stats.json'
+
+SUB_BITS = 2 # 2^SUB_BITS buckets per octave
+BUCKETS = 96 # enough for 2^24 us
+
+
+def _bucket_floor(index): # smallest value in us that falls into the given bucket
+    if index < 8:
+        return index
+    octave = (index >> SUB_BITS) + 2
+    return (4 | (index & 3)) << (octave - 3)
+
+
+class Histogram(object):
+    """
+    A fixed-size log-bucketed histogram of durations.
+
+    """
+    def __init__(self, name, deadline=None):
+        """
+        Constructor
+        @param name: a string used for reporting
+        @param deadline: a float in secs, longer durations count as overruns
+        """
+        self.name = name
+        self.deadline_us = int(deadline * 1000000) if deadline else None
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.max_us = 0
+        self.overruns = 0
+
+    def record(self, duration): # duration in secs, as given by time.monotonic() differences
+        us = int(duration * 1000000)
+        if us < 8:
+            index = us
+        else:
+            octave = us.bit_length()
+            index = ((octave - 2) << SUB_BITS) | ((us >> (octave - 3)) & 3)
+            if index >= BUCKETS:
+                index = BUCKETS - 1
+        self.counts[index] += 1
+        self.count += 1
+        if us > self.max_us:
+            self.max_us = us
+        if self.deadline_us is not None and us > self.deadline_us:
+            self.overruns += 1
+
+    def percentile(self, p): # upper bound in us of the bucket holding the p-th percentile
+        if self.count == 0:
+            return 0
+        rank = p * self.count / 100.0
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(_bucket_floor(index + 1), self.max_us)
+        return self.max_us
+
+    def reset(self):
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.max_us = 0
+        self.overruns = 0
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'p50_ms': self.percentile(50) / 1000.0,
+            'p99_ms': self.percentile(99) / 1000.0,
+            'max_ms': self.max_us / 1000.0,
+            'deadline_ms': self.deadline_us / 1000.0 if self.deadline_us is not None else None,
+            'overruns': self.overruns,
+        }
+
+
+class Monitor(object):
+    """
+    A registry of named histograms, one per stage of the loop.
+
+    """
+    def __init__(self):
+        self.histograms = {}
+        self.gauges = {} # name --> callable returning a number, read only at snapshot time
+        self.started = time.monotonic()
+
+    def histogram(self, name, deadline=None): # get or create the histogram for a stage
+        hist = self.histograms.get(name)
+        if hist is None:
+            hist = self.histograms[name] = Histogram(name, deadline)
+        return hist
+
+    def gauge(self, name, getter): # register a counter owned by another module
+        self.gauges[name] = getter
+
+    def snapshot(self):
+        return {
+            'uptime_s': round(time.monotonic() - self.started, 3),
+            'stages': {name: hist.snapshot() for name, hist in self.histograms.items()},
+            'gauges': {name: getter() for name, getter in self.gauges.items()},
+        }
+
+    def report(self): # print and save a snapshot
+        snap = self.snapshot()
+        print('Loop stats after %.1fs:' % snap['uptime_s'])
+        for name, s in snap['stages'].items():
+            print('  %-18s n=%-8d p50=%7.2fms p99=%7.2fms max=%7.2fms overruns=%d' %
+                  (name, s['count'], s['p50_ms'], s['p99_ms'], s['max_ms'], s['overruns']))
+        for name, value in snap['gauges'].items():
+            print('  %-18s %s' % (name, value))
+        try:
+            if not os.path.exists(SNAPSHOT_DIR):
+                os.mkdir(SNAPSHOT_DIR)
+            with open(SNAPSHOT_FILE, 'w') as f:
+                json.dump(snap, f, indent=2)
+        except OSError as e:
+            print(e)
+        return snap
+
+    def install(self, signum=signal.SIGUSR1): # must be called from the main thread
+        signal.signal(signum, lambda signum, frame: self.report())
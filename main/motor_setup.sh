@@ -20,6 +20,11 @@ fi
 
 # Pyserial package install  ## https://pyserial.readthedocs.io/en/latest/shortintro.html#opening-serial-ports
 apt-get install python3-serial -y
+# Numpy for filtering the ultrasonic sensors history
+apt-get install python3-numpy -y
+# stable /dev/uvrobot-* names for the serial adapters, see usb_peripherals/discovery.py
+cp usb_peripherals/99-uvrobot-serial.rules /etc/udev/rules.d/
+udevadm control --reload-rules
 # check if the phrase "enable_uart=1" existed in the file or not
 if [ 0 -eq $( grep -c 'enable_uart=1' /boot/config.txt ) ]; then
 	# if not exist this phrase, then add it
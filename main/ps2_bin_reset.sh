@@ -9,6 +9,10 @@ fi
 
 echo "This will reset PS2 Controller's binary for Raspberry Pi"
 
+# rerun this after every change to ps2x/*.cpp: the ps2x binary in the repo is
+# not rebuilt with the sources. Since HEARTBEAT_MS the binary resends its state
+# every 100ms, main.py only watches it for staleness once that heartbeat is seen
+
 # ----------- renew binary files --------------------
 # go to cpp code section, clean the c binary files and re-create them
 cd ./ps2x
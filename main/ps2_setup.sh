@@ -21,6 +21,7 @@ fi
 apt-get install wiringpi -y
 
 # ----------- renew binary files --------------------
+# also the way to update an installed robot after a change to ps2x/*.cpp
 chmod +x ps2_bin_reset.sh
 ./ps2_bin_reset.sh
 
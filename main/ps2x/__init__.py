@@ -41,6 +41,7 @@
  * Licensed under the MIT license. All right reserved.
  --------------------------------------------------------------"""
 from ps2x.ps2x import PS2X
+from ps2x.response import StickResponse
 
 PS2_DAT = 13  # wiringPi pin (not BCM). ref: http://wiringpi.com/pins/
 PS2_CMD = 12  # wiringPi pin (not BCM). ref: http://wiringpi.com/pins/
@@ -52,5 +53,4 @@ PS2_PRESSURE = False
 PS2_RUMBLE   = False
 
 ps2 = PS2X(PS2_DAT, PS2_CMD, PS2_SEL, PS2_CLK, PS2_ANALOG, PS2_LOCKED, PS2_PRESSURE, PS2_RUMBLE)
-
-
+stick = StickResponse() # response curve of the Left stick, tuned in ps2x/response.json
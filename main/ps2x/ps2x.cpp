@@ -74,6 +74,7 @@
 #define PS2_LOCKED true
 #define PS2_PRESSURE false
 #define PS2_RUMBLE false
+#define HEARTBEAT_MS 100 // resend the state this often when nothing changes, so the main process knows we're alive
 
 struct option_s {
     int ps2_dat;
@@ -174,17 +175,25 @@ int main(int argc, char *argv[]) {
 
     /*now come the loop*/
     bool changed_flag = false;
+    unsigned int last_sent = millis();
     while (1) {
         ps2.update();
         if (ps2.changed()) 
         {   
             changed_flag = true;
             sendData(ps2.rawButton(), ps2.rawLStick());
+            last_sent = millis();
         }
         else if (changed_flag) //need to have this to main system to compare
         {
             changed_flag = false;
             sendData(ps2.rawButton(), ps2.rawLStick());
+            last_sent = millis();
+        }
+        else if ((millis() - last_sent) > HEARTBEAT_MS) // heartbeat
+        {
+            sendData(ps2.rawButton(), ps2.rawLStick());
+            last_sent = millis();
         }
 
         //pause(); //pause to wait for ISR and not consuming system memory
@@ -40,6 +40,7 @@
  * 
  * Licensed under the MIT license. All right reserved.
  --------------------------------------------------------------"""
+import hal
 import subprocess as sp
 from ps2x.streamReader import StreamReader
 import sys
@@ -88,9 +89,9 @@ class PS2X(object):
         self.en_rumble = rumble
 
         # self.TARGET = './ps2x'
-        self.TARGET = '/ps2x/ps2x' # absolute directory, must run ps2_bin_reset.sh before run this
+        self.TARGET = hal.get('ps2_command') # sudo /ps2x/ps2x on the robot, must run ps2_bin_reset.sh before run this
         try:
-            self.ps2obj = sp.Popen(['sudo',self.TARGET,
+            self.ps2obj = sp.Popen(self.TARGET + [
                                         '-d', str(self.dat_pin),
                                         '-c', str(self.cmd_pin),
                                         '-s', str(self.sel_pin),
@@ -106,7 +107,8 @@ class PS2X(object):
             print(e)
             raise ValueError("This may happened because you forgot to run ps2_bin_reset.sh. Please make sure to do that!")
         
-        self.output  = StreamReader(self.ps2obj.stdout)
+        self.bad_frames = 0 # number of Data: lines that couldn't be parsed
+        self.output  = StreamReader(self.ps2obj.stdout, self.__parse) # latest frame wins
         
         # DualShock button constants
         self.SELECT     = 0x0001
@@ -131,6 +133,7 @@ class PS2X(object):
         self.last_buttons = 0xFFFF # all button released
         self.Lsticks = 0x807F # 128 << 8 + 127 --> stable state of the analog stick
         self.last_Lsticks = 0x807F # 128 << 8 + 127 --> stable state of the analog stick
+        self.frame = (0xFFFF, 0x807F) # (buttons, Lsticks) of the newest frame, as sent even when the arbiter mutes them
 
 
     def __del__(self):
@@ -139,19 +142,34 @@ class PS2X(object):
         """
         self.clean()
     
-    def update(self):
-        output = self.output.readline(0.05)  # 0.05 secs = 50ms to let the shell output the result
-        # sys.stdout.flush()
-        if output:  # turn it into string if it is not a null
+    def __parse(self, output): # run on the reader thread, return (slot, frame) or None
+        try:
             raw_data = output.strip().decode("utf-8")
             data = list(raw_data.split(" "))
-            if (len(data) is 3) and (data[0] == "Data:"): # correct frame
-                    self.last_buttons = self.buttons
-                    self.last_Lsticks = self.Lsticks
-                    self.buttons = int(data[1])
-                    self.Lsticks = int(data[2])
-            else: # if this is information, then dump it to output
-                print(raw_data)
+            if data[0] == "Data:": # a frame, maybe truncated or garbled
+                buttons, Lsticks = int(data[1]), int(data[2])
+                if len(data) != 3 or not (0 <= buttons <= 0xFFFF and 0 <= Lsticks <= 0xFFFF):
+                    raise ValueError(raw_data)
+                return 0, (buttons, Lsticks)
+        except (ValueError, IndexError): # UnicodeDecodeError included: skip it, the reader thread must go on
+            self.bad_frames += 1
+            return None
+        print(raw_data) # if this is information, then dump it to output
+        return None
+
+    def update(self): # never blocks, take the newest frame if the ps2x process sent one
+        self.last_buttons = self.buttons
+        self.last_Lsticks = self.Lsticks
+        frame = self.output.latest()
+        if frame is not None:
+            self.frame = frame
+        self.buttons, self.Lsticks = self.frame
+
+    def dropped(self): # number of frames the control loop was too slow to see
+        return self.output.dropped
+
+    def age(self): # secs since the ps2x process last sent a frame, it resends the state as a heartbeat
+        return self.output.age()
     
     def clean(self):
         # check if process terminated or not
@@ -0,0 +1,88 @@
+"""------------------------------------------------------------*-
+  Stick response curve module for the PS2X controller
+ --------------------------------------------------------------
+ * Maps the raw ADC values of the Left stick (0-255) to a
+ * proportional speed in [-scale, scale], through a deadzone
+ * and an expo curve:
+ *      y = (1 - expo)*x + expo*x^3
+ * where x is the stick travel out of the deadzone, from 0 to 1.
+ *
+ * Both curves are precomputed into 256-entry tables, so a
+ * stick reading is one lookup per axis.
+ *
+ * The curves are tuned in CONFIG_FILE, e.g.:
+ *      {"linear":  {"deadzone": 0.08, "expo": 0.4, "scale": 1.0},
+ *       "angular": {"deadzone": 0.08, "expo": 0.6, "scale": 0.6}}
+ * The file is checked by reload(), so edits take effect on a
+ * running robot. A broken file is reported and ignored.
+ *
+ --------------------------------------------------------------"""
+import json
+import math
+import os
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'response.json')
+LY_CENTER = 127 # stable state of the analog stick, see PS2X.LstickTouched()
+LX_CENTER = 128
+DEFAULTS = {'deadzone': 0.08, 'expo': 0.4, 'scale': 1.0}
+
+
+def response_table(center, deadzone, expo, scale): # output for every stick value, positive below center
+    if not 0 <= deadzone < 1 or not 0 <= expo <= 1:
+        raise ValueError('deadzone must be in [0, 1) and expo in [0, 1]')
+    table = []
+    for value in range(256):
+        if value < center:
+            x = (center - value)/center
+        else:
+            x = -(value - center)/(255 - center)
+        travel = abs(x)
+        if travel <= deadzone:
+            table.append(0.0)
+            continue
+        travel = min(1.0, (travel - deadzone)/(1 - deadzone))
+        table.append(math.copysign(scale*((1 - expo)*travel + expo*travel**3), x))
+    return tuple(table)
+
+
+class StickResponse(object):
+    """
+    A python written hot-reloadable response curve for the Left stick.
+
+    """
+    def __init__(self, path=CONFIG_FILE):
+        """
+        Constructor
+        @param path: a string indicates the json file holding the curve settings
+        """
+        self.path = path
+        self.mtime = None
+        self.__linear = response_table(LY_CENTER, **DEFAULTS)
+        self.__angular = response_table(LX_CENTER, **DEFAULTS)
+        self.reload()
+
+    def reload(self): # rebuild the tables if the config file changed, cheap enough to poll every second
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError: # no config file, keep the defaults
+            mtime = None
+        if mtime == self.mtime:
+            return False
+        self.mtime = mtime
+        if mtime is None:
+            return False
+        try:
+            with open(self.path) as f:
+                config = json.load(f)
+            linear = dict(DEFAULTS, **config.get('linear', {}))
+            angular = dict(DEFAULTS, **config.get('angular', {}))
+            tables = (response_table(LY_CENTER, **linear), response_table(LX_CENTER, **angular))
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            print('Stick response not reloaded:', e)
+            return False
+        self.__linear, self.__angular = tables # swap both at once
+        print('Stick response loaded: linear', linear, 'angular', angular)
+        return True
+
+    def read(self, Lx, Ly): # (linear, angular) for the given stick position, forward and left are positive
+        return self.__linear[Ly], self.__angular[Lx]
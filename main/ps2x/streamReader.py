@@ -7,23 +7,39 @@
  * References:
  * - http://eyalarubas.com/python-subproc-nonblock.html
  * - https://gist.github.com/EyalAr
+ *
+ * Two modes:
+ * - queue mode (no parser): every line is kept in order and
+ *   read back with readline().
+ * - latest-value mode (with parser): lines are parsed on the
+ *   reader thread and only the newest frame of each slot is kept,
+ *   read back with latest(). Older unread frames are dropped and
+ *   counted, so a slow consumer never reacts to stale input.
  --------------------------------------------------------------"""
-from threading import Thread
+from threading import Thread, Lock
 from queue import Queue, Empty
+import time
 
 class StreamReader:
     """
     A python written module for continuous stream reading.
 
     """
-    def __init__(self, popen_object):
+    def __init__(self, popen_object, parser = None):
         """
         stream: the stream to read from.
                 Usually a process' stdout or stderr.
+        parser: None for queue mode, or a callable turning a raw line into
+                a (slot, frame) tuple, or None to skip the line.
         """
 
         self._s = popen_object
         self._q = Queue()
+        self._latest = {} # slot --> newest unread frame
+        self._lock = Lock()
+        self.frames = 0 # number of frames published in latest-value mode
+        self.dropped = 0 # number of frames overwritten before being read
+        self.last_line = None # time.monotonic() of the last line read in latest-value mode
 
         def _populateQueue(stream, queues):
             """
@@ -37,8 +53,32 @@ class StreamReader:
                 else:
                     raise UnexpectedEndOfStream
 
-        self._t = Thread(target = _populateQueue,
-                args = (self._s, self._q))
+        def _populateLatest(stream, parser):
+            """
+            Parse lines from 'stream', keep only the newest frame of each slot.
+            """
+
+            while True:
+                line = stream.readline()
+                if not line:
+                    raise UnexpectedEndOfStream
+                self.last_line = time.monotonic() # any line, heartbeats included, proves the process is alive
+                parsed = parser(line)
+                if parsed is None:
+                    continue
+                slot, frame = parsed
+                with self._lock:
+                    if slot in self._latest:
+                        self.dropped += 1
+                    self._latest[slot] = frame
+                    self.frames += 1
+
+        if parser is None:
+            self._t = Thread(target = _populateQueue,
+                    args = (self._s, self._q))
+        else:
+            self._t = Thread(target = _populateLatest,
+                    args = (self._s, parser))
         self._t.daemon = True
         self._t.start() #start collecting lines from the stream
 
@@ -49,4 +89,13 @@ class StreamReader:
         except Empty:
             return None
 
+    def age(self): # secs since the last line, infinite if nothing came yet
+        if self.last_line is None:
+            return float('inf')
+        return time.monotonic() - self.last_line
+
+    def latest(self, slot = 0): # newest frame of the slot not read yet, or None. Never blocks
+        with self._lock:
+            return self._latest.pop(slot, None)
+
 class UnexpectedEndOfStream(Exception): pass
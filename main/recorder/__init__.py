@@ -0,0 +1,9 @@
+"""------------------------------------------------------------*-
+  Init module for the session recorder
+ --------------------------------------------------------------
+ * Records the inputs and motor commands of a control session,
+ * UVROBOT_RECORD=<file> python3 main.py, to replay it offline
+ * with recorder/replay.py.
+ *
+ --------------------------------------------------------------"""
+from recorder.recorder import Recorder, read_log, NAMES, TICK, PS2, WEB, SENSOR, LIMIT, MOTOR, DEGRADED
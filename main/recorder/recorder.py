@@ -0,0 +1,144 @@
+"""------------------------------------------------------------*-
+  Session recorder for UV Robot
+ --------------------------------------------------------------
+ * Writes what goes into and out of the control loop to a compact
+ * binary log, to replay it offline (see recorder/replay.py):
+ * - PS2, WEB, DEGRADED: input state seen by the controllers in
+ *   the next tick, once arbitrated, only when it changed
+ * - TICK: a control tick, once the inputs are updated and before
+ *   anything acts on them. Carries the release grid origin and the
+ *   tick time of the Scheduler, so a replay runs the same tasks
+ * - SENSOR: every ultrasonic sample, from the reader thread
+ * - LIMIT: every limit switch edge, from the GPIO thread
+ * - MOTOR: every frame queued to the motor driver
+ * - ESTOP: an emergency stop, from the arbiter, in the tick it
+ *   happened
+ *
+ * File: MAGIC, start time (float64), then records of
+ *      kind (uint8), usecs since the previous record (uint32),
+ *      payload length (uint16), payload
+ * Times are integers, so a replay rebuilds them exactly.
+ *
+ --------------------------------------------------------------"""
+import os
+import struct
+import threading
+import time
+
+MAGIC = b'UVRL\x02' # 2: WEB records the held keys as a bitmap
+START = struct.Struct('<d')
+RECORD = struct.Struct('<BIH') # kind, usecs since the previous record, payload length
+FLUSH_TIME = 1 # secs - the file is flushed this often, a crash loses at most that
+
+TICK = 0 # scheduler epoch, tick time
+PS2 = 1 # buttons, Lsticks
+WEB = 2 # bitmap of the held keys (see ipc.KEYS), then the command signal, empty when none
+SENSOR = 3 # 6 distances
+LIMIT = 4 # switch bit, pressed
+MOTOR = 5 # frame as queued
+DEGRADED = 6 # flag
+ESTOP = 7 # nothing
+
+TICK_TIME = struct.Struct('<dd')
+PS2_STATE = struct.Struct('<HH')
+WEB_KEYS = struct.Struct('<B')
+SENSOR_FRAME = struct.Struct('<6H')
+LIMIT_EDGE = struct.Struct('<BB')
+NAMES = {TICK: 'tick', PS2: 'ps2', WEB: 'web', SENSOR: 'sensor', LIMIT: 'limit', MOTOR: 'motor', DEGRADED: 'degraded',
+         ESTOP: 'estop'}
+
+
+class Recorder(object):
+    """
+    A python written binary session recorder.
+
+    """
+    def __init__(self, path, clock=time.monotonic):
+        """
+        Constructor
+        @param path: a string, the log file, its directory is created if needed
+        @param clock: a callable returning monotonic time in secs
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.path = path
+        self.clock = clock
+        self.records = 0
+        self.__file = open(path, 'wb')
+        self.__lock = threading.Lock()
+        self.__last = self.__start = clock()
+        self.__flushed = self.__start
+        self.__ps2 = self.__web = self.__degraded = None # last state written
+        self.__file.write(MAGIC + START.pack(self.__start))
+        print('Recording the session to', path)
+
+    def __write(self, kind, payload=b''): # any thread
+        with self.__lock:
+            if self.__file is None:
+                return
+            now = self.clock()
+            usecs = max(int(round((now - self.__last)*1000000)), 0)
+            self.__last += usecs/1000000.0 # exactly what the replay will add up
+            self.__file.write(RECORD.pack(kind, usecs, len(payload)) + payload)
+            self.records += 1
+
+    def tick(self, loop, ps2, sv, degraded): # task after the inputs are updated, before anything acts on them
+        state = (ps2.buttons, ps2.Lsticks)
+        if state != self.__ps2:
+            self.__ps2 = state
+            self.__write(PS2, PS2_STATE.pack(*state))
+        state = (sv.keys, sv.buttons)
+        if state != self.__web:
+            self.__web = state
+            self.__write(WEB, WEB_KEYS.pack(sv.keys) + (sv.buttons or '').encode('utf-8'))
+        if degraded != self.__degraded:
+            self.__degraded = degraded
+            self.__write(DEGRADED, bytes([degraded]))
+        self.__write(TICK, TICK_TIME.pack(loop.epoch, loop.now))
+        if self.clock() - self.__flushed > FLUSH_TIME:
+            self.__flushed = self.clock()
+            with self.__lock:
+                self.__file.flush()
+
+    def sensor(self, values): # Ultrasonics.tap
+        self.__write(SENSOR, SENSOR_FRAME.pack(*[min(max(int(value), 0), 0xFFFF) for value in values]))
+
+    def limit(self, bit, pressed): # LimitSwitches.tap
+        self.__write(LIMIT, LIMIT_EDGE.pack(bit, pressed))
+
+    def motor(self, frame): # SerialWriter.tap
+        self.__write(MOTOR, frame)
+
+    def estop(self): # emergency_stop() of main.py
+        self.__write(ESTOP)
+
+    def close(self):
+        with self.__lock:
+            if self.__file is not None:
+                self.__file.close()
+                self.__file = None
+        print('Session recorded: %d records in %s' % (self.records, self.path))
+
+
+def read_log(path):
+    """
+    Read a session log
+    @param path: a string, a file written by Recorder
+    @return a generator of (secs, kind, payload), secs on the clock of the recording
+    """
+    with open(path, 'rb') as file:
+        data = file.read()
+    if not data.startswith(MAGIC):
+        raise ValueError('%s is not a session log' % path)
+    pos = len(MAGIC)
+    secs = START.unpack_from(data, pos)[0]
+    pos += START.size
+    while pos + RECORD.size <= len(data):
+        kind, usecs, length = RECORD.unpack_from(data, pos)
+        pos += RECORD.size
+        if pos + length > len(data): # cut short by a crash
+            return
+        secs += usecs/1000000.0
+        yield secs, kind, data[pos:pos + length]
+        pos += length
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""------------------------------------------------------------*-
+  Offline replay of a recorded control session for UV Robot
+ --------------------------------------------------------------
+ * Feeds a log written by recorder.Recorder back through the
+ * control loop of main.py: the same Scheduler tasks, the same
+ * motor_controller(), hand_controller(), governor and ramps, on a
+ * virtual clock, as fast as the CPU goes.
+ *
+ * main.py is imported on the sim backend, then its peripherals
+ * are swapped for replay ones:
+ * - ps2 and sv take the recorded states instead of their process
+ * - the ultrasonic samples and limit switch edges are pushed at
+ *   their recorded time (the edges through a FakeGPIO)
+ * - the watchdog only follows the recorded degraded flag
+ * - the inputs are recorded once arbitrated: the arbiter only
+ *   replays the recorded emergency stops
+ * - a fresh MotorUART_PWM on the virtual clock, on an emulated
+ *   driver, its frames are collected from the writer tap. The
+ *   writer is drained after each tick: a replay faster than the
+ *   driver would overrun its ring, and the motor resends every
+ *   channel when it does
+ * stick.reload and limits.resync do nothing, response.json is
+ * read once.
+ *
+ * The replayed frames can be diffed with the recorded ones, to
+ * check a change of the controllers doesn't change what they
+ * send, and the replay can be profiled. From main/:
+ *      UVROBOT_RECORD=/tmp/MIS_logs/session.uvrl python3 main.py
+ *      python3 recorder/replay.py /tmp/MIS_logs/session.uvrl --diff
+ *      python3 recorder/replay.py /tmp/MIS_logs/session.uvrl --profile
+ * --profile only covers the records, not main.py starting.
+ *
+ --------------------------------------------------------------"""
+import argparse
+import os
+import sys
+import time
+
+MAIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, MAIN_DIR)
+os.environ.setdefault('UVROBOT_BACKEND', 'sim') # never the robot hardware
+os.environ['UVROBOT_CAMERA_PORT'] = '0'
+os.environ.pop('UVROBOT_RECORD', None) # don't overwrite the session being replayed
+os.environ.pop('UVROBOT_SIM_TRACE', None)
+
+from recorder.recorder import read_log, TICK, PS2, WEB, SENSOR, LIMIT, MOTOR, DEGRADED, ESTOP
+from recorder.recorder import TICK_TIME, PS2_STATE, WEB_KEYS, SENSOR_FRAME, LIMIT_EDGE
+
+TOP = 25 # functions printed by --profile
+
+
+class VirtualClock(object):
+    """
+    A python written clock moved by the replay.
+
+    """
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def set(self, now): # never goes back, the recorded threads interleave by a few usecs
+        if now > self.now:
+            self.now = now
+
+
+class ReplaySensor(object):
+    """
+    A python written stand-in of Ultrasonics fed with recorded samples.
+
+    """
+    def __init__(self, clock):
+        """
+        Constructor
+        @param clock: a VirtualClock, for the age of the samples
+        """
+        from usb_peripherals.history import SensorHistory
+        from usb_peripherals.ultrasonics import CHANNELS
+        self.clock = clock
+        self.history = SensorHistory(CHANNELS)
+        self.values = (0,) * CHANNELS
+        self.stamp = None # recorded time of the newest sample
+        self.frames = 0
+        self.bad_frames = 0 # the recorder only sees good ones
+
+    def push(self, values, secs): # a sample, as Ultrasonics.__publish
+        from usb_peripherals.ultrasonics import STALE_TIME
+        if self.stamp is not None and secs - self.stamp > STALE_TIME:
+            self.history.clear()
+        self.history.push(values)
+        self.values = tuple(values)
+        self.stamp = secs
+        self.frames += 1
+
+    def read(self):
+        if self.stamp is None:
+            return self.values, float('inf')
+        return self.values, self.clock() - self.stamp
+
+    def age(self):
+        return self.read()[1]
+
+    def stale(self):
+        from usb_peripherals.ultrasonics import STALE_TIME
+        return self.age() > STALE_TIME
+
+    def clean(self):
+        pass
+
+
+def replay(path, speed=0, profiler=None):
+    """
+    Run a recorded session through the control loop of main.py
+    @param path: a string, a file written by Recorder
+    @param speed: a float, 1 paces the replay in real time, 0 as fast as possible
+    @param profiler: a cProfile.Profile enabled while the records are replayed, or None
+    @return a dict with the replayed frames [(secs, frame)], the recorded ones and counts
+    """
+    records = list(read_log(path))
+    import main
+    from hal.fake_gpio import FakeGPIO
+    from hal.sim_robot import SimRobot, SimMotorDriver
+    from usb_peripherals.motor import MotorUART_PWM
+    from usb_peripherals import MOTOR_BAUDRATE, MAX_SPEED
+    from governor import Governor
+    from failsafe import Watchdog
+
+    clock = VirtualClock(records[0][0] if records else 0.0)
+    live = (main.motor, main.sensor) # the peripherals of the sim backend, only cleaned
+    driver = SimMotorDriver(SimRobot()) # drains the writer of the replay motor
+    driver.start()
+    frames = []
+    inputs = {'ps2': (main.ps2.buttons, main.ps2.Lsticks), 'web': (0, None), 'degraded': False, 'estop': False}
+    try:
+        motor = MotorUART_PWM(baudRate=MOTOR_BAUDRATE, speed=MAX_SPEED, port=driver.port, clock=clock)
+        motor.writer.tap = lambda frame: frames.append((clock(), frame))
+        motor.refresh() # as main.py when it starts recording
+        sensor = ReplaySensor(clock)
+        main.GPIO = gpio = FakeGPIO(clock)
+        main.motor = motor
+        main.sensor = sensor
+        main.governor = Governor(motor, sensor)
+        main.watchdog = Watchdog(main.failsafe_degraded, main.failsafe_recovered)
+        main.watchdog.watch('recorded', lambda: float('inf') if inputs['degraded'] else 0.0, 1)
+        main.millis = lambda: int(clock() * 1000)
+        main.gpio_init()
+        limits = main.limits
+
+        def ps2_update(ps2=main.ps2):
+            ps2.last_buttons = ps2.buttons
+            ps2.last_Lsticks = ps2.Lsticks
+            ps2.buttons, ps2.Lsticks = inputs['ps2']
+
+        def sv_update(sv=main.sv):
+            sv.last_buttons = sv.buttons
+            sv.last_keys = sv.keys
+            sv.keys, sv.buttons = inputs['web']
+
+        def arbitrate():
+            if inputs['estop']:
+                inputs['estop'] = False
+                main.emergency_stop()
+
+        loop = main.control_loop(clock, tasks={'ps2.update': ps2_update,
+                                               'sv.update': sv_update,
+                                               'arbitrate': arbitrate,
+                                               'stick.reload': lambda: None,
+                                               'limits.resync': lambda: None})
+        recorded = []
+        ticks = 0
+        started = time.monotonic()
+        if profiler is not None:
+            profiler.enable()
+        for secs, kind, payload in records:
+            if kind == TICK:
+                epoch, now = TICK_TIME.unpack(payload)
+                if loop.epoch is None:
+                    loop.start(epoch)
+                clock.set(now)
+                if speed > 0: # hold the recorded pace
+                    wait = (now - records[0][0])/speed - (time.monotonic() - started)
+                    if wait > 0:
+                        time.sleep(wait)
+                loop.run_once(now)
+                motor.writer.drain() # no frame dropped from the ring, as on the robot
+                ticks += 1
+            elif kind == PS2:
+                inputs['ps2'] = PS2_STATE.unpack(payload)
+            elif kind == WEB:
+                inputs['web'] = (WEB_KEYS.unpack_from(payload)[0], payload[WEB_KEYS.size:].decode('utf-8') or None)
+            elif kind == DEGRADED:
+                inputs['degraded'] = bool(payload[0])
+            elif kind == ESTOP: # before the tick it happened in
+                inputs['estop'] = True
+            elif kind == SENSOR:
+                clock.set(secs)
+                sensor.push(list(SENSOR_FRAME.unpack(payload)), secs)
+            elif kind == LIMIT:
+                clock.set(secs)
+                bit, pressed = LIMIT_EDGE.unpack(payload)
+                gpio.set_input(limits.pins[bit], gpio.LOW if pressed else gpio.HIGH)
+                limits.resync() # the recorded edge passed the debounce, it has to be taken
+            elif kind == MOTOR:
+                recorded.append((secs, payload))
+        if profiler is not None:
+            profiler.disable()
+        wall = time.monotonic() - started
+        motor.clean()
+    finally:
+        driver.stop()
+        main.ps2.clean()
+        main.sv.shutdown()
+        for peripheral in live:
+            peripheral.clean()
+    span = records[-1][0] - records[0][0] if records else 0.0
+    return {'frames': frames, 'recorded': recorded, 'ticks': ticks, 'records': len(records),
+            'span': span, 'wall': wall}
+
+
+def diff(recorded, replayed):
+    """
+    Compare two frame streams, frame by frame, times aside
+    @return (index of the first different frame or None, number of different frames)
+    """
+    first = None
+    different = abs(len(recorded) - len(replayed))
+    for i, (a, b) in enumerate(zip(recorded, replayed)):
+        if a[1] != b[1]:
+            different += 1
+            if first is None:
+                first = i
+    if first is None and len(recorded) != len(replayed):
+        first = min(len(recorded), len(replayed))
+    return first, different
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a recorded session through the control loop of main.py')
+    parser.add_argument('log', help='session log, written with UVROBOT_RECORD=<file> python3 main.py')
+    parser.add_argument('-o', '--output', help='text file of the replayed frames, "<secs> <frame>" per line')
+    parser.add_argument('--diff', action='store_true', help='compare the replayed frames with the recorded ones')
+    parser.add_argument('--speed', type=float, default=0, help='1 for real time, 0 (default) as fast as possible')
+    parser.add_argument('--profile', action='store_true', help='profile the replay, print the slowest functions')
+    args = parser.parse_args()
+
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+    result = replay(args.log, args.speed, profiler)
+    if profiler is not None:
+        import pstats
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(TOP)
+
+    frames = result['frames']
+    print('Replayed %d records, %d ticks, %.1fs of session in %.2fs (x%.0f): %d frames, %d recorded' %
+          (result['records'], result['ticks'], result['span'], result['wall'],
+           result['span']/result['wall'] if result['wall'] else 0, len(frames), len(result['recorded'])))
+    if args.output:
+        with open(args.output, 'w') as file:
+            for secs, frame in frames:
+                file.write('%.6f %s\n' % (secs, frame.decode('utf-8', 'replace')))
+    if args.diff:
+        recorded = result['recorded']
+        first, different = diff(recorded, frames)
+        if first is None:
+            print('Same frames as recorded')
+        else:
+            print('%d frames differ, the first one is #%d' % (different, first))
+            for name, stream in (('recorded', recorded), ('replayed', frames)):
+                if first < len(stream):
+                    print('  %s at %.6f: %s' % (name, stream[first][0], stream[first][1].decode('utf-8', 'replace')))
+        sys.exit(1 if first is not None else 0)
+
+
+if __name__ == '__main__':
+    main()
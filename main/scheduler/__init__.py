@@ -0,0 +1,8 @@
+"""------------------------------------------------------------*-
+  Init module for the control loop scheduler
+ --------------------------------------------------------------
+ * Fixed-rate cooperative scheduler: every stage of the main
+ * loop is a task with its own period and deadline.
+ *
+ --------------------------------------------------------------"""
+from scheduler.scheduler import Scheduler, Task, LOOP_PERIOD
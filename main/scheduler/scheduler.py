@@ -0,0 +1,193 @@
+"""------------------------------------------------------------*-
+  Fixed-rate cooperative scheduler for UV Robot
+ --------------------------------------------------------------
+ * Runs every stage of the control loop as a task with its own
+ * period and deadline, on top of one steady base tick.
+ *
+ * - Tasks are plain callables and must never block: each one
+ *   should poll its peripheral and return.
+ * - Periods are rounded to whole ticks. Missed releases are
+ *   skipped, not replayed, so a late task never bursts.
+ * - Ticks are scheduled on absolute monotonic time, so jitter
+ *   never accumulates into drift.
+ * - A task running over its deadline, or a tick running over
+ *   the base period, is counted as an overrun and reported.
+ *
+ --------------------------------------------------------------"""
+import time
+
+LOOP_PERIOD = 0.01 # secs --> 100Hz base tick
+REPORT_INTERVAL = 5 # secs between two overrun reports
+
+
+class Task(object):
+    """
+    A single stage of the control loop.
+
+    """
+    def __init__(self, name, callback, period, deadline):
+        """
+        Constructor
+        @param name: a string used for reporting
+        @param callback: a callable without argument, run once per release
+        @param period: a float indicates the release interval in secs
+        @param deadline: a float indicates the allowed run time in secs
+        """
+        self.name = name
+        self.callback = callback
+        self.period = period
+        self.deadline = deadline
+        self.next_release = 0.0
+        self.runs = 0
+        self.overruns = 0 # number of runs longer than the deadline
+        self.skipped = 0 # number of releases missed because the loop was late
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self.histogram = None # monitor.Histogram, if the loop is monitored
+
+
+class Scheduler(object):
+    """
+    A python written cooperative scheduler for the control loop.
+
+    """
+    def __init__(self, period=LOOP_PERIOD, clock=time.monotonic, sleep=time.sleep, stats=None):
+        """
+        Constructor
+        @param period: a float indicates the base tick in secs
+        @param clock: a callable returning monotonic time in secs
+        @param sleep: a callable used to wait for the next tick
+        @param stats: a monitor.Monitor to record task durations into, or None
+        """
+        if period <= 0:
+            raise ValueError('The given period is invalid!')
+
+        self.period = period
+        self.clock = clock
+        self.sleep = sleep
+        self.tasks = []
+        self.running = False
+        self.stats = stats
+        self.tick_histogram = stats.histogram('tick', period) if stats else None
+
+        self.epoch = None # time the release grid starts from, see start()
+        self.now = clock() # time of the tick being run, steady for all its tasks
+        self.ticks = 0
+        self.overruns = 0 # number of ticks longer than the base period
+        self.max_jitter = 0.0 # worst lateness of a tick start, in secs
+        self.peak_tick = 0.0 # longest tick since the last call of peak(), in secs
+        self.peak_jitter = 0.0 # worst lateness of a tick start since the last call of jitter(), in secs
+        self.__reported = 0 # overrun count at the time of the last report
+        self.__last_report = clock()
+
+    def add(self, name, callback, period=None, deadline=None):
+        """
+        Register a task, tasks run in the order they are added
+        @param period: release interval in secs, default to the base tick
+        @param deadline: allowed run time in secs, default to the task period
+        """
+        if period is None:
+            period = self.period
+        period = max(1, round(period / self.period)) * self.period # snap to whole ticks
+        if deadline is None:
+            deadline = period
+        task = Task(name, callback, period, deadline)
+        if self.stats is not None:
+            task.histogram = self.stats.histogram(name, deadline)
+        self.tasks.append(task)
+        return task
+
+    def run_once(self, now):
+        """
+        Run every task that is due at the given tick time
+        """
+        clock = self.clock
+        self.now = now
+        for task in self.tasks:
+            if now < task.next_release:
+                continue
+            start = clock()
+            task.callback()
+            task.last_duration = duration = clock() - start
+            task.runs += 1
+            if duration > task.max_duration:
+                task.max_duration = duration
+            if duration > task.deadline:
+                task.overruns += 1
+            if task.histogram is not None:
+                task.histogram.record(duration)
+            # next release on the task grid, skipping any release we were too late for
+            task.next_release += task.period
+            if task.next_release <= now:
+                missed = int((now - task.next_release) / task.period) + 1
+                task.skipped += missed
+                task.next_release += missed * task.period
+
+    def start(self, now):
+        """
+        Release every task at the given time, their grid starts from there
+        """
+        self.epoch = self.now = now
+        for task in self.tasks:
+            task.next_release = now
+
+    def run(self):
+        """
+        Run the loop until stop() is called
+        """
+        self.running = True
+        next_tick = self.clock()
+        self.start(next_tick)
+
+        while self.running:
+            now = self.clock()
+            jitter = now - next_tick
+            if jitter > self.max_jitter:
+                self.max_jitter = jitter
+            if jitter > self.peak_jitter:
+                self.peak_jitter = jitter
+
+            start = now
+            self.run_once(now)
+            self.ticks += 1
+
+            next_tick += self.period
+            now = self.clock()
+            if now - start > self.peak_tick:
+                self.peak_tick = now - start
+            if self.tick_histogram is not None:
+                self.tick_histogram.record(now - start)
+            if now > next_tick: # this tick ate into the next one
+                self.overruns += 1
+                next_tick = now # start over from here instead of bursting to catch up
+            else:
+                self.sleep(next_tick - now)
+
+            if now - self.__last_report > REPORT_INTERVAL:
+                self.__last_report = now
+                self.report()
+
+    def stop(self):
+        self.running = False
+
+    def peak(self): # longest tick since the previous call, then start over, e.g. for the telemetry
+        peak = self.peak_tick
+        self.peak_tick = 0.0
+        return peak
+
+    def jitter(self): # worst lateness of a tick start since the previous call, then start over, e.g. for the telemetry
+        jitter = self.peak_jitter
+        self.peak_jitter = 0.0
+        return jitter
+
+    def report(self): # print a summary only if something overran since the last report
+        total = self.overruns + sum(t.overruns for t in self.tasks)
+        if total == self.__reported:
+            return
+        late = [t for t in self.tasks if t.overruns > 0]
+        print('Loop overrun: %d of %d ticks, max jitter %.1fms' %
+              (self.overruns, self.ticks, self.max_jitter * 1000))
+        for task in late:
+            print('  %s: %d overruns, max %.1fms (deadline %.1fms)' %
+                  (task.name, task.overruns, task.max_duration * 1000, task.deadline * 1000))
+        self.__reported = total
@@ -18,30 +18,30 @@
  * - https://stackoverflow.com/questions/18277048/gevent-pywsgi-graceful-shutdown
  
  --------------------------------------------------------------"""
+import hal
 import subprocess as sp
-from ps2x.streamReader import StreamReader
-from server_camera import CameraServer
+from ipc import ControlLink, key_bits
 import sys
 import time
 
+LEASE_TIME = 0.75 # secs - keys of a web client are released if it sends nothing for this long (code.js resends every 0.25s)
+
 class WebServer(object):
     """
     A python written module for interacting with the server.
 
     """
     def __init__(self):
-        self.TARGET = 'server_control.py' # absolute directory
+        self.TARGET = hal.get('web_command') # sudo python3 server_control.py on the robot
         try:
-            self.svobj = sp.Popen(['sudo','python3',self.TARGET],
-                                                    shell=False,
-                                                    stdout=sp.PIPE)
+            # key state frames come on the control link, bound before the server starts sending
+            self.link = ControlLink()
+            self.link.start()
+            self.svobj = sp.Popen(self.TARGET,
+                                                    shell=False)
         except Exception as e:
             print(e)
             raise ValueError("Something went wrong on the server side")
-        self.output  = StreamReader(self.svobj.stdout)
-
-        self.camera = CameraServer()
-        self.camera.start() #start camera server
 
         # Button constants
         self.UP         = 'UP'
@@ -58,51 +58,82 @@ class WebServer(object):
         self.LIGHT_OFF  = 'LF'
         self.HIGHSPEED  = 'HS'
         self.LOWSPEED   = 'LS'
+        self.COMMANDS   = (self.LIGHT_ON, self.LIGHT_OFF, self.HIGHSPEED, self.LOWSPEED)
+        self.ARROWS     = key_bits(self.UP) | key_bits(self.DOWN) | key_bits(self.LEFT) | key_bits(self.RIGHT)
+        self.HANDS      = key_bits(self.LHAND_UP) | key_bits(self.LHAND_DOWN) | key_bits(self.RHAND_UP) | key_bits(self.RHAND_DOWN)
 
         # value for the buttons and sticks
-        self.buttons = None # all button released
-        self.last_buttons = None # all button released
+        self.buttons = None # command of this pass (LIGHT_ON ... LOWSPEED), None if none
+        self.last_buttons = None
+        self.keys = 0 # bitmap of the keys held by the driving web client, see ipc.KEYS
+        self.last_keys = 0 # all keys released
+        self.client = None # id of that web client, None if no client drives
+        self.held = {} # client id --> (buttons, time they changed), of every web client holding keys
+        self.command = (None, None) # (command signal, client id) taken on the last update
+        self.estop = False # an emergency stop was asked since the last update
+
+        self.camera = hal.get('camera_server')() # picamera, or the synthetic camera in sim
+        self.camera.start() #start camera server
 
         print("Web server ready!")
 
-    def update(self):
-        output = self.output.readline(0.04)  # 0.04 secs = 40ms to let the shell output the result
-        # sys.stdout.flush()
-        # output = self.svobj.stdout.readline() # this will hang the system
+    def update(self): # never blocks, take the keys held now from the state table of the control link
         self.last_buttons = self.buttons
-        if output:  # turn it into string if it is not a null
-            self.buttons = output.strip().decode("utf-8")
-            return
-        self.buttons = None
-        return
+        self.last_keys = self.keys
+        self.held = self.link.table(LEASE_TIME) # pressed until released, or until the lease runs out
+        self.command = self.link.command()
+        self.estop = self.link.estop()
+        self.select(self.client)
+
+    def select(self, client, anyone=False): # only this web client drives, None for none. The arbiter calls it after update()
+        cmd, sender = self.command
+        self.client = client
+        self.keys = self.held[client][0] if client in self.held else 0
+        if cmd is not None and (sender == client or anyone): # a command counts as pressed for one pass
+            self.buttons = cmd
+        else:
+            self.buttons = None
+
+    def dropped(self): # number of commands the control loop was too slow to see
+        return self.link.dropped
+
+    def expired(self): # number of web clients that went silent while holding keys
+        return self.link.expired
+
+    def age(self): # secs since the control server last sent anything, heartbeats included
+        return self.link.age()
 
     def shutdown(self):
         # check if process terminated or not
         # A None value indicates that the process hasn't terminated yet.
         self.camera.shutdown()
+        self.link.stop()
         if self.svobj.poll() is None:
             self.svobj.terminate()
             self.svobj.kill()
             print('Web Server terminated!')
     
     def buttonChanged(self): # will be TRUE if any button changes state (on to off, or off to on)
-        return self.last_buttons != self.buttons
+        return self.last_buttons != self.buttons or self.last_keys != self.keys
     
     def buttonPressing(self): # will be TRUE as long as ANY button is pressed
-        return self.buttons != None
+        return self.buttons != None or self.keys != 0
     
     def arrowPressing(self): # will be TRUE as long as arrow buttons (UP, DOWN, RIGHT, LEFT) are pressed
-        return self.buttons in [self.UP,self.DOWN,self.LEFT,self.RIGHT]
+        return bool(self.keys & self.ARROWS)
     
     def LRpressing(self): # will be TRUE as long as left right hand controlling buttons are pressed
-        return self.buttons in [self.LHAND_UP,self.LHAND_DOWN,self.RHAND_UP,self.RHAND_DOWN]
+        return bool(self.keys & self.HANDS)
+    
+    def isPressing(self, button): # will be TRUE as long as a specific button is pressed, keys are held together
+        return bool(self.keys & key_bits(button)) or self.buttons == button
     
-    def isPressing(self, button): # will be TRUE as long as a specific button is pressed
-        return self.buttons == button
+    def __wasPressing(self, button): # TRUE if a specific button was pressed on the last update
+        return bool(self.last_keys & key_bits(button)) or self.last_buttons == button
     
     def pressed(self, button): # will be true only once when button is pressed
-        return self.buttonChanged() and self.isPressing(button)
+        return self.isPressing(button) and not self.__wasPressing(button)
 
     # released must be place independently, not hybrid under a pressing method!  
     def released(self, button): # will be true only once when button is released
-        return self.buttonChanged() and (self.last_buttons == button)
+        return self.__wasPressing(button) and not self.isPressing(button)
@@ -14,9 +14,10 @@
  * - https://blog.miguelgrinberg.com/post/the-flask-mega-tutorial-part-iv-database
  
  --------------------------------------------------------------"""
-from app.models import User
+from app.models import User, users
 from app import db
 u = User(username='admin')
 u.set_password('MIS@2020')
 db.session.add(u)
 db.session.commit()
+users.invalidate() # the running control server reads its logged in users again
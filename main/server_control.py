@@ -16,35 +16,46 @@
  
  --------------------------------------------------------------"""
 from app import control_app, socket
+from flask import request
 from flask_socketio import emit
+from ipc import ControlClient, LIGHT_ON, LIGHT_OFF, HIGHSPEED, LOWSPEED, ESTOP
 import sys
+import time
 
 # L_DIR = "/tmp/MIS_logs/light"
-LIGHT_STATE = False
-SPEED_STATE = False
+HEARTBEAT_TIME = 0.1 # secs - tells the main process this server is still alive, the replies bring the light and speed state
+TELEMETRY_RATE = 5 # Hz - telemetry messages sent to a browser at most, the changes in between are merged
+link = ControlClient() # key state frames to main.py, telemetry from it in link.telemetry
+clients = {} # socket.io session id --> client id in the frames, 0 is this server, at most 0x7FFF as in the telemetry
+last_client = 0
+subscribers = {} # socket.io session id --> [time its next telemetry message is allowed, values it was sent]
+
+def client_id():
+    global last_client
+    if request.sid not in clients:
+        last_client = last_client % 0x7FFF + 1
+        clients[request.sid] = last_client
+    return clients[request.sid]
 
 @socket.on('connect')
 def test_connect():
-    global LIGHT_STATE
-    global SPEED_STATE
-
     sys.stdout.write("Client connected!\n")
     sys.stdout.flush()
+    client_id()
+    # light and speed as main.py last replied
+    emit('light', 'ON' if link.light else 'OF')
+    emit('speed', 'HI' if link.speed else 'LO')
+    subscribers[request.sid] = [0, {}] # the whole state known so far goes with the next heartbeat
 
-    if LIGHT_STATE:
-        emit('light', 'ON')
-    else:
-        emit('light', 'OF')
-
-    if SPEED_STATE:
-        emit('speed', 'HI')
-    else:
-        emit('speed', 'LO')
+@socket.on('disconnect')
+def test_disconnect():
+    subscribers.pop(request.sid, None)
+    if request.sid in clients:
+        link.send(clients.pop(request.sid), 0) # release its keys now, not at the end of its lease
 
-@socket.on('pressed')
-def handle_key_is_pressing(signal):
-    sys.stdout.write(signal + "\n")
-    sys.stdout.flush()
+@socket.on('keys')
+def handle_keys(bits): # bitmap of the held keys, on every change and as a heartbeat while held
+    link.send(client_id(), int(bits) & 0xFF)
 
 # @socket.on('released')
 # def handle_key_released(signal):
@@ -52,35 +63,49 @@ def handle_key_is_pressing(signal):
 #     sys.stdout.flush()
 
 @socket.on('light')
-def handle_light_toggle():
-    global LIGHT_STATE
-    
-    LIGHT_STATE = ~LIGHT_STATE
-
-    if LIGHT_STATE:
-        sys.stdout.write("LO\n") # LIGHT ON
-        emit('light', 'ON')
-    else:
-        sys.stdout.write("LF\n") # LIGHT OFF
-        emit('light', 'OF')
-    sys.stdout.flush()
+def handle_light_toggle(): # the new state comes back with the next reply
+    link.send(client_id(), command=LIGHT_OFF if link.light else LIGHT_ON)
 
 @socket.on('speed')
 def handle_speed_toggle():
-    global SPEED_STATE
-    
-    SPEED_STATE = ~SPEED_STATE
+    link.send(client_id(), command=LOWSPEED if link.speed else HIGHSPEED)
 
-    if SPEED_STATE:
-        sys.stdout.write("HS\n") # HIGHSPEED
-        emit('speed', 'HI')
-    else:
-        sys.stdout.write("LS\n") # LOWSPEED
-        emit('speed', 'LO')
+@socket.on('estop')
+def handle_estop(): # from anyone, whoever holds the control lease
+    link.send(client_id(), 0, command=ESTOP)
 
-    sys.stdout.flush()
+
+def holder_name(holder, sid): # the holder of the control lease, as seen by that browser
+    if holder < 0:
+        return 'PS2'
+    if holder == 0:
+        return 'NOBODY'
+    return 'YOU' if clients.get(sid) == holder else 'WEB #%d' % holder
+
+
+def publish_telemetry(now): # the fields changed since what each browser was last sent, at most TELEMETRY_RATE per browser
+    for sid, subscriber in list(subscribers.items()):
+        if now < subscriber[0]: # too soon for this one, its changes keep until its next turn
+            continue
+        changes = link.telemetry.delta(subscriber[1])
+        if 'holder' in changes:
+            changes['holder'] = holder_name(changes['holder'], sid)
+        if changes:
+            socket.emit('telemetry', changes, room=sid)
+            subscriber[0] = now + 1.0 / TELEMETRY_RATE
+
+
+def heartbeat():
+    while True:
+        link.send(0)
+        if link.replies(): # the lights or the speed changed, from here or from the PS2 controller
+            socket.emit('light', 'ON' if link.light else 'OF')
+            socket.emit('speed', 'HI' if link.speed else 'LO')
+        publish_telemetry(time.monotonic())
+        socket.sleep(HEARTBEAT_TIME)
 
 
 if __name__ == "__main__":
+    socket.start_background_task(heartbeat)
     # control_app.run(host='0.0.0.0', port=7497, debug=False)  # run collecting app
     socket.run(control_app,host='0.0.0.0', port=8003)
@@ -1,3 +1,4 @@
+import hal
 from usb_peripherals.ultrasonics import Ultrasonics
 from usb_peripherals.motor import MotorUART_PWM#, MotorUART_PID
 
@@ -5,8 +6,9 @@ SENSOR_BAUDRATE = 9600
 MOTOR_BAUDRATE = 250000
 MAX_SPEED = 600
 
-sensor = Ultrasonics(SENSOR_BAUDRATE)
+ports = hal.get('ports') # role --> port: discovery on the robot, pty emulators with UVROBOT_BACKEND=sim
+sensor = Ultrasonics(SENSOR_BAUDRATE, ports.get('sensor'))
 # sensor = Ultrasonics(PORT, BAUDRATE)
-motor = MotorUART_PWM(sensor.port, MOTOR_BAUDRATE, MAX_SPEED)
+motor = MotorUART_PWM(sensor.port, MOTOR_BAUDRATE, MAX_SPEED, ports.get('motor'))
 # Motor = MotorUART_PWM(PORT, BAUDRATE, MAX_SPEED)
 
@@ -0,0 +1,113 @@
+"""------------------------------------------------------------*-
+  USB serial device discovery module
+ --------------------------------------------------------------
+ * Finds which serial port belongs to which peripheral, without
+ * relying on the ttyUSB enumeration order.
+ *
+ * For each role of DEVICES, in this order:
+ * - the udev symlink, if it exists (see 99-uvrobot-serial.rules)
+ * - the only port whose USB VID/PID (and serial number, if set)
+ *   matches, from a single list_ports scan of sysfs
+ * - probing, only for the roles still unknown: every candidate
+ *   port is opened at the same time, each on its own thread,
+ *   and asked by the probe of the role
+ * - the last port left, for a role without a probe (the MSD_EM
+ *   driver never talks first, so it can't be probed)
+ *
+ * Print what is connected with:
+ *      python3 -m serial.tools.list_ports -v
+ *
+ --------------------------------------------------------------"""
+import os
+import serial
+import threading
+import time
+from serial.tools import list_ports
+
+PROBE_TIMEOUT = 2.5 # secs - the Nano resets when the port is opened, its bootloader takes ~1.5s
+CANDIDATES = ('/dev/ttyUSB', '/dev/ttyACM') # ports worth probing
+
+# role --> how to recognise its adapter, None matches anything
+DEVICES = {
+    'sensor': {'symlink': '/dev/uvrobot-sensor', 'vid': 0x1A86, 'pid': 0x7523, 'serial': None}, # CH340 of the Nano
+    'motor':  {'symlink': '/dev/uvrobot-motor', 'vid': None, 'pid': None, 'serial': None}, # whatever is left
+}
+
+
+def probe_sensor(port, baudrate=9600): # True if the port streams frames of 6 distances
+    try:
+        with serial.Serial(port=port, baudrate=baudrate, timeout=PROBE_TIMEOUT) as connection:
+            connection.readline() # probably a partial line
+            return len(connection.readline().split()) == 6
+    except (serial.SerialException, OSError):
+        return False
+
+PROBES = {'sensor': probe_sensor} # role --> callable(port) returning True if the device of the role is there
+
+
+def _matches(info, device): # True if the port description fits the VID/PID/serial of the device
+    if device.get('vid') is None and device.get('serial') is None:
+        return False # nothing to match on
+    for key, attr in (('vid', 'vid'), ('pid', 'pid'), ('serial', 'serial_number')):
+        wanted = device.get(key)
+        if wanted is not None and getattr(info, attr) != wanted:
+            return False
+    return True
+
+
+def discover(devices=DEVICES, probes=PROBES):
+    """
+    Map every role of devices to a port
+    @param devices: a dict role --> {'symlink', 'vid', 'pid', 'serial'}
+    @param probes: a dict role --> callable(port) returning a boolean
+    @return a dict role --> port, roles that weren't found are left out
+    """
+    start = time.monotonic()
+    found = {}
+    ports = [info for info in list_ports.comports() if info.device.startswith(CANDIDATES)]
+    claimed = set()
+
+    for role, device in devices.items(): # udev symlinks
+        link = device.get('symlink')
+        if link and os.path.exists(link):
+            found[role] = link
+            claimed.add(os.path.realpath(link))
+
+    ambiguous = {} # role --> ports matching the same VID/PID
+    for role, device in devices.items(): # USB descriptors
+        if role in found:
+            continue
+        matches = [info.device for info in ports if info.device not in claimed and _matches(info, device)]
+        if len(matches) == 1:
+            found[role] = matches[0]
+            claimed.add(matches[0])
+        elif matches:
+            ambiguous[role] = matches
+
+    unknown = [role for role in devices if role not in found and role in probes]
+    if unknown: # probe the ports left, all at once
+        free = [info.device for info in ports if info.device not in claimed]
+        answers = {} # (role, port) --> boolean
+        threads = []
+        for role in unknown:
+            for port in ambiguous.get(role, free):
+                thread = threading.Thread(target=lambda r=role, p=port: answers.__setitem__((r, p), probes[r](p)))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+        for thread in threads:
+            thread.join(PROBE_TIMEOUT + 1)
+        for role in unknown:
+            for port in ambiguous.get(role, free):
+                if answers.get((role, port)) and port not in claimed:
+                    found[role] = port
+                    claimed.add(port)
+                    break
+
+    left = [info.device for info in ports if info.device not in claimed]
+    unprobed = [role for role in devices if role not in found and role not in probes]
+    if len(unprobed) == 1 and len(left) == 1: # the last one standing
+        found[unprobed[0]] = left[0]
+
+    print('USB discovery in %.0fms:' % ((time.monotonic() - start) * 1000), found)
+    return found
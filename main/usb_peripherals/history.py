@@ -0,0 +1,115 @@
+"""------------------------------------------------------------*-
+  Sensor history module for the ultrasonic sensors
+ --------------------------------------------------------------
+ * Keeps the last DEPTH frames of all channels in a fixed-size
+ * NumPy ring, and gives filtered views over it:
+ * - median(): per channel median of the ring, kills single
+ *   sample spikes.
+ * - ema(): exponential moving average, updated on every push.
+ * - robust(): per channel mean of the samples within OUTLIER_K
+ *   median absolute deviations of the median.
+ *
+ * Every view is computed on whole arrays into preallocated
+ * buffers, there is no loop over samples. push() is called by
+ * the reader thread, the views by the control loop, so both
+ * sides take the lock.
+ *
+ --------------------------------------------------------------"""
+import threading
+import numpy as np
+
+DEPTH = 5 # frames, ~150ms of Nano frames
+EMA_ALPHA = 0.3 # weight of the newest frame in ema()
+OUTLIER_K = 3.0 # samples further than this many MADs from the median are rejected by robust()
+MIN_SPREAD = 2.0 # cm - lower bound of the MAD, so a steady channel doesn't reject its own noise
+
+
+class SensorHistory(object):
+    """
+    A python written ring buffer of multi-channel sensor frames.
+
+    """
+    def __init__(self, channels=6, depth=DEPTH, alpha=EMA_ALPHA, k=OUTLIER_K):
+        """
+        Constructor
+        @param channels: an integer indicates the number of values in a frame
+        @param depth: an integer indicates the number of frames kept
+        @param alpha: a float in (0, 1], weight of the newest frame in the ema
+        @param k: a float indicates the outlier rejection threshold, in MADs
+        """
+        if depth < 1 or not 0 < alpha <= 1:
+            raise ValueError('The given depth or alpha is invalid!')
+        self.depth = depth
+        self.alpha = alpha
+        self.k = k
+        self.frames = np.zeros((depth, channels), dtype=np.float32)
+        self.count = 0 # number of valid frames, always rows [0, count) since the ring fills from row 0
+        self.index = 0 # next row to write
+        self.__lock = threading.Lock()
+        self.__ema = np.zeros(channels, dtype=np.float32)
+        self.__median = np.zeros(channels, dtype=np.float32)
+        self.__step = np.zeros(channels, dtype=np.float32)
+        self.__dev = np.zeros((depth, channels), dtype=np.float32)
+        self.__mask = np.zeros((depth, channels), dtype=bool)
+
+    def push(self, values): # add a frame, overwriting the oldest one when the ring is full
+        with self.__lock:
+            row = self.frames[self.index]
+            row[:] = values
+            if self.count == 0:
+                self.__ema[:] = row
+            else: # ema += alpha*(row - ema)
+                np.subtract(row, self.__ema, out=self.__step)
+                self.__step *= self.alpha
+                self.__ema += self.__step
+            self.index = (self.index + 1) % self.depth
+            if self.count < self.depth:
+                self.count += 1
+
+    def clear(self): # forget everything, e.g. after the sensor went silent
+        with self.__lock:
+            self.count = 0
+            self.index = 0
+
+    def latest(self): # newest frame, or None if empty
+        with self.__lock:
+            if self.count == 0:
+                return None
+            return self.frames[self.index - 1].copy()
+
+    def ordered(self): # copy of the frames in the ring, oldest first
+        with self.__lock:
+            if self.count < self.depth:
+                return self.frames[:self.count].copy()
+            return np.roll(self.frames, -self.index, axis=0)
+
+    def median(self): # per channel median of the ring, or None if empty
+        with self.__lock:
+            if self.count == 0:
+                return None
+            np.median(self.frames[:self.count], axis=0, out=self.__median)
+            return self.__median.copy()
+
+    def ema(self): # per channel exponential moving average, or None if empty
+        with self.__lock:
+            if self.count == 0:
+                return None
+            return self.__ema.copy()
+
+    def robust(self): # per channel mean of the ring without its outliers, or None if empty
+        with self.__lock:
+            count = self.count
+            if count == 0:
+                return None
+            window = self.frames[:count]
+            dev = self.__dev[:count]
+            mask = self.__mask[:count]
+            median = np.median(window, axis=0, out=self.__median)
+            np.subtract(window, median, out=dev)
+            np.abs(dev, out=dev)
+            spread = np.median(dev, axis=0) # median absolute deviation
+            np.maximum(spread, MIN_SPREAD, out=spread)
+            spread *= self.k
+            np.less_equal(dev, spread, out=mask) # at least half of the samples are kept
+            np.multiply(window, mask, out=dev)
+            return dev.sum(axis=0) / mask.sum(axis=0)
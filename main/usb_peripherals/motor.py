@@ -28,6 +28,8 @@ import os
 import serial
 import struct
 import time
+from monitor import stats
+from usb_peripherals.writer import SerialWriter
 
 ################# constant for PID #######################
 # RAD_STEP = 1 # radian
@@ -40,6 +42,115 @@ MINIMUM_DIF = 50
 DEPART_PWM = 120
 STOP_PWM = 90 # value in which the motors almost don't move, so we can set them to zero immediately
 # MAX_PWM declared inside the class
+FRAME_GAP = 0.001 # secs - pacing the MSD_EM driver needs between two writes
+WRITE_TIMEOUT = 0.05 # secs - give up on a write to a stalled adapter after this long
+REFRESH_TIME = 1 # secs - resend every channel this often, in case the driver has been reset
+CHANNELS = (1, 2, 3, 4) # N1, N2: wheels - N3, N4: hands. N0 addresses all of them at once
+TWIST_ACCEL = 600 # pwm/s - default ramp of set_twist() when a wheel speeds up, PWM_STEP every 50ms like the arrows did
+TWIST_DECEL = 1200 # pwm/s - default ramp when a wheel slows down, braking is allowed to be harder
+MAX_TICK = 0.1 # secs - longest time update() ramps over in one go, so a stalled tick can't jump the speed
+
+# ---------------------------- motion rules --------------------------------
+# The (pwm_1, pwm_2) state is classified into a regime, then the rule stored in
+# MOTION_TABLE for (command, regime) updates it. pwm_1 drives the left wheel,
+# pwm_2 the right one. Rules work on w = [0, pwm_1, pwm_2], so a wheel is
+# addressed by its channel number, and return the (channel, pwm) commands to
+# send, or RELEASE to slow down instead.
+STRAIGHT = 0 # pwm_1 == pwm_2, standstill or straight forward/backward
+LEAD_1 = 1 # |pwm_1| > |pwm_2|, turning right
+LEAD_2 = 2 # |pwm_1| < |pwm_2|, turning left
+
+MOVE_FW = 0
+MOVE_BW = 1
+TURN_RIGHT = 2
+TURN_LEFT = 3
+
+RELEASE = None
+
+
+def _depart_or_speed_up(w, accel, sign, max_pwm): # move straight, sign = 1 forward, -1 backward
+    pwm = w[1]
+    if abs(pwm) < DEPART_PWM:
+        pwm = sign*DEPART_PWM
+        cmds = [(0, pwm)]
+    elif sign*pwm < max_pwm:
+        pwm += sign*accel # faster a little bit
+        cmds = [(0, pwm)]
+    else:
+        cmds = []
+    w[1] = w[2] = pwm
+    return cmds + [(3, 0), (4, 0)]
+
+def _catch_up(w, accel, sign, max_pwm, lead, lag): # move straight while turning: bring the slow wheel up
+    if sign*w[lead] <= sign*w[lag]: # turning against the moving direction
+        return RELEASE
+    pwm = w[lag]
+    if -DEPART_PWM < pwm < DEPART_PWM:
+        pwm = sign*DEPART_PWM
+    elif abs(w[lead] - pwm) < MINIMUM_DIF:
+        pwm = w[lead]
+    else:
+        pwm += sign*accel # faster a little bit to make it fast enough with the other
+    w[lag] = pwm
+    return [(lag, pwm)]
+
+def _start_turning(w, accel, direction, max_pwm, drive, other, slow_by): # turn while going straight, slow_by None means accel
+    pwm = w[drive]
+    if abs(pwm) < STOP_PWM: # standstill
+        w[drive] = DEPART_PWM if direction else -DEPART_PWM
+        return [(drive, w[drive])]
+    sign = 1 if pwm > STOP_PWM else -1
+    if sign*pwm < max_pwm:
+        w[drive] = pwm + sign*accel # faster a little bit
+        return [(drive, w[drive])]
+    if sign*pwm > max_pwm: # protection if real speed is higher than limit
+        w[1] = w[2] = sign*max_pwm
+        return [(0, w[drive]), (3, 0), (4, 0)]
+    w[other] -= sign*(accel if slow_by is None else slow_by) # at max speed: slower the other motor
+    return [(other, w[other])]
+
+def _even_out(w, accel, direction, max_pwm, drive, other): # turning the other way: bring the drive wheel up
+    if abs(w[other] - w[drive]) < MINIMUM_DIF:
+        w[drive] = w[other]
+    elif w[drive] < w[other]:
+        w[drive] += accel
+    else:
+        w[drive] -= accel
+    return [(drive, w[drive])]
+
+def _turn_harder(w, accel, direction, max_pwm, drive, other): # already turning this way
+    sign = 1 if w[drive] > w[other] else -1
+    pwm = w[drive]
+    if sign*pwm < max_pwm:
+        w[drive] = pwm + sign*accel # faster a little bit
+        return [(drive, w[drive])]
+    if sign*pwm > max_pwm: # protection if real speed is higher than limit
+        w[drive] = sign*max_pwm
+        return [(drive, w[drive])]
+    pwm = w[other]
+    if pwm == 0 or abs(pwm) == DEPART_PWM: # reached max turning limit
+        return []
+    if abs(pwm) < DEPART_PWM:
+        w[other] = sign*DEPART_PWM
+    else:
+        w[other] = pwm - sign*accel # slower a little the other motor
+    return [(other, w[other])]
+
+# command --> (regime used when |pwm_1| == |pwm_2| in opposite directions, {regime: (rule, wheels)})
+MOTION_TABLE = {
+    MOVE_FW:    (LEAD_2, {STRAIGHT: (_depart_or_speed_up, ()),
+                          LEAD_1:   (_catch_up, (1, 2)),
+                          LEAD_2:   (_catch_up, (2, 1))}),
+    MOVE_BW:    (LEAD_2, {STRAIGHT: (_depart_or_speed_up, ()),
+                          LEAD_1:   (_catch_up, (1, 2)),
+                          LEAD_2:   (_catch_up, (2, 1))}),
+    TURN_RIGHT: (LEAD_1, {STRAIGHT: (_start_turning, (1, 2, DEPART_PWM)),
+                          LEAD_1:   (_turn_harder, (1, 2)),
+                          LEAD_2:   (_even_out, (1, 2))}),
+    TURN_LEFT:  (LEAD_2, {STRAIGHT: (_start_turning, (2, 1, None)),
+                          LEAD_1:   (_even_out, (2, 1)),
+                          LEAD_2:   (_turn_harder, (2, 1))}),
+}
 
 millis = lambda: int(time.time() * 1000)
 
@@ -51,24 +162,30 @@ class MotorUART_PWM(object):
     UART serial connection via PySerial.
     """
 
-    def __init__(self, busy_port='/dev/ttyUSB0', baudRate=250000, speed = 400):
+    def __init__(self, busy_port='/dev/ttyUSB0', baudRate=250000, speed = 400, port=None, clock=time.monotonic):
         """
         Constructor
-        @param port: a string dedicated to the connected device
+        @param busy_port: a string dedicated to another device, the other ttyUSB is used
         @param baudRate: an integer indicates the connection spped
+        @param port: a string dedicated to the connected device, overrides busy_port
+        @param clock: a callable returning monotonic time in secs, for the ramps and refreshes (virtual in a replay)
         """
         if baudRate < 9600 or baudRate > 1000000:
             raise ValueError('The given baudrate is invalid!')
 
-        self.port = '/dev/ttyUSB0'
-        if self.port == busy_port:
-            self.port = '/dev/ttyUSB1'
+        if port is not None: # found by usb_peripherals.discovery
+            self.port = port
+        else:
+            self.port = '/dev/ttyUSB0'
+            if self.port == busy_port:
+                self.port = '/dev/ttyUSB1'
         # Initialize PySerial connection
         print('motor port ', self.port)
         self.__serial = serial.Serial(port=self.port,
                                     baudrate=baudRate,
                                     bytesize=serial.EIGHTBITS, 
-                                    timeout=2
+                                    timeout=2,
+                                    write_timeout=WRITE_TIMEOUT
                                     )
 
         if self.__serial.isOpen():
@@ -81,6 +198,20 @@ class MotorUART_PWM(object):
         self.BACKWARD = False # for outer use, not here
         self.MAX_PWM = speed
         self.last_millis = millis()
+        self.__pending = {} # channel --> pwm, commands collected during the current control tick
+        self.__errors = 0 # writer errors already taken into account
+        self.__overwritten = 0 # frames dropped from the full writer ring, already taken into account
+        self.__shadow = [0, 0, 0, 0, 0] # last value sent to each channel, N0 P0 is sent below
+        self.__blocked = [0, 0, 0, 0, 0] # per channel: 1 or -1 if that direction is stopped by a limit switch
+        self.clock = clock
+        self.__last_refresh = clock()
+        self.sent = 0 # number of channel commands written to the driver
+        self.suppressed = 0 # number of channel commands skipped since the driver already has the value
+        self.linear = 0.0 # target body velocity given to set_twist()
+        self.angular = 0.0
+        self.accel = TWIST_ACCEL # pwm/s
+        self.decel = TWIST_DECEL # pwm/s
+        self.__last_update = clock()
         """
           MODE_TURNING = 0
           MODE_SF_POSITION = 1
@@ -97,6 +228,12 @@ class MotorUART_PWM(object):
         self.__serial.write(cmd_0)
         time.sleep(0.001) # stablize time
         self.__serial.write(cmd_1)
+
+        # all following commands are written by a background thread
+        self.writer = SerialWriter(self.__serial, FRAME_GAP,
+                                   send_stats=stats.histogram('motor.send'), # time spent in serial writes
+                                   latency_stats=stats.histogram('motor.latency')) # time from flush() to written
+        self.writer.start()
         print("Motor ready!")
 
     def __del__(self):
@@ -110,43 +247,105 @@ class MotorUART_PWM(object):
         ## stop the motor if still running
         while self.pwm_1 != 0 and self.pwm_2 != 0:
             self.release()
+            self.flush()
+        if self.writer.is_alive():
+            self.stop() # make sure nothing is left running
+            self.writer.drain()
+            self.writer.stop()
         ## Close connection if still established
         if (self.__serial is not None and self.__serial.isOpen() == True):
             self.__serial.close()
-            
-    def __send(self, cmd): # format and send to the driver
-        cmd = cmd.encode('utf-8')
-        self.__serial.write(cmd) # send to the driver
+
+    def stop(self): # stop all motors now, ahead of anything still queued
+        self.pwm_1 = self.pwm_2 = 0
+        self.linear = self.angular = 0.0
+        self.__pending.clear()
+        self.__shadow = [0, 0, 0, 0, 0]
+        self.writer.put_urgent(b'{N0 P0}')
+        self.sent += 1
+
+    def __set(self, channel, value): # queue a command for channel N0-N4, last write wins until flush()
+        pending = self.__pending
+        pending.pop(channel, None) # re-insert, so the frame keeps the order of the last writes
+        if channel == 0: # N0 drives all motors, so it overrides anything pending on N1-N4
+            for other in CHANNELS:
+                pending.pop(other, None)
+        pending[channel] = value
+
+    def __frame(self): # turn pending commands into one frame, skipping the values the driver already has
+        pending = self.__pending
+        shadow = self.__shadow
+        now = self.clock()
+        if now - self.__last_refresh > REFRESH_TIME: # forced refresh: resend everything
+            self.__last_refresh = now
+            if 0 not in pending:
+                refresh = {channel: shadow[channel] for channel in CHANNELS if channel not in pending}
+                refresh.update(pending)
+                pending = refresh
+            self.__shadow = shadow = [None] * 5
+        frame = []
+        blocked = self.__blocked
+        for channel, value in pending.items():
+            if blocked[channel] and value*blocked[channel] > 0: # the hand sits on its limit switch
+                value = 0
+            if channel == 0:
+                if shadow[1] == shadow[2] == shadow[3] == shadow[4] == value:
+                    self.suppressed += 1
+                    continue
+                shadow[1] = shadow[2] = shadow[3] = shadow[4] = value
+            elif shadow[channel] == value:
+                self.suppressed += 1
+                continue
+            shadow[channel] = value
+            frame.append('{N%d P%s}' % (channel, value))
+        self.__pending.clear()
+        self.sent += len(frame)
+        return ''.join(frame)
+
+    def flush(self): # hand all commands queued during this control tick to the writer as a single frame
+        if self.writer.errors != self.__errors: # a write failed, so the shadow can't be trusted anymore
+            self.__errors = self.writer.errors
+            self.refresh() # resend everything now
+        if self.writer.overwritten != self.__overwritten: # a dropped frame may hold values the shadow says were sent
+            self.__overwritten = self.writer.overwritten
+            self.refresh() # resend everything now
+        if not self.__pending and self.clock() - self.__last_refresh <= REFRESH_TIME:
+            return
+        frame = self.__frame()
+        if frame:
+            self.writer.put(frame.encode('utf-8'))
+
+    def refresh(self): # resend every channel on the next flush(), the refreshes go on from there
+        self.__last_refresh = float('-inf')
+
+    def age(self): # secs since the driver last took a frame, flush() refreshes it every REFRESH_TIME
+        return time.monotonic() - self.writer.last_write
+
+    def hand_limit(self, channel, direction): # priority stop of hand N3/N4, safe to call from a GPIO interrupt thread
+        self.__blocked[channel] = direction # nothing can drive it further that way, until hand_unlimit()
+        self.writer.put_priority(('{N%d P0}' % channel).encode('utf-8'))
+
+    def hand_unlimit(self, channel, direction): # the limit switch is released
+        if self.__blocked[channel] == direction:
+            self.__blocked[channel] = 0
 
     def Lhand_up(self):
-        time.sleep(0.001) # stablize time
-        cmd = "{N3 P300}" # Set all motors to PWM mode
-        self.__send(cmd) # format and send to the driver
+        self.__set(3, 300)
 
     def Lhand_down(self):
-        time.sleep(0.001) # stablize time
-        cmd = "{N3 P-300}" # Set all motors to PWM mode
-        self.__send(cmd) # format and send to the driver
+        self.__set(3, -300)
 
     def Lhand_stop(self):
-        time.sleep(0.001) # stablize time
-        cmd = "{N3 P0}" # Stop left hand motor
-        self.__send(cmd) # format and send to the driver
+        self.__set(3, 0)
     
     def Rhand_up(self):
-        time.sleep(0.001) # stablize time
-        cmd = "{N4 P300}" # Set all motors to PWM mode
-        self.__send(cmd) # format and send to the driver
+        self.__set(4, 300)
 
     def Rhand_down(self):
-        time.sleep(0.001) # stablize time
-        cmd = "{N4 P-300}" # Set all motors to PWM mode
-        self.__send(cmd) # format and send to the driver
+        self.__set(4, -300)
 
     def Rhand_stop(self):
-        time.sleep(0.001) # stablize time
-        cmd = "{N4 P0}" # Stop left hand motor
-        self.__send(cmd) # format and send to the driver
+        self.__set(4, 0)
 
     def __release(self, pwm_in): # support frame for release method
         pwm_out = 0 #  -STOP_PWM < pwm_in < STOP_PWM  --> stop now! so pwm_out = 0
@@ -167,364 +366,119 @@ class MotorUART_PWM(object):
             if self.pwm_1 == self.pwm_2:
                 self.pwm_1 = self.__release(self.pwm_1) # calculate value to really slow down
                 self.pwm_2 = self.pwm_1 # make them equal again
-                cmd = "{N0 P" + str(self.pwm_1) + "}" # {N1 P500} - set speed for pwm
-                self.__send(cmd) # format and send to the driver
-                time.sleep(0.001) # stablize time
-                cmd = "{N3 P0}" # {N1 P500} - set speed for pwm
-                self.__send(cmd) # format and send to the driver
-                time.sleep(0.001) # stablize time
-                cmd = "{N4 P0}" # {N1 P500} - set speed for pwm
-                self.__send(cmd) # format and send to the driver
+                self.__set(0, self.pwm_1)
+                self.__set(3, 0)
+                self.__set(4, 0)
             # --- turning right
             elif abs(self.pwm_1) > abs(self.pwm_2):
                 if self.pwm_2 != 0: # pwm_2 is supposed to be 0, if it's not zero, then reduce both until pwm_2 reaches zero
                     self.pwm_1 = self.__release(self.pwm_1) # calculate value to really slow down
                     self.pwm_2 = self.__release(self.pwm_2) # calculate value to really slow down
-                    cmd = "{N1 P" + str(self.pwm_1) + "}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
-                    time.sleep(0.001) # stablize time
-                    cmd = "{N2 P" + str(self.pwm_2) + "}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
+                    self.__set(1, self.pwm_1)
+                    self.__set(2, self.pwm_2)
                 else: # now pwm_2 is really 0, we can take care of pwm_1 fully
                     self.pwm_1 = self.__release(self.pwm_1) # calculate value to really slow down
-                    cmd = "{N1 P" + str(self.pwm_1) + "}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
+                    self.__set(1, self.pwm_1)
             # --- turning left
             else: # abs(self.pwm_1) < abs(self.pwm_2)
                 if self.pwm_1 != 0: # pwm_1 is supposed to be 0, if it's not zero, then reduce both until pwm_1 reaches zero
                     self.pwm_1 = self.__release(self.pwm_1) # calculate value to really slow down
                     self.pwm_2 = self.__release(self.pwm_2) # calculate value to really slow down
-                    cmd = "{N1 P" + str(self.pwm_1) + "}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
-                    time.sleep(0.001) # stablize time
-                    cmd = "{N2 P" + str(self.pwm_2) + "}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
+                    self.__set(1, self.pwm_1)
+                    self.__set(2, self.pwm_2)
                 else: # now pwm_1 is really 0, we can take care of pwm_2 fully
                     self.pwm_2 = self.__release(self.pwm_2) # calculate value to really slow down
-                    cmd = "{N2 P" + str(self.pwm_2) + "}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
+                    self.__set(2, self.pwm_2)
         return True # not done work yet, so return True
     
 
+    """
+    velocity control: set_twist() gives the target, update() ramps toward it once per control tick
+    use either this or the step methods below, update() overrides what they did
+    """
+    def set_twist(self, linear, angular):
+        """
+        Set the target body velocity, as fractions of MAX_PWM
+        @param linear: a float from -1 (full backward) to 1 (full forward)
+        @param angular: a float from -1 (full turn right) to 1 (full turn left)
+        """
+        self.linear = min(1.0, max(-1.0, linear))
+        self.angular = min(1.0, max(-1.0, angular))
+
+    def __targets(self): # differential drive kinematics: target pwm of the left and right wheels
+        left = self.linear - self.angular
+        right = self.linear + self.angular
+        peak = max(abs(left), abs(right))
+        if peak > 1: # scale both down, so the turning radius is kept at full speed
+            left /= peak
+            right /= peak
+        return left*self.MAX_PWM, right*self.MAX_PWM
+
+    def __ramp(self, pwm, target, secs): # next pwm of a wheel, one rate limited step toward its target
+        if -STOP_PWM < target < STOP_PWM: # the motor wouldn't move anyway
+            target = 0
+        elif pwm != 0 and (pwm > 0) != (target > 0): # reversing: brake down to zero first
+            target = 0
+        sign = 1 if (pwm or target) > 0 else -1
+        speed, goal = abs(pwm), abs(target)
+        if speed < goal:
+            speed = min(max(speed + self.accel*secs, DEPART_PWM), goal) # jump over the dead band when departing
+        elif speed > goal:
+            speed -= self.decel*secs
+            if speed < max(goal, STOP_PWM): # almost don't move anymore, so stop now
+                speed = goal
+        return sign*int(round(speed))
+
+    def update(self): # ramp both wheels toward the set_twist() target, call once per control tick before flush()
+        now = self.clock()
+        secs = min(now - self.__last_update, MAX_TICK)
+        self.__last_update = now
+        left, right = self.__targets()
+        pwm_1 = self.__ramp(self.pwm_1, left, secs)
+        pwm_2 = self.__ramp(self.pwm_2, right, secs)
+        if pwm_1 != self.pwm_1:
+            self.pwm_1 = pwm_1
+            self.__set(1, pwm_1)
+        if pwm_2 != self.pwm_2:
+            self.pwm_2 = pwm_2
+            self.__set(2, pwm_2)
+
     """
     only 6 direction: Straight, Left, Right * (Forward, Backward)
+    every motion is one lookup in MOTION_TABLE, see the rules above the class
     """
-    def move_fw(self, accel): # move forward, so both motor rotate at the same time
-        if self.pwm_1 == self.pwm_2: # system not turning, straight forward or backward
-            if abs(self.pwm_1) < DEPART_PWM: # pwm_1 is equal pwm_2, so choose one to do math
-                self.pwm_1 = DEPART_PWM
-                cmd = "{N0 P" + str(self.pwm_1) + "}" # {N1 P500} - set speed for pwm
-                self.__send(cmd) # format and send to the driver
-            elif self.pwm_1 < self.MAX_PWM:
-                self.pwm_1 += accel # faster a little bit
-                cmd = "{N0 P" + str(self.pwm_1) + "}" # {N1 P500} - set speed for pwm
-                self.__send(cmd) # format and send to the driver
-            time.sleep(0.001) # stablize time
-            cmd = "{N3 P0}" # {N1 P500} - set speed for pwm
-            self.__send(cmd) # format and send to the driver
-            time.sleep(0.001) # stablize time
-            cmd = "{N4 P0}" # {N1 P500} - set speed for pwm
-            self.__send(cmd) # format and send to the driver
-            self.pwm_2 = self.pwm_1 # if pwm_1 changed, then change pwm_2
+    def __drive(self, command, accel, direction):
+        tie, rules = MOTION_TABLE[command]
+        pwm_1, pwm_2 = self.pwm_1, self.pwm_2
+        if pwm_1 == pwm_2:
+            regime = STRAIGHT
+        elif abs(pwm_1) > abs(pwm_2):
+            regime = LEAD_1
+        elif abs(pwm_1) < abs(pwm_2):
+            regime = LEAD_2
+        else: # same speed, opposite directions
+            regime = tie
+        rule, wheels = rules[regime]
+        w = [0, pwm_1, pwm_2]
+        cmds = rule(w, accel, direction, self.MAX_PWM, *wheels)
+        if cmds is RELEASE:
+            self.release()
             return
-        elif abs(self.pwm_1) > abs(self.pwm_2): # system is turning in some direction
-            if self.pwm_1 > self.pwm_2: # positive value
-                if -DEPART_PWM < self.pwm_2 < DEPART_PWM: # pwm_1 is equal pwm_2, so choose one to do math
-                    self.pwm_2 = DEPART_PWM
-                elif abs(self.pwm_1-self.pwm_2) < MINIMUM_DIF:
-                    self.pwm_2 = self.pwm_1
-                else:
-                    self.pwm_2 += accel # faster a little bit to make it fast enough with the other
-                cmd = "{N2 P" + str(self.pwm_2) + "}" # {N1 P500} - set speed for pwm
-                self.__send(cmd) # format and send to the driver
-                return
-            # negative value will be released below
-        else: # abs(self.pwm_1) < abs(self.pwm_2): system is turning in the other direction
-            if self.pwm_1 < self.pwm_2: # positive value
-                if -DEPART_PWM < self.pwm_1 < DEPART_PWM: # pwm_1 is equal pwm_2, so choose one to do math
-                    self.pwm_1 = DEPART_PWM
-                elif abs(self.pwm_2-self.pwm_1) < MINIMUM_DIF:
-                    self.pwm_1 = self.pwm_2
-                else:
-                    self.pwm_1 += accel # faster a little bit to make it fast enough with the other
-                cmd = "{N1 P" + str(self.pwm_1) + "}" # {N1 P500} - set speed for pwm
-                self.__send(cmd) # format and send to the driver
-                return
-           # negative value will be released below
-        self.release() # release for negative value since we are moving forward
+        self.pwm_1, self.pwm_2 = w[1], w[2]
+        for channel, value in cmds:
+            self.__set(channel, value)
+
+    def move_fw(self, accel): # move forward, so both motor rotate at the same time
+        self.__drive(MOVE_FW, accel, 1)
 
     def move_bw(self, accel): # move backward, so both motor rotate at the same time
-        if self.pwm_1 == self.pwm_2: # system not turning
-            if -DEPART_PWM < self.pwm_1 < DEPART_PWM: # pwm_1 is equal pwm_2, so choose one to do math
-                self.pwm_1 = -DEPART_PWM
-                cmd = "{N0 P" + str(self.pwm_1) + "}" # {N1 P500} - set speed for pwm
-                self.__send(cmd) # format and send to the driver
-            elif self.pwm_1 > -self.MAX_PWM:
-                self.pwm_1 -= accel # faster a little bit
-                cmd = "{N0 P" + str(self.pwm_1) + "}" # {N1 P500} - set speed for pwm
-                self.__send(cmd) # format and send to the driver
-            time.sleep(0.001) # stablize time
-            cmd = "{N3 P0}" # {N1 P500} - set speed for pwm
-            self.__send(cmd) # format and send to the driver
-            time.sleep(0.001) # stablize time
-            cmd = "{N4 P0}" # {N1 P500} - set speed for pwm
-            self.__send(cmd) # format and send to the driver
-            self.pwm_2 = self.pwm_1 # if pwm_1 changed, then change pwm_2
-            return
-        elif abs(self.pwm_1) > abs(self.pwm_2): # system is turning in some direction
-            if self.pwm_1 < self.pwm_2: # negative value
-                if -DEPART_PWM < self.pwm_2 < DEPART_PWM: # pwm_1 is equal pwm_2, so choose one to do math
-                    self.pwm_2 = -DEPART_PWM
-                elif abs(self.pwm_1-self.pwm_2) < MINIMUM_DIF:
-                    self.pwm_2 = self.pwm_1
-                else:
-                    self.pwm_2 -= accel # faster a little bit to make it fast enough with the other
-                cmd = "{N2 P" + str(self.pwm_2) + "}" # {N1 P500} - set speed for pwm
-                self.__send(cmd) # format and send to the driver
-                return
-            # positive value will be released below
-        else: # system is turning in the other direction: abs(self.pwm_1) < abs(self.pwm_2)
-            if self.pwm_1 > self.pwm_2: # negative value
-                if -DEPART_PWM < self.pwm_1 < DEPART_PWM: # pwm_1 is equal pwm_2, so choose one to do math
-                    self.pwm_1 = -DEPART_PWM
-                elif abs(self.pwm_2-self.pwm_1) < MINIMUM_DIF:
-                    self.pwm_1 = self.pwm_2
-                else:
-                    self.pwm_1 -= accel # faster a little bit to make it fast enough with the other
-                cmd = "{N1 P" + str(self.pwm_1) + "}" # {N1 P500} - set speed for pwm
-                self.__send(cmd) # format and send to the driver
-                return
-           # positive value will be released below
-        self.release() # release for positive value since we are moving backward
+        self.__drive(MOVE_BW, accel, -1)
 
     def turn_right(self, direction, accel): # turn right, so only one motor rotate at a time  |pwm_1| > |pwm_2|
-        # --- if system is standstill, moving for/back
-        if self.pwm_1 == self.pwm_2:
-            # --- standstill
-            if abs(self.pwm_1) < STOP_PWM : 
-                if direction: # if moving forward
-                    self.pwm_1 = DEPART_PWM
-                else: # if moving backward
-                    self.pwm_1 = -DEPART_PWM
-                cmd = "{N1 P" + str(self.pwm_1) + "}" # {N1 P500} - set speed for pwm
-                self.__send(cmd) # format and send to the driver
-                return
-            # --- moving forward
-            elif self.pwm_1 > STOP_PWM : # absolutely > 0
-                if self.pwm_1 < self.MAX_PWM:
-                    self.pwm_1 += accel # faster a little bit
-                    cmd = "{N1 P" + str(self.pwm_1) + "}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
-                    return
-                elif self.pwm_1 > self.MAX_PWM:
-                    self.pwm_1 = self.pwm_2 = self.MAX_PWM # protection if real speed is higher than limit
-                    cmd = "{N0 P" + str(self.pwm_1) + "}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
-                    time.sleep(0.001) # stablize time
-                    cmd = "{N3 P0}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
-                    time.sleep(0.001) # stablize time
-                    cmd = "{N4 P0}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
-                    return
-                else: # self.pwm_1 == self.MAX_PWM, so self.pwm_2 == self.MAX_PWM too
-                    self.pwm_2 -= DEPART_PWM  # slower the other motor
-                    cmd = "{N2 P" + str(self.pwm_2) + "}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
-                    return
-            # --- moving backward
-            else : # self.pwm_1 < -STOP_PWM
-                if self.pwm_1 > -self.MAX_PWM:
-                    self.pwm_1 -= accel # faster a little bit
-                    cmd = "{N1 P" + str(self.pwm_1) + "}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
-                    return
-                elif self.pwm_1 < -self.MAX_PWM:
-                    self.pwm_1 = self.pwm_2 = -self.MAX_PWM # protection if real speed is higher than limit
-                    cmd = "{N0 P" + str(self.pwm_1) + "}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
-                    time.sleep(0.001) # stablize time
-                    cmd = "{N3 P0}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
-                    time.sleep(0.001) # stablize time
-                    cmd = "{N4 P0}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
-                    return
-                else: # self.pwm_1 == -self.MAX_PWM, so self.pwm_2 == -self.MAX_PWM too
-                    self.pwm_2 += DEPART_PWM  # slower a little the other motor
-                    cmd = "{N2 P" + str(self.pwm_2) + "}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
-                    return
-        # --- if system is turning left instead, then make the right wheel faster
-        elif abs(self.pwm_1) < abs(self.pwm_2):
-            if abs(self.pwm_2-self.pwm_1) < MINIMUM_DIF:
-                self.pwm_1 = self.pwm_2
-            elif self.pwm_1 < self.pwm_2: # postitive value
-                self.pwm_1 += accel # faster a little bit to make it fast enough with the other
-            else: # self.pwm_1 > self.pwm_2, negative value
-                self.pwm_1 -= accel # faster a little bit to make it fast enough with the other
-            cmd = "{N1 P" + str(self.pwm_1) + "}" # {N1 P500} - set speed for pwm
-            self.__send(cmd) # format and send to the driver
-            return
-        # --- if system is really turning right
-        else: # abs(self.pwm_1) > abs(self.pwm_2)
-            if self.pwm_1 > self.pwm_2: # positive value
-                if self.pwm_1 < self.MAX_PWM:
-                    self.pwm_1 += accel # faster a little bit
-                    cmd = "{N1 P" + str(self.pwm_1) + "}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
-                    return
-                elif self.pwm_1 > self.MAX_PWM:
-                    self.pwm_1 = self.MAX_PWM # protection if real speed is higher than limit
-                    cmd = "{N1 P" + str(self.pwm_1) + "}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
-                    return
-                else: # self.pwm_1 == self.MAX_PWM, so self.pwm_2 == self.MAX_PWM too
-                    if self.pwm_2 == 0 or abs(self.pwm_2) == DEPART_PWM: # reached max turning limit
-                        return
-                    if abs(self.pwm_2) < DEPART_PWM:
-                        self.pwm_2 = DEPART_PWM
-                    else:
-                        self.pwm_2 -= accel  # slower a little the other motor
-                    cmd = "{N2 P" + str(self.pwm_2) + "}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
-                    return
-            else: # self.pwm_1 < self.pwm_2, negative value
-                if self.pwm_1 > -self.MAX_PWM:
-                    self.pwm_1 -= accel # faster a little bit
-                    cmd = "{N1 P" + str(self.pwm_1) + "}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
-                    return
-                elif self.pwm_1 < -self.MAX_PWM:
-                    self.pwm_1 = -self.MAX_PWM # protection if real speed is higher than limit
-                    cmd = "{N1 P" + str(self.pwm_1) + "}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
-                    return
-                else: # self.pwm_1 == self.MAX_PWM, so self.pwm_2 == self.MAX_PWM too
-                    if self.pwm_2 == 0 or abs(self.pwm_2) == DEPART_PWM: # reached max turning limit
-                        return
-                    if abs(self.pwm_2) < DEPART_PWM:
-                        self.pwm_2 = -DEPART_PWM
-                    else:
-                        self.pwm_2 += accel  # slower a little the other motor
-                    cmd = "{N2 P" + str(self.pwm_2) + "}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
-                    return
-
-
-    def turn_left(self, direction, accel): # turn right, so only one motor rotate at a time  |pwm_1| > |pwm_2|
-        # --- if system is standstill, moving for/back
-        if self.pwm_1 == self.pwm_2:
-            # --- standstill
-            if abs(self.pwm_2) < STOP_PWM : 
-                if direction: # if moving forward
-                    self.pwm_2 = DEPART_PWM
-                else: # if moving backward
-                    self.pwm_2 = -DEPART_PWM
-                cmd = "{N2 P" + str(self.pwm_2) + "}" # {N1 P500} - set speed for pwm
-                self.__send(cmd) # format and send to the driver
-                return
-            # --- moving forward
-            elif self.pwm_2 > STOP_PWM : # absolutely > 0
-                if self.pwm_2 < self.MAX_PWM:
-                    self.pwm_2 += accel # faster a little bit
-                    cmd = "{N2 P" + str(self.pwm_2) + "}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
-                    return
-                elif self.pwm_2 > self.MAX_PWM:
-                    self.pwm_1 = self.pwm_2 = self.MAX_PWM # protection if real speed is higher than limit
-                    cmd = "{N0 P" + str(self.pwm_2) + "}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
-                    time.sleep(0.001) # stablize time
-                    cmd = "{N3 P0}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
-                    time.sleep(0.001) # stablize time
-                    cmd = "{N4 P0}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
-                    return
-                else: # self.pwm_2 == self.MAX_PWM, so self.pwm_1 == self.MAX_PWM too
-                    self.pwm_1 -= accel  # slower a little the other motor
-                    cmd = "{N1 P" + str(self.pwm_1) + "}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
-                    return
-            # --- moving backward
-            else : # self.pwm_2 < -STOP_PWM
-                if self.pwm_2 > -self.MAX_PWM:
-                    self.pwm_2 -= accel # faster a little bit
-                    cmd = "{N2 P" + str(self.pwm_2) + "}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
-                    return
-                elif self.pwm_2 < -self.MAX_PWM:
-                    self.pwm_1 = self.pwm_2 = -self.MAX_PWM # protection if real speed is higher than limit
-                    cmd = "{N0 P" + str(self.pwm_2) + "}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
-                    time.sleep(0.001) # stablize time
-                    cmd = "{N3 P0}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
-                    time.sleep(0.001) # stablize time
-                    cmd = "{N4 P0}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
-                    return
-                else: # self.pwm_2 == -self.MAX_PWM, so self.pwm_1 == -self.MAX_PWM too
-                    self.pwm_1 += accel  # slower a little the other motor
-                    cmd = "{N1 P" + str(self.pwm_1) + "}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
-                    return
-        # --- if system is turning right instead, then make the left wheel faster
-        elif abs(self.pwm_1) > abs(self.pwm_2):
-            if abs(self.pwm_1-self.pwm_2) < MINIMUM_DIF:
-                self.pwm_2 = self.pwm_1
-            elif self.pwm_2 < self.pwm_1: # postitive value
-                self.pwm_2 += accel # faster a little bit to make it fast enough with the other
-            else: # self.pwm_2 > self.pwm_1, negative value
-                self.pwm_2 -= accel # faster a little bit to make it fast enough with the other
-            cmd = "{N2 P" + str(self.pwm_2) + "}" # {N1 P500} - set speed for pwm
-            self.__send(cmd) # format and send to the driver
-            return
-        # --- if system is really turning left
-        else: # abs(self.pwm_1) < abs(self.pwm_2)
-            if self.pwm_2 > self.pwm_1: # positive value
-                if self.pwm_2 < self.MAX_PWM:
-                    self.pwm_2 += accel # faster a little bit
-                    cmd = "{N2 P" + str(self.pwm_2) + "}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
-                    return
-                elif self.pwm_2 > self.MAX_PWM:
-                    self.pwm_2 = self.MAX_PWM # protection if real speed is higher than limit
-                    cmd = "{N2 P" + str(self.pwm_2) + "}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
-                    return
-                else: # self.pwm_2 == self.MAX_PWM, so self.pwm_1 == self.MAX_PWM too
-                    if self.pwm_1 == 0 or abs(self.pwm_1) == DEPART_PWM: # reached max turning limit
-                        return
-                    if abs(self.pwm_1) < DEPART_PWM:
-                        self.pwm_1 = DEPART_PWM
-                    else:
-                        self.pwm_1 -= accel  # slower a little the other motor
-                    cmd = "{N1 P" + str(self.pwm_1) + "}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
-                    return
-            else: # self.pwm_2 < self.pwm_1, negative value
-                if self.pwm_2 > -self.MAX_PWM:
-                    self.pwm_2 -= accel # faster a little bit
-                    cmd = "{N2 P" + str(self.pwm_2) + "}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
-                    return
-                elif self.pwm_2 < -self.MAX_PWM:
-                    self.pwm_2 = -self.MAX_PWM # protection if real speed is higher than limit
-                    cmd = "{N2 P" + str(self.pwm_2) + "}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
-                    return
-                else: # self.pwm_2 == self.MAX_PWM, so self.pwm_1 == self.MAX_PWM too
-                    if self.pwm_1 == 0 or abs(self.pwm_1) == DEPART_PWM: # reached max turning limit
-                        return
-                    if abs(self.pwm_1) < DEPART_PWM:
-                        self.pwm_1 = -DEPART_PWM
-                    else:
-                        self.pwm_1 += accel  # slower a little the other motor
-                    cmd = "{N1 P" + str(self.pwm_1) + "}" # {N1 P500} - set speed for pwm
-                    self.__send(cmd) # format and send to the driver
-                    return
+        self.__drive(TURN_RIGHT, accel, direction)
+
+    def turn_left(self, direction, accel): # turn left, so only one motor rotate at a time  |pwm_2| > |pwm_1|
+        self.__drive(TURN_LEFT, accel, direction)
 
 
 class MotorUART_PID(object):
@@ -10,11 +10,61 @@
  *
  * ref: https://www.robot-electronics.co.uk/htm/srf05tech.htm
  *
+ * A background thread reads the frames of the Nano as they come
+ * and keeps the newest one with its monotonic timestamp, so read()
+ * never waits for the serial port. A sample older than STALE_TIME
+ * (Nano hung or unplugged) is flagged by stale().
+ * Every sample also goes into history, for filtered readings.
+ *
+ * Two frame formats are understood, mixed in the same stream:
+ * - ASCII: "d1 d2 d3 d4 d5 d6 \n", what the Nano sends by default.
+ * - binary: FRAME_SYNC, seq, 6 x uint16 LE distances, CRC8 of
+ *   seq + distances (poly 0x07), 15 bytes instead of ~30.
+ * Once the Nano is found, BINARY_REQUEST is sent to it. A firmware
+ * that knows it switches to binary frames, an older one ignores it
+ * and keeps talking ASCII. Binary frames failing the CRC are counted
+ * and dropped, the parser resyncs on the next FRAME_SYNC. Bytes
+ * that can't start an ASCII frame are skipped up to the next
+ * FRAME_SYNC, without waiting for a newline. Run this file
+ * (UVROBOT_BACKEND=sim python3 -m usb_peripherals.ultrasonics,
+ * from main/) to check the resync on damaged binary streams.
+ *
  --------------------------------------------------------------"""
+from array import array
 import os
 import serial
 import struct
+import threading
 import time
+from usb_peripherals.history import SensorHistory
+
+CHANNELS = 6 # the Nano sends 6 distances in cm per line
+STALE_TIME = 0.25 # secs - the Nano sends a frame every ~30ms, so this is several frames missed
+FRAME_SYNC = 0xA5 # never found in an ASCII frame
+FRAME = struct.Struct('<BB%dHB' % CHANNELS) # sync, seq, distances, crc8
+BINARY_REQUEST = b'B' # ask the Nano for binary frames, b'A' goes back to ASCII
+REQUEST_EVERY = 100 # ASCII frames between two BINARY_REQUEST
+MAX_LINE = 64 # bytes - longer ASCII garbage without a newline is dropped
+ASCII_LINE = b'0123456789 -\r\t' # bytes of an ASCII frame before its newline, anything else is binary or noise
+READ_JOIN_TIME = 2.5 # secs - clean() waits for the reader thread, longer than the read timeout
+
+
+def _crc8_table(poly=0x07):
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ poly) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return bytes(table)
+
+CRC8_TABLE = _crc8_table()
+
+def crc8(data): # CRC-8/SMBUS, same as crc8() in nano_transmitter.ino
+    crc = 0
+    for byte in data:
+        crc = CRC8_TABLE[crc ^ byte]
+    return crc
 
 
 millis = lambda: int(time.time() * 1000)
@@ -27,17 +77,42 @@ class Ultrasonics(object):
     UART serial connection via PySerial.
     """
 
-    def __init__(self, baudRate=9600):
+    def __init__(self, baudRate=9600, port=None):
         """
         Constructor
-        @param port: a string dedicated to the connected device
         @param baudRate: an integer indicates the connection spped
+        @param port: a string dedicated to the connected device, or None to look for it
         """
         if baudRate < 9600 or baudRate > 1000000:
             raise ValueError('The given baudrate is invalid!')
 
         self.port = '/dev/ttyUSB0'
+        self.__serial = None
+        self.__values = array('i', [0] * CHANNELS) # newest sample, written in place by the reader thread
+        self.__stamp = None # time.monotonic() of the newest sample
+        self.__lock = threading.Lock()
+        self.__running = True
+        self.__reader = None
+        self.history = SensorHistory(CHANNELS) # last frames, filtered views for the control loop
+        self.frames = 0 # number of samples received
+        self.bad_frames = 0 # number of lines that couldn't be parsed or binary frames failing the CRC
+        self.lost_frames = 0 # binary frames missing from the sequence numbers
+        self.binary = False # True once the Nano answered BINARY_REQUEST
+        self.tap = None # callable(values) seeing every sample, on the reader thread, e.g. a recorder
+        self.__seq = None # sequence number of the last binary frame
         try:
+            if port is not None: # already found by usb_peripherals.discovery, no need to probe
+                self.port = port
+                print(self.port)
+                self.__serial = serial.Serial(port=self.port,
+                                            baudrate=baudRate,
+                                            bytesize=serial.EIGHTBITS,
+                                            timeout=2
+                                            )
+                print("Ultrasonic ready!")
+                self.__start()
+                return
+
             for i in range(0,2):
                 
                 self.port = self.port[:11] + str(i)
@@ -54,8 +129,9 @@ class Ultrasonics(object):
                     self.__serial.close()
                 self.__serial.open()
 
-                if len(self.read()) is 7:
+                if len(self.__probe()) is 7:
                     print("Ultrasonic ready!")
+                    self.__start()
                     return
                 
                 self.__serial.close()
@@ -66,11 +142,182 @@ class Ultrasonics(object):
             print("No sensor is connected! Please check your wiring")
             return
         
-    def read(self):
+    def __start(self):
+        self.__request()
+        self.__reader = threading.Thread(target=self.__ingest)
+        self.__reader.daemon = True
+        self.__reader.start()
+
+    def __request(self): # ask for binary frames, ignored by an ASCII only firmware
+        try:
+            self.__serial.write(BINARY_REQUEST)
+        except (serial.SerialException, OSError) as e:
+            print(e)
+
+    def __probe(self): # blocking read of one line, only used to find the port of the Nano
         try:
             self.__serial.flushInput()
             data = self.__serial.readline().decode('utf-8').split(" ")
             return data
         except:
-            return [999,999,999,999,999,999] # return for not connected
+            return []
+
+    def __ingest(self): # reader thread: parse every frame into the latest-sample cache
+        buffer = bytearray()
+        while self.__running:
+            try:
+                data = self.__serial.read(self.__serial.in_waiting or 1) # waits for a byte up to the timeout
+            except Exception as e:
+                if not self.__running: # clean() closed the port under the read
+                    return
+                if not isinstance(e, (serial.SerialException, OSError)):
+                    raise
+                print('Ultrasonic reader stopped:', e) # unplugged, samples will go stale
+                return
+            if data:
+                self.__feed(buffer, data)
+
+    def __feed(self, buffer, data): # add the bytes read to buffer, publish its complete frames
+        buffer += data
+        del buffer[:self.__parse(buffer)]
+        if len(buffer) > MAX_LINE: # no frame boundary in sight
+            self.bad_frames += 1
+            del buffer[:]
+
+    def __parse(self, buffer): # publish every complete frame of buffer, return the number of bytes used
+        pos = 0
+        end = len(buffer)
+        with memoryview(buffer) as view:
+            while pos < end:
+                if buffer[pos] == FRAME_SYNC: # binary frame
+                    if end - pos < FRAME.size:
+                        break
+                    frame = FRAME.unpack_from(view, pos)
+                    if crc8(view[pos + 1:pos + FRAME.size - 1]) != frame[-1]:
+                        self.bad_frames += 1
+                        pos += 1 # resync on the next FRAME_SYNC
+                        continue
+                    self.__publish(frame[2:-1], frame[1])
+                    pos += FRAME.size
+                    continue
+                newline = buffer.find(b'\n', pos) # ASCII frame
+                if newline < 0:
+                    pending = bytes(view[pos:end])
+                    if not pending.translate(None, ASCII_LINE): # the start of a line, wait for its end
+                        break
+                    sync = buffer.find(FRAME_SYNC, pos + 1)
+                    if sync >= 0: # the tail of a broken binary frame, or noise
+                        pos = sync
+                        continue
+                    pos += len(pending.rstrip(ASCII_LINE)) # keep what may still start a line
+                    break
+                sync = buffer.find(FRAME_SYNC, pos, newline)
+                if sync >= 0: # skip the tail of a broken frame up to the binary one
+                    pos = sync
+                    continue
+                try:
+                    fields = [int(field) for field in bytes(view[pos:newline]).split()]
+                except ValueError:
+                    fields = None
+                if fields is None or len(fields) != CHANNELS: # partial or corrupted line
+                    self.bad_frames += 1
+                else:
+                    self.__publish(fields, None)
+                pos = newline + 1
+        return pos
+
+    def __publish(self, fields, seq): # store a sample, seq is None for ASCII frames
+        if seq is not None:
+            if self.__seq is not None:
+                self.lost_frames += (seq - self.__seq - 1) & 0xFF
+            self.__seq = seq
+            self.binary = True
+        elif self.frames % REQUEST_EVERY == REQUEST_EVERY - 1: # the request may have been lost while the Nano booted
+            self.__request()
+        now = time.monotonic()
+        if self.__stamp is not None and now - self.__stamp > STALE_TIME: # don't filter across a gap
+            self.history.clear()
+        self.history.push(fields)
+        if self.tap is not None:
+            self.tap(fields)
+        values = self.__values
+        with self.__lock:
+            for i, value in enumerate(fields):
+                values[i] = value
+            self.__stamp = now
+        self.frames += 1
+
+    def read(self): # (newest sample, its age in secs), never blocks. The age is infinite if nothing came yet
+        with self.__lock:
+            stamp = self.__stamp
+            values = tuple(self.__values)
+        if stamp is None:
+            return values, float('inf')
+        return values, time.monotonic() - stamp
+
+    def age(self): # secs since the newest sample
+        return self.read()[1]
+
+    def stale(self): # True if the sample is too old to be trusted, act on it instead of using the values
+        return self.age() > STALE_TIME
+
+    def clean(self): # stop the reader thread, then close the port
+        self.__running = False
+        if self.__reader is not None:
+            try:
+                self.__serial.cancel_read() # out of the blocking read at once
+            except (AttributeError, serial.SerialException, OSError): # not on every platform
+                pass
+            self.__reader.join(READ_JOIN_TIME)
+            self.__reader = None
+        if self.__serial is not None and self.__serial.isOpen():
+            self.__serial.close()
+
+
+if __name__ == '__main__': # binary frames with corrupted, dropped and split bytes: every later good frame is recovered
+    import contextlib
+    import io
+    import random
+
+    def binary(seq, fields):
+        body = struct.pack('<B%dH' % CHANNELS, seq & 0xFF, *fields)
+        return bytes([FRAME_SYNC]) + body + bytes([crc8(body)])
+
+    def run(stream, chunks, rng): # feed the stream in chunks of random sizes, as the reader thread would
+        with contextlib.redirect_stdout(io.StringIO()):
+            sensor = Ultrasonics(port='/dev/null/none') # can't be opened: no reader thread, everything else is set
+        received = []
+        sensor.tap = lambda fields: received.append(list(fields))
+        buffer = bytearray()
+        pos = 0
+        while pos < len(stream):
+            size = rng.choice(chunks)
+            sensor._Ultrasonics__feed(buffer, stream[pos:pos + size])
+            pos += size
+        return received, sensor
 
+    rng = random.Random(12)
+    frames = [binary(seq, [rng.choice((0x0B, 0x20, 0x1A5, 0x3E7)) if rng.random() < 0.3 else rng.randrange(2, 400)
+                           for _ in range(CHANNELS)]) for seq in range(400)]
+    no_newline = [frame for frame in frames if b'\n' not in frame][:200]
+    for name, frames, chunks, damage in (('clean', frames[:200], (1,), {}),
+                                         ('dropped byte, no newline', no_newline, (1,), {5: 'drop'}),
+                                         ('corrupted, dropped, split', frames[:200], (1, 2, 7, 15, 40),
+                                          {3: 'flip', 50: 'drop', 51: 'drop', 120: 'cut', 121: 'drop'})):
+        stream = bytearray()
+        for i, frame in enumerate(frames):
+            frame = bytearray(frame)
+            if damage.get(i) == 'flip':
+                frame[6] ^= 0x10
+            elif damage.get(i) == 'drop':
+                del frame[rng.randrange(1, len(frame))]
+            elif damage.get(i) == 'cut': # the Nano reset in the middle of a frame
+                del frame[rng.randrange(1, len(frame)):]
+            stream += frame
+        received, sensor = run(bytes(stream), chunks, rng)
+        expected = [list(FRAME.unpack(frame)[2:-1]) for i, frame in enumerate(frames) if i not in damage]
+        assert received == expected, '%s: %d of %d frames' % (name, len(received), len(expected))
+        print('%-26s %d frames, %d bad, %d lost' % (name, len(received), sensor.bad_frames, sensor.lost_frames))
+    received, sensor = run(b'12 30 999 40 55 7 \n' * 3 + frames[0] + b'1 2 3 4 5 6 \n', (1, 3), rng)
+    assert len(received) == 5 and not sensor.bad_frames, 'ASCII and binary in one stream'
+    print('Ultrasonic parser OK')
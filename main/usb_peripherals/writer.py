@@ -0,0 +1,141 @@
+"""------------------------------------------------------------*-
+  Background serial writer module
+ --------------------------------------------------------------
+ * Moves serial writes off the control thread, so a stalled
+ * USB-serial adapter can't stall the control loop.
+ *
+ * - Frames go into a bounded ring. When it is full the oldest
+ *   frame is overwritten (and counted): only the newest
+ *   commands matter for a motor.
+ * - Urgent frames (stop all motors) jump the queue and flush
+ *   everything queued before them.
+ * - Priority frames (stop one motor) jump the queue too, and are
+ *   queued again behind what is already there, so no older frame
+ *   can undo them.
+ * - The writer keeps the pacing gap the device needs between
+ *   two writes and gives up on a write after the serial
+ *   write_timeout, counting it as an error.
+ *
+ --------------------------------------------------------------"""
+import collections
+import serial
+import threading
+import time
+
+QUEUE_DEPTH = 8 # frames, that's 80ms of commands at a 10ms control tick
+
+
+class SerialWriter(threading.Thread):
+    """
+    A python written background writer for a PySerial connection.
+
+    """
+    def __init__(self, connection, gap=0.001, depth=QUEUE_DEPTH, send_stats=None, latency_stats=None):
+        """
+        Constructor
+        @param connection: an opened serial.Serial, with write_timeout set
+        @param gap: a float in secs, minimum time between two writes
+        @param depth: an integer indicates the size of the ring
+        @param send_stats: a monitor.Histogram for the duration of each write, or None
+        @param latency_stats: a monitor.Histogram for the time from put() to written, or None
+        """
+        super().__init__()
+        self.daemon = True
+        self.connection = connection
+        self.gap = gap
+        self.send_stats = send_stats
+        self.latency_stats = latency_stats
+
+        self.__ring = collections.deque(maxlen=depth)
+        self.__urgent = collections.deque()
+        self.__cond = threading.Condition()
+        self.__running = True
+        self.__busy = False # a frame has been taken out of the ring but not written yet
+
+        self.max_depth = 0
+        self.overwritten = 0 # frames dropped because the ring was full
+        self.flushed = 0 # frames dropped because an urgent frame superseded them
+        self.errors = 0 # writes that timed out or failed
+        self.last_write = time.monotonic() # time of the last successful write, the port was just opened
+        self.tap = None # callable(frame) seeing every frame queued, in queue order, e.g. a recorder
+
+    def depth(self): # number of frames waiting
+        return len(self.__ring) + len(self.__urgent)
+
+    def put(self, frame): # queue a frame (bytes), never blocks
+        with self.__cond:
+            ring = self.__ring
+            if len(ring) == ring.maxlen:
+                self.overwritten += 1
+            ring.append((frame, time.monotonic()))
+            if len(ring) > self.max_depth:
+                self.max_depth = len(ring)
+            if self.tap is not None:
+                self.tap(frame)
+            self.__cond.notify_all()
+
+    def put_urgent(self, frame): # send before anything else, dropping what is queued
+        with self.__cond:
+            self.flushed += len(self.__ring)
+            self.__ring.clear()
+            self.__urgent.append((frame, time.monotonic()))
+            if self.tap is not None:
+                self.tap(frame)
+            self.__cond.notify_all()
+
+    def put_priority(self, frame): # send before anything else, and again after what is queued
+        with self.__cond:
+            now = time.monotonic()
+            self.__urgent.append((frame, now))
+            ring = self.__ring
+            if len(ring) == ring.maxlen:
+                self.overwritten += 1
+            ring.append((frame, now))
+            if self.tap is not None:
+                self.tap(frame)
+            self.__cond.notify_all()
+
+    def drain(self, timeout=1): # wait until everything queued has been written
+        deadline = time.monotonic() + timeout
+        with self.__cond:
+            while (self.__ring or self.__urgent or self.__busy) and time.monotonic() < deadline:
+                self.__cond.wait(0.01)
+
+    def stop(self):
+        with self.__cond:
+            self.__running = False
+            self.__cond.notify_all()
+
+    def run(self):
+        last_write = 0
+        while True:
+            with self.__cond:
+                while self.__running and not self.__ring and not self.__urgent:
+                    self.__cond.wait()
+                if not self.__running:
+                    return
+                if self.__urgent:
+                    frame, queued = self.__urgent.popleft()
+                else:
+                    frame, queued = self.__ring.popleft()
+                self.__busy = True
+
+            wait = last_write + self.gap - time.monotonic()
+            if wait > 0: # the device needs a short gap between two writes
+                time.sleep(wait)
+            start = time.monotonic()
+            try:
+                self.connection.write(frame)
+                self.last_write = time.monotonic()
+            except (serial.SerialTimeoutException, serial.SerialException, OSError) as e:
+                self.errors += 1
+                print('Serial write failed:', e)
+            last_write = time.monotonic()
+            if self.send_stats is not None:
+                self.send_stats.record(last_write - start)
+            if self.latency_stats is not None:
+                self.latency_stats.record(last_write - queued)
+
+            with self.__cond:
+                self.__busy = False
+                self.__cond.notify_all()